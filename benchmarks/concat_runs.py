@@ -0,0 +1,66 @@
+"""
+Benchmark combining the data frames of many course runs.
+
+Compares growing a data frame one run at a time (what `DataFrame.append` in 
+a loop did) with collecting the run data frames and calling `pd.concat` once,
+reporting the time and peak memory for each number of runs.
+
+Usage::
+
+    python benchmarks/concat_runs.py [rows per run]
+"""
+
+import sys
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from time import perf_counter
+
+RUN_COUNTS = [5, 10, 20, 40, 60]
+
+def make_run(run, rows):
+    # a data frame shaped like the step_activity dataset
+    return pd.DataFrame({
+        "course": "programming-101",
+        "run": run,
+        "learner_id": np.arange(rows).astype(str),
+        "step": "1.1",
+        "week_number": np.random.randint(1, 5, rows),
+        "step_number": np.random.randint(1, 20, rows),
+        "first_visited_at": "2020-01-01 10:00:00 UTC",
+        "last_completed_at": "2020-01-01 10:05:00 UTC",
+    })
+
+def grow(runs):
+    df = None
+    for run_df in runs:
+        if df is None:
+            df = run_df
+        else:
+            df = pd.concat([df, run_df], ignore_index=True)
+    return df
+
+def concat_once(runs):
+    return pd.concat(runs, ignore_index=True)
+
+def measure(func, runs):
+    tracemalloc.start()
+    start = perf_counter()
+    func(runs)
+    duration = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 1024 / 1024
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print("rows per run: {}".format(rows))
+    print("{:>5} {:>12} {:>12} {:>12} {:>12}".format("runs", "grow (s)", "grow (MB)", "concat (s)", "concat (MB)"))
+    for run_count in RUN_COUNTS:
+        runs = [make_run(run, rows) for run in range(1, run_count + 1)]
+        grow_time, grow_memory = measure(grow, runs)
+        concat_time, concat_memory = measure(concat_once, runs)
+        print("{:>5} {:>12.3f} {:>12.1f} {:>12.3f} {:>12.1f}".format(run_count, grow_time, grow_memory, concat_time, concat_memory))
@@ -0,0 +1,97 @@
+"""
+Benchmark parsing the organisation's admin runs page.
+
+Compares the original parser (a multiline `re.findall` followed by 5 more
+`re.search` calls for each run) with `fl_data_downloader.parsers.parse_runs_page`
+(a single precompiled pattern, which also types the columns), the speedup is
+the original time divided by the new time. The time taken to parse the page 
+with BeautifulSoup, which the browser also did for every page before 0.5.0, 
+is shown in its own column and isn't included in the speedup. The new parser
+also creates the typed columns, a fixed cost of about 1ms, so it is no
+quicker than the original for pages with fewer than about 100 runs. The runs 
+in the saved page are repeated to make pages with more runs.
+
+Usage::
+
+    python benchmarks/parse_runs_page.py [saved runs page]
+
+The saved page defaults to benchmarks/fixtures/runs_page.html.
+"""
+
+import os
+import re
+import sys
+
+import pandas as pd
+
+from bs4 import BeautifulSoup
+from time import perf_counter
+
+from fl_data_downloader.parsers import parse_runs_page
+
+RUN_COUNTS = [100, 1000, 5000]
+
+REPEATS = 5
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "runs_page.html")
+
+def parse_runs_page_original(content):
+    # the parser used before 0.5.0
+    course_runs = []
+    
+    courses = re.findall(b"course-meta__title(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)data-order(.+?)\n(.+?)\n",content)
+
+    for each in courses:
+        url_name = re.search(b'/courses/(.+?)/',each[0]).group(0).decode("utf-8")[:-1][9:]
+        full_name = re.search(b'">(.+?)</a>',each[0]).group(0).decode("utf-8")[:-4][2:]
+        run = int(re.search(b'/courses/(.+?)/(.+?)">',each[0]).group(0).decode("utf-8")[:-2].split("/")[-1])
+        start_date = re.search(b"'(.+?)'",each[8]).group(0)[1:][:-1].decode("utf-8")
+        status = re.search(b'flag--(.+?)>(.+?)<',each[5]).group(0)[:-1].decode("utf-8").split(">")[1]
+
+        course_runs.append([url_name, full_name, run, start_date, status])
+
+    return pd.DataFrame(course_runs, columns=["course", "full_name", "run", "start_date", "status"])
+
+def parse_soup(content):
+    return BeautifulSoup(content, "lxml").find_all("a", class_="course-meta__title")
+
+def make_page(content, run_count):
+    # repeat the runs in a saved page, giving each copy new run numbers
+    start = content.index(b"<!-- run -->")
+    end = content.index(b"<!-- end runs -->")
+    runs = content[start:end].split(b"<!-- run -->")[1:]
+
+    rows = []
+    for i in range(run_count):
+        run = runs[i % len(runs)]
+        rows.append(re.sub(rb"(/admin/courses/[^/]+/)(\d+)", lambda m: m.group(1) + str(1000 + i).encode("utf-8"), run))
+
+    return content[:start] + b"<!-- run -->".join([b""] + rows) + content[end:]
+
+def time_parser(parser, content):
+    best = None
+    for _ in range(REPEATS):
+        start = perf_counter()
+        df = parser(content)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(df)
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE
+    with open(path, "rb") as page_file:
+        content = page_file.read()
+
+    print("{:>6} {:>10} {:>10} {:>10} {:>8}".format("runs", "soup", "original", "parsers", "speedup"))
+    for run_count in RUN_COUNTS:
+        page = make_page(content, run_count)
+        soup_time, soup_rows = time_parser(parse_soup, page)
+        original_time, original_rows = time_parser(parse_runs_page_original, page)
+        new_time, new_rows = time_parser(parse_runs_page, page)
+        assert original_rows == new_rows == soup_rows, "the parsers found a different number of runs"
+
+        print("{:>6} {:>9.1f}ms {:>9.1f}ms {:>9.1f}ms {:>7.1f}x".format(
+            run_count, soup_time * 1000, original_time * 1000, new_time * 1000, original_time / new_time))
+
+if __name__ == "__main__":
+    main()
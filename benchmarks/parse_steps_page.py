@@ -0,0 +1,100 @@
+"""
+Benchmark parsing a run's admin overview page for its steps.
+
+Compares the original parser (a `re.findall` over the page for each of the
+10 types of step, then another `re.findall` on each step) with 
+`fl_data_downloader.parsers.parse_steps_page` (a single precompiled pattern
+which finds all the types of step in one pass and creates typed columns,
+which the original left to pandas when the data was next read). Creating
+the typed columns is a fixed cost of about 1ms, so the new parser is only 
+quicker for pages with more than about 100 steps. The steps in the saved 
+page are repeated to make pages with more steps.
+
+Usage::
+
+    python benchmarks/parse_steps_page.py [saved overview page]
+
+The saved page defaults to benchmarks/fixtures/steps_page.html.
+"""
+
+import os
+import re
+import sys
+
+import pandas as pd
+
+from time import perf_counter
+
+from fl_data_downloader.parsers import parse_steps_page
+
+STEP_COUNTS = [50, 100, 200, 1000, 10000]
+
+REPEATS = 5
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "steps_page.html")
+
+def parse_steps_page_original(raw_page, course, run):
+    # the parser used before 0.5.0
+    search_keys = {
+        "video-articles":b'video-articles/(.+?)VI',
+        "discussions":b'discussions/(.+?)DI',
+        "articles":b'/articles/(.+?)AR',
+        "quizzes":b'quizzes/(.+?)QU',
+        "exercises":b'exercises/(.+?)EX',
+        "assignments":b'assignments/(.+?)AS',
+        "assignment_reviews":b'assignment_reviews/(.+?)RV',
+        "assignment_reflections":b'assignment_reflections/(.+?)RE',
+        "poll_articles":b'poll-articles/(.+?)PL',
+        "audio_articles":b'audio-articles/(.+?)AU',
+        }
+
+    run_steps = []
+    for key in search_keys:
+        raw_steps = re.findall(search_keys[key],raw_page)               
+        for raw_step in raw_steps:
+            step_info = re.findall("(\\d+)",raw_step.decode('utf-8'))
+            admin_url = "https://www.futurelearn.com/admin/{}/{}".format(key,step_info[0])
+
+            step_id = step_info[1] + "." + step_info[2].zfill(2)
+            week = step_info[1]
+            step = step_info[2]
+            step_type = key[:-1]
+            run_steps.append([course, run, step_id, week, step, admin_url, step_type])
+
+    return pd.DataFrame(run_steps, columns=["course", "run", "step_id", "week", "step", "admin_url", "step_type"])
+
+def make_page(content, step_count):
+    # repeat the steps in a saved page
+    start = content.index(b"<!-- steps -->")
+    end = content.index(b"<!-- end steps -->")
+    steps = [line for line in content[start:end].split(b"\n") if b"/admin/" in line]
+
+    rows = [steps[i % len(steps)] for i in range(step_count)]
+    return content[:start] + b"\n".join(rows) + b"\n" + content[end:]
+
+def time_parser(parser, content):
+    best = None
+    for _ in range(REPEATS):
+        start = perf_counter()
+        df = parser(content, "programming-101", 1)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE
+    with open(path, "rb") as page_file:
+        content = page_file.read()
+
+    print("{:>6} {:>10} {:>10} {:>8}".format("steps", "original", "parsers", "speedup"))
+    for step_count in STEP_COUNTS:
+        page = make_page(content, step_count)
+        original_time, original_df = time_parser(parse_steps_page_original, page)
+        new_time, new_df = time_parser(parse_steps_page, page)
+        assert sorted(original_df["admin_url"]) == sorted(new_df["admin_url"]), "the parsers found different steps"
+
+        print("{:>6} {:>9.1f}ms {:>9.1f}ms {:>7.1f}x".format(
+            step_count, original_time * 1000, new_time * 1000, original_time / new_time))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark reading a slice of a dataset from the cache.
+
+Compares reading every run in full, combining them and then filtering (what
+`get_dataset_for_courses` followed by filtering does) with reading each run
+with the columns and filters pushed into the cache reader (what
+`FutureLearnData.query` does), reporting the time and peak memory for the
+csv and parquet cache formats.
+
+Usage::
+
+    python benchmarks/query_pushdown.py [rows per run]
+"""
+
+import sys
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from time import perf_counter
+
+from fl_data_downloader.cache import CacheManager
+from fl_data_downloader.schemas import apply_schema
+
+RUN_COUNT = 20
+
+COLUMNS = ["course", "run", "learner_id", "step", "last_completed_at"]
+
+FILTERS = [("week_number", "==", 1)]
+
+def make_run(run, rows):
+    # a data frame shaped like the step_activity dataset
+    return apply_schema(pd.DataFrame({
+        "course": "programming-101",
+        "run": run,
+        "learner_id": np.arange(rows).astype(str),
+        "step": "1.1",
+        "week_number": np.random.randint(1, 7, rows),
+        "step_number": np.random.randint(1, 20, rows),
+        "first_visited_at": "2020-01-01 10:00:00 UTC",
+        "last_completed_at": "2020-01-01 10:05:00 UTC",
+    }), "step_activity")
+
+def read_then_filter(cache_manager):
+    dfs = [cache_manager.get_data("raspberry-pi", "programming-101", run, "step_activity") for run in range(1, RUN_COUNT + 1)]
+    df = pd.concat(dfs, ignore_index=True)
+    return df[df["week_number"] == 1][COLUMNS]
+
+def pushdown(cache_manager):
+    dfs = [cache_manager.get_data("raspberry-pi", "programming-101", run, "step_activity", columns=COLUMNS, filters=FILTERS) for run in range(1, RUN_COUNT + 1)]
+    return pd.concat(dfs, ignore_index=True)
+
+def measure(func, cache_manager):
+    tracemalloc.start()
+    start = perf_counter()
+    rows = len(func(cache_manager))
+    duration = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak / 1024 / 1024, rows
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    results = []
+    for cache_format in ["csv", "parquet"]:
+        cache_manager = CacheManager(tempfile.mkdtemp(), True, format=cache_format, memory_cache=False)
+        for run in range(1, RUN_COUNT + 1):
+            cache_manager.save_data(make_run(run, rows), "raspberry-pi", "programming-101", run, "step_activity")
+
+        full_time, full_memory, full_rows = measure(read_then_filter, cache_manager)
+        pushdown_time, pushdown_memory, pushdown_rows = measure(pushdown, cache_manager)
+        assert full_rows == pushdown_rows, "the reads returned a different number of rows"
+        results.append((cache_format, full_time, full_memory, pushdown_time, pushdown_memory))
+
+    print("runs: {}, rows per run: {}".format(RUN_COUNT, rows))
+    print("{:>8} {:>12} {:>12} {:>14} {:>14}".format("format", "full (s)", "full (MB)", "pushdown (s)", "pushdown (MB)"))
+    for cache_format, full_time, full_memory, pushdown_time, pushdown_memory in results:
+        print("{:>8} {:>12.3f} {:>12.1f} {:>14.3f} {:>14.1f}".format(cache_format, full_time, full_memory, pushdown_time, pushdown_memory))
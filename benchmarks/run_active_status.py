@@ -0,0 +1,72 @@
+"""
+Benchmark finding whether every run of an organisation is active.
+
+Compares the original lookup (filtering the runs data frame with 2 boolean
+masks for each run) with the run index built by `FutureLearnData` when the
+runs are loaded, and with `_are_runs_active`, which calculates the status of
+all the runs at once as `get_runs_active_status` does.
+
+Usage::
+
+    python benchmarks/run_active_status.py
+"""
+
+import pandas as pd
+
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from fl_data_downloader.data import COURSE_RUN_INACTIVE_AFTER, _index_runs, _are_runs_active
+from fl_data_downloader.schemas import apply_schema
+
+RUN_COUNTS = [100, 1000, 5000]
+
+REPEATS = 3
+
+def make_runs(run_count):
+    # runs of 10 courses, starting a week apart
+    runs = []
+    start = datetime(2015, 1, 5)
+    for i in range(run_count):
+        runs.append(["course-{}".format(i % 10), "Course {}".format(i % 10), i // 10 + 1, start + timedelta(weeks=i), "finished"])
+    return apply_schema(pd.DataFrame(runs, columns=["course", "full_name", "run", "start_date", "status"]), "runs")
+
+def lookup_original(runs_df):
+    # the lookup used before 0.5.0, for every run
+    statuses = []
+    for course, run in zip(runs_df["course"], runs_df["run"]):
+        run_df = runs_df[(runs_df["course"] == course) & (runs_df["run"] == run)]
+        start_date = pd.Timestamp(run_df.iloc[0]["start_date"])
+        statuses.append(datetime.now() < start_date + timedelta(seconds=COURSE_RUN_INACTIVE_AFTER))
+    return statuses
+
+def lookup_index(runs_df):
+    run_index, course_runs = _index_runs(runs_df)
+    return [datetime.now() < run_index[(course, run)][2] for course, run in zip(runs_df["course"], runs_df["run"])]
+
+def lookup_vectorised(runs_df):
+    return _are_runs_active(runs_df["start_date"]).to_list()
+
+def time_lookup(lookup, runs_df):
+    best = None
+    for _ in range(REPEATS):
+        start = perf_counter()
+        statuses = lookup(runs_df)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, statuses
+
+def main():
+    print("{:>6} {:>10} {:>10} {:>11} {:>8}".format("runs", "original", "index", "vectorised", "speedup"))
+    for run_count in RUN_COUNTS:
+        runs_df = make_runs(run_count)
+        original_time, original = time_lookup(lookup_original, runs_df)
+        index_time, index = time_lookup(lookup_index, runs_df)
+        vectorised_time, vectorised = time_lookup(lookup_vectorised, runs_df)
+        assert original == index == vectorised, "the lookups found a different status"
+
+        print("{:>6} {:>9.1f}ms {:>9.1f}ms {:>10.1f}ms {:>7.1f}x".format(
+            run_count, original_time * 1000, index_time * 1000, vectorised_time * 1000, original_time / index_time))
+
+if __name__ == "__main__":
+    main()
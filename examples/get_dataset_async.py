@@ -0,0 +1,15 @@
+import asyncio
+from fl_data_downloader import AsyncFutureLearnData
+
+async def main():
+    async with AsyncFutureLearnData(organisation="raspberry-pi", max_connections=8) as fl:
+
+        # download the enrolments and step activity for all runs at the same time
+        enrolments_df, step_activity_df = await asyncio.gather(
+            fl.get_dataset_for_course(course="programming-101", dataset="enrolments"),
+            fl.get_dataset_for_course(course="programming-101", dataset="step_activity"))
+
+        print(enrolments_df)
+        print(step_activity_df)
+
+asyncio.run(main())
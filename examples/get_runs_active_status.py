@@ -0,0 +1,7 @@
+from fl_data_downloader import FutureLearnData
+
+fl = FutureLearnData("raspberry-pi")
+
+status_df = fl.get_runs_active_status(dataset="comments")
+
+print(status_df[status_df["active"]])
@@ -0,0 +1,16 @@
+import logging
+
+from fl_data_downloader import FutureLearnData, metrics
+
+# log the time taken by each request, parse and cache read or write
+logging.basicConfig(level=logging.DEBUG)
+
+fl = FutureLearnData("raspberry-pi", max_workers=4)
+fl.get_dataset_for_course("programming-101", "enrolments")
+
+# the seconds, bytes and rows of each stage and the counters e.g. retries
+print(metrics.get_summary())
+print(metrics.get_counters())
+
+# write the metrics to a JSON file for a monitoring system
+metrics.export_json("metrics.json")
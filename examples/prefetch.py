@@ -0,0 +1,8 @@
+from fl_data_downloader import FutureLearnData
+
+fl = FutureLearnData("raspberry-pi", max_workers=4)
+
+# refresh the expired enrolments and comments so they are read from the cache later
+results_df = fl.prefetch(datasets=["enrolments", "comments"])
+
+print(results_df)
@@ -0,0 +1,17 @@
+from datetime import datetime
+from fl_data_downloader import FutureLearnData, between
+
+fl = FutureLearnData("raspberry-pi")
+
+# the steps completed in the first week of January, only reading the columns needed
+query = fl.query("step_activity").where(
+    course=["programming-101", "programming-102"],
+    columns=["course", "run", "learner_id", "step", "last_completed_at"],
+    last_completed_at=between(datetime(2020, 1, 6), datetime(2020, 1, 13)))
+
+# which runs will be read from the cache and which downloaded
+print(query.plan())
+
+step_activity_df = query.to_data_frame()
+
+print(step_activity_df)
@@ -1,16 +1,11 @@
-import sqlite3
-from fl_data_downloader import FutureLearnData
+from fl_data_downloader import FutureLearnData, SqliteSink
 
-conn = sqlite3.connect("my_dataset.db")
+sink = SqliteSink("my_dataset.db")
 
 fl = FutureLearnData(organisation="raspberry-pi")
 
 df = fl.get_dataset_for_course(course="programming-101", dataset="enrolments")
 
-df.to_sql("enrolments", conn, if_exists="replace")
-
-conn.close()
-
-
-
+sink.write("enrolments", df)
 
+sink.close()
@@ -6,9 +6,41 @@ from .credentials import (
 from .data import (
     FutureLearnData,
     download_data,
+    prune_cache,
     AVAILABLE_DATASETS
 )
 
+from .asyncdata import AsyncFutureLearnData
+
+from .pipeline import download_all
+
+from .sinks import (
+    CsvSink,
+    SqliteSink,
+    DuckDBSink
+)
+
+from .retry import RetryPolicy
+
+from .cache import MemoryCache
+
+from .query import (
+    DatasetQuery,
+    between
+)
+
+from .instrumentation import (
+    Metrics,
+    Span,
+    metrics
+)
+
+from .connections import (
+    configure_http,
+    get_connection_stats,
+    DEFAULT_POOL_SIZE
+)
+
 from .exceptions import (
     NeedToLoginException, 
     DatasetNotKnownException, 
@@ -18,17 +50,38 @@ from .exceptions import (
 
 def fl_data_dl():
 
+    import sys
     from argparse import ArgumentParser
 
-    parser = ArgumentParser(description="FutureLearn Data Downloader")
+    # "fl-data-dl cache ..." manages the cache and "fl-data-dl warm ..." refreshes it rather than downloading data
+    if len(sys.argv) > 1 and sys.argv[1] == "cache":
+        return _cache_command(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "warm":
+        return _warm_command(sys.argv[2:])
+
+    parser = ArgumentParser(description="FutureLearn Data Downloader", epilog="Use [fl-data-dl cache stats] and [fl-data-dl cache prune] to manage the cache and [fl-data-dl warm] to refresh it.")
     parser.add_argument("organisation", help="The organisation you want to download data for.")
-    parser.add_argument("course", nargs='+', help="The course(s) you want to download data for.")
+    parser.add_argument("course", nargs='*', help="The course(s) you want to download data for.")
+    parser.add_argument("-a", "--all", help="Download data for all the organisation's courses.", action="store_true")
     parser.add_argument("-d", "--dataset", nargs='+',  help="The dataset(s) you wish to download data for:\n {}".format(", ".join(AVAILABLE_DATASETS)))
     parser.add_argument("-o", "--output", help="The output directory where the data files should be written, defaults to the current directory.")
     parser.add_argument("-l", "--login", help="Login and store FutureLearn credentials.", action="store_true")
     parser.add_argument("-V", "--version", help="Display the version number.", action="version", version="fl_data_downloader (0.4.3)")
     parser.add_argument("--no-cache", help="Disable the cache.", action="store_true")
+    parser.add_argument("--cache-format", help="The format of the cache files, csv (default) or parquet.", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--cache-compression", help="Compress the cache files using gzip or zstd.", choices=["gzip", "zstd"])
+    parser.add_argument("--max-cache-size", help="The maximum size of the cache e.g. 500MB or 2GB.", type=_parse_size)
+    parser.add_argument("--cache-layout", help="Store the cache files in a flat directory (default) or hive style partition directories.", choices=["flat", "partitioned"], default="flat")
+    parser.add_argument("-w", "--workers", help="The number of course runs to download at the same time, defaults to 1.", type=int, default=1)
+    parser.add_argument("--metrics", help="Write the time taken by each stage of the download to a JSON file.", metavar="FILE")
     args = parser.parse_args()
+
+    if not args.course and not args.all:
+        parser.error("the course(s) or --all is required")
+
+    # keep a connection open for each worker
+    if args.workers > DEFAULT_POOL_SIZE:
+        configure_http(pool_size=args.workers)
     
     if args.output:
         output_dir = args.output
@@ -39,7 +92,12 @@ def fl_data_dl():
         store_credentials()
 
     try:
-        download_data(organisation=args.organisation, courses=args.course, datasets=args.dataset, directory=output_dir, use_cache=not args.no_cache)
+        if args.all:
+            download_all(organisation=args.organisation, courses=args.course or None, datasets=args.dataset, sink=CsvSink(output_dir), download_workers=args.workers, use_cache=not args.no_cache, cache_format=args.cache_format, 
+                cache_compression=args.cache_compression, max_cache_size=args.max_cache_size, cache_layout=args.cache_layout, metrics_path=args.metrics)
+        else:
+            download_data(organisation=args.organisation, courses=args.course, datasets=args.dataset, directory=output_dir, use_cache=not args.no_cache, max_workers=args.workers, cache_format=args.cache_format, 
+                cache_compression=args.cache_compression, max_cache_size=args.max_cache_size, cache_layout=args.cache_layout, metrics_path=args.metrics)
 
     except NeedToLoginException:
         print("Error: Dataset not returned? Is your username and password correct?\nReset stored credentials using [fl-data-dl course --login]")
@@ -49,3 +107,85 @@ def fl_data_dl():
 
     except KeyboardInterrupt:
         print("Cancelled")
+
+def _warm_command(argv):
+
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog="fl-data-dl warm", description="Refresh the datasets in the cache which have expired or will expire soon, so they are read from the cache when they are needed.")
+    parser.add_argument("organisation", help="The organisation you want to refresh data for.")
+    parser.add_argument("course", nargs='*', help="The course(s) you want to refresh data for, defaults to all the organisation's courses.")
+    parser.add_argument("-d", "--dataset", nargs='+',  help="The dataset(s) you wish to refresh:\n {}".format(", ".join(AVAILABLE_DATASETS)))
+    parser.add_argument("--ahead", help="Also refresh datasets which will expire within this number of hours, defaults to 1.", type=float, default=1)
+    parser.add_argument("--cache-format", help="The format of the cache files, csv (default) or parquet.", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--cache-compression", help="Compress the cache files using gzip or zstd.", choices=["gzip", "zstd"])
+    parser.add_argument("--cache-layout", help="Store the cache files in a flat directory (default) or hive style partition directories.", choices=["flat", "partitioned"], default="flat")
+    parser.add_argument("-w", "--workers", help="The number of datasets to download at the same time, defaults to 1.", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.workers > DEFAULT_POOL_SIZE:
+        configure_http(pool_size=args.workers)
+
+    try:
+        fl = FutureLearnData(args.organisation, max_workers=args.workers, cache_format=args.cache_format, cache_compression=args.cache_compression, 
+            cache_layout=args.cache_layout)
+        results_df = fl.prefetch(courses=args.course or None, datasets=args.dataset, ahead=args.ahead * 60 * 60)
+        for result, count in results_df["result"].value_counts().items():
+            print("{:<14}- {} datasets".format(result, count))
+
+    except NeedToLoginException:
+        print("Error: Dataset not returned? Is your username and password correct?\nReset stored credentials using [fl-data-dl course --login]")
+
+    except DatasetNotKnownException:
+        print("Error: [{}] is not a valid dataset. The options are:\n{}".format(args.dataset, ", ".join(AVAILABLE_DATASETS)))
+
+    except KeyboardInterrupt:
+        print("Cancelled")
+
+def _cache_command(argv):
+
+    from argparse import ArgumentParser
+    from .cache import CacheManager, EVICTION_POLICIES
+
+    parser = ArgumentParser(prog="fl-data-dl cache", description="Manage the FutureLearn Data Downloader cache")
+    parser.add_argument("--cache-directory", help="The cache directory, defaults to ~/.fl-data-dl-cache.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    subparsers.add_parser("stats", help="Show the number of entries and size of the cache.")
+    prune_parser = subparsers.add_parser("prune", help="Remove entries from the cache to reclaim space.")
+    prune_parser.add_argument("--max-size", help="The maximum size of the cache e.g. 500MB or 2GB. Entries for runs which are no longer active are removed first.", type=_parse_size)
+    prune_parser.add_argument("--policy", help="Remove the least recently (lru, default) or least frequently (lfu) used entries.", choices=EVICTION_POLICIES, default="lru")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        cache_manager = CacheManager(args.cache_directory, True, memory_cache=False)
+        stats_df = cache_manager.get_stats()
+        if stats_df.empty:
+            print("The cache is empty")
+            return
+
+        stats_df["bytes"] = stats_df["bytes"].map(_format_size)
+        print(stats_df.rename(columns={"bytes": "size"}).to_string(index=False))
+        print("total         - {} entries, {}".format(stats_df["entries"].sum(), _format_size(cache_manager.get_size())))
+
+    elif args.command == "prune":
+        result = prune_cache(args.cache_directory, max_size=args.max_size, policy=args.policy)
+        print("pruned        - {} entries, {} files, {} reclaimed".format(result["entries"], result["files"], _format_size(result["bytes"])))
+
+def _parse_size(value):
+    # parse a size e.g. "500MB", "2G" or "1048576" into a number of bytes
+    import re
+    from argparse import ArgumentTypeError
+
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*$", value, re.IGNORECASE)
+    if match is None:
+        raise ArgumentTypeError("[{}] is not a valid size e.g. 500MB or 2GB".format(value))
+    units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+def _format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return "{:.1f}{}".format(size, unit) if unit != "B" else "{}{}".format(int(size), unit)
+        size /= 1024
+    return "{:.1f}TB".format(size)
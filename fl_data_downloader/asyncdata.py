@@ -0,0 +1,489 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from datetime import datetime
+from functools import partial
+from mechanicalsoup import LinkNotFoundError
+
+from .credentials import login, relogin
+from .exceptions import (
+    NeedToLoginException,
+    DatasetNotFoundForCourse,
+    CourseRunNotFound
+)
+from .cache import CacheManager, DEFAULT_MISSING_TTL, _copy_data_frame
+from .retry import RetryPolicy
+from .instrumentation import metrics
+from .data import (
+    FUTURELEARN_URL,
+    DATASET_URLS,
+    RUNS_URL,
+    STEPS_URL,
+    DOWNLOAD_CHUNK_SIZE,
+    _calc_cache_expiry,
+    _index_runs,
+    _inactive_runs,
+    _concat,
+    _check_dataset_file,
+    _read_dataset_file,
+    _parse_page
+)
+from .parsers import parse_runs_page, parse_steps_page
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:
+    aiohttp = None
+
+class AsyncFutureLearnData:
+    """
+    An asyncio version of :class:`FutureLearnData`. The `get_` methods are
+    coroutines which share a pool of keep-alive connections, so many datasets
+    can be downloaded at the same time without blocking the event loop.
+
+    Requires `aiohttp <https://docs.aiohttp.org>`_ (``pip install aiohttp``).
+
+    Example, get the enrolments for 2 runs of `programming-101` at the same time::
+
+        import asyncio
+        from fl_data_downloader import AsyncFutureLearnData
+
+        async def main():
+            async with AsyncFutureLearnData("raspberry-pi") as fl:
+                dfs = await asyncio.gather(
+                    fl.get_dataset("programming-101", 1, "enrolments"),
+                    fl.get_dataset("programming-101", 2, "enrolments"))
+                print(dfs)
+
+        asyncio.run(main())
+
+    :param string organisation:
+        The organisation to get the courses for e.g. "raspberry-pi"
+
+    :param Browser browser:
+        A browser object returned by the `fl_data_downloader.login` function,
+        its session cookies are used for all requests. If `None` (default)
+        the login function will be called.
+
+    :param boolean use_cache:
+        Whether to use the cache. Defaults to `True`.
+
+    :param string cache_directory:
+        The directory to use for storing cache files. If `None` (default)
+        the directory ~/.fl-data-dl-cache
+
+    :param integer max_retries:
+        The maximum number of times to try and download a dataset
+
+    :param RetryPolicy retry_policy:
+        Decides when failed requests are retried and limits the rate of
+        requests, see :class:`RetryPolicy`. If `None` (default) failed
+        requests are tried `max_retries` times with exponential backoff.
+
+    :param string cache_format:
+        The format cache files are stored in, "csv" (default) or "parquet".
+
+    :param integer max_connections:
+        The maximum number of requests which can be made at the same time.
+        Defaults to `10`.
+
+    :param string base_url:
+        The url requests are made to, defaults to "https://www.futurelearn.com".
+        Can be changed to use a local test server.
+
+    :param string cache_compression:
+        The compression used for cache files, "gzip" or "zstd". Defaults to `None`.
+
+    :param integer max_cache_size:
+        The maximum number of bytes used by the cache files, see 
+        :class:`FutureLearnData`. Defaults to `None`.
+
+    :param integer missing_ttl:
+        The number of seconds before a dataset which wasn't available for a
+        run is requested again. Defaults to 7 days.
+
+    :param string cache_layout:
+        How the cache files are stored, "flat" (default) or "partitioned", 
+        see :class:`FutureLearnData`.
+    """
+    def __init__(self, organisation, browser=None, use_cache=True, cache_directory=None, max_retries=3, cache_format="csv", max_connections=10, base_url=FUTURELEARN_URL, retry_policy=None, 
+        cache_compression=None, max_cache_size=None, missing_ttl=DEFAULT_MISSING_TTL, cache_layout="flat"):
+        if aiohttp is None:
+            raise ImportError("AsyncFutureLearnData requires aiohttp. Install it using: pip install aiohttp")
+
+        self._organisation = organisation
+        self._cache_manager = CacheManager(cache_directory, use_cache, format=cache_format, compression=cache_compression, max_size=max_cache_size, missing_ttl=missing_ttl, 
+            layout=cache_layout)
+        self._max_retries = max_retries
+        self._retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_retries=max_retries)
+        self._max_connections = max_connections
+        self._base_url = base_url.rstrip("/")
+
+        if browser is None:
+            browser = login()
+        self._browser = browser
+
+        # the aiohttp session and semaphore are created when first used as
+        # they must be created inside the running event loop
+        self._session = None
+        self._semaphore = None
+        self._runs_lock = None
+        self._login_lock = None
+        self._login_count = 0
+
+        # the downloads in progress, so coroutines which need the same data wait for it
+        self._downloads = {}
+
+        # a property which will hold all the runs for the organisation
+        self._runs = None
+        self._run_index = None
+        self._course_runs = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """
+        Closes the connections used by this object.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_dataset(self, course, run, dataset):
+        """
+        Gets a FutureLearn dataset for a specific run of a course.
+
+        :param string course:
+            The online course e.g. "programming-101"
+
+        :param integer run:
+            The number of the specific course run
+
+        :param string dataset:
+            The name of the dataset e.g. "enrolments"
+
+        :return:
+            The dataset in a `pandas.DataFrame`.
+        """
+        expiry = _calc_cache_expiry(dataset, await self.get_run_active_status(course, run))
+
+        keys = (self._organisation, course, run, dataset)
+
+        async def download():
+            # don't request datasets which weren't available when they were last requested
+            if await self._run(self._cache_manager.is_missing, *keys):
+                print("not available - {}_{}_{}_{}".format(self._organisation, course, run, dataset))
+                metrics.count("not available")
+                raise LinkNotFoundError()
+
+            print("downloading   - {}_{}_{}_{}".format(self._organisation, course, run, dataset))
+            url = DATASET_URLS[dataset].format(course=course, run=run, dataset=dataset)
+            try:
+                path, content_hash = await self._with_login(partial(self._download_to_file, url))
+            except LinkNotFoundError:
+                await self._run(self._cache_manager.mark_missing, *keys)
+                raise
+
+            try:
+                with metrics.span("parse", url) as span:
+                    df = await self._run(_read_dataset_file, path, course, run, dataset)
+                    span.rows = len(df)
+            finally:
+                os.remove(path)
+
+            await self._run(self._cache_manager.save_data, df, self._organisation, course, run, dataset, 
+                url=url, content_hash=content_hash)
+            return df
+
+        return await self._get_or_download(keys, expiry, download)
+
+    async def get_dataset_for_course(self, course, dataset):
+        """
+        Gets a FutureLearn dataset for all runs of a course, downloading the
+        runs at the same time.
+
+        :param string course:
+            The online course e.g. "programming-101"
+
+        :param string dataset:
+            The name of the dataset e.g. "enrolments"
+
+        :return:
+            The dataset in a `pandas.DataFrame`.
+        """
+        await self._get_runs()
+        runs = self._course_runs.get(course, [])
+
+        dfs = await asyncio.gather(*[self._get_dataset_or_none(course, run, dataset) for run in runs])
+        dfs = [df for df in dfs if df is not None]
+
+        # if no datasets were found for any course run raise an error
+        if len(dfs) == 0:
+            raise DatasetNotFoundForCourse
+
+        return _concat(dfs, dataset)
+
+    async def get_runs(self):
+        """
+        Get all the runs for an organisation, see :meth:`FutureLearnData.get_runs`.
+
+        :return:
+            The run data in a `pandas.DataFrame`.
+        """
+        expiry = _calc_cache_expiry("runs", True)
+
+        async def download():
+            print("downloading   - {}_runs".format(self._organisation))
+            url = RUNS_URL.format(organisation=self._organisation)
+            content = await self._get_futurelearn_page(url)
+
+            df = await self._run(_parse_page, parse_runs_page, url, content)
+            await self._run(self._cache_manager.save_data, df, self._organisation, "runs", 
+                url=url, content_hash=hashlib.sha256(content).hexdigest())
+            return df
+
+        return await self._get_or_download((self._organisation, "runs"), expiry, download)
+
+    async def get_steps_for_run(self, course, run):
+        """
+        Get the steps for a course run, see :meth:`FutureLearnData.get_steps_for_run`.
+
+        :param string course:
+            The online course e.g. "programming-101"
+
+        :param integer run:
+            The number of the specific course run
+
+        :return:
+            The step data in a `pandas.DataFrame`.
+        """
+        expiry = _calc_cache_expiry("steps-for-run", await self.get_run_active_status(course, run))
+
+        async def download():
+            print("downloading   - {}_{}_{}_steps-for-run".format(self._organisation, course, run))
+            url = STEPS_URL.format(course=course, run=run)
+            content = await self._get_futurelearn_page(url)
+
+            df = await self._run(_parse_page, parse_steps_page, url, content, course, run)
+            await self._run(self._cache_manager.save_data, df, self._organisation, course, run, "steps-for-run", 
+                url=url, content_hash=hashlib.sha256(content).hexdigest())
+            return df
+
+        return await self._get_or_download((self._organisation, course, run, "steps-for-run"), expiry, download)
+
+    async def get_run_active_status(self, course, run):
+        """
+        Returns whether a run is still "active", see :meth:`FutureLearnData.get_run_active_status`.
+
+        :param string course:
+            The online course e.g. "programming-101"
+
+        :param integer run:
+            The number of the specific course run
+
+        :return:
+            True is the course is "active", False if "inactive".
+        """
+        await self._get_runs()
+        try:
+            start_date, status, active_until = self._run_index[(course, int(run))]
+        except (KeyError, ValueError, TypeError):
+            raise CourseRunNotFound("The course run does not exist. {}.{}".format(course, run))
+
+        return datetime.now() < active_until
+
+    async def _get_runs(self):
+        # the runs are only loaded once, even if many coroutines ask for them at the same time
+        if self._runs_lock is None:
+            self._runs_lock = asyncio.Lock()
+        async with self._runs_lock:
+            if self._runs is None:
+                runs_df = await self.get_runs()
+                self._run_index, self._course_runs = _index_runs(runs_df)
+                self._cache_manager.inactive_runs = self._cache_manager.inactive_runs | _inactive_runs(self._organisation, self._run_index)
+                self._runs = runs_df
+        return self._runs
+
+    async def _get_or_download(self, keys, expiry, download):
+        # get data from the cache or, if it isn't there, await download to get it. coroutines
+        # which need data which is already being downloaded wait for that download, and the
+        # cache's lock for the keys stops other processes downloading it at the same time
+        df = await self._run(self._cache_manager.get_data, *keys, expiry=expiry)
+        if df is not None:
+            return df
+
+        if keys in self._downloads:
+            df = await asyncio.shield(self._downloads[keys])
+            return _copy_data_frame(df)
+
+        future = asyncio.get_event_loop().create_future()
+        self._downloads[keys] = future
+        try:
+            lock = self._cache_manager.lock(*keys)
+            await self._acquire(lock)
+            try:
+                df = await self._run(self._cache_manager.get_data, *keys, expiry=expiry)
+                if df is None:
+                    df = await download()
+            finally:
+                lock.release()
+
+            future.set_result(df)
+            return df
+
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+        except BaseException as error:
+            future.set_exception(error)
+            # the error is raised here, so the future doesn't need to report it if nothing is waiting
+            future.exception()
+            raise
+
+        finally:
+            del self._downloads[keys]
+
+    async def _acquire(self, lock):
+        # take a lock in a thread so the event loop isn't blocked, if the coroutine is 
+        # cancelled while waiting the lock is released when it has been taken
+        acquired = asyncio.get_event_loop().run_in_executor(None, lock.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            acquired.add_done_callback(lambda acquired: acquired.cancelled() or acquired.exception() is not None or lock.release())
+            raise
+
+    async def _get_dataset_or_none(self, course, run, dataset):
+        try:
+            return await self.get_dataset(course, run, dataset)
+        except LinkNotFoundError:
+            return None
+
+    async def _run(self, func, *args, **kwargs):
+        # run blocking parsing and cache file access in a thread so the event loop isn't blocked
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    def _get_session(self):
+        if self._session is None:
+            # copy the session cookies from the logged in browser
+            cookie_jar = aiohttp.CookieJar(unsafe=True)
+            self._copy_cookies(cookie_jar)
+
+            headers = {"User-Agent": self._browser.session.headers.get("User-Agent", "")}
+            connector = aiohttp.TCPConnector(limit=self._max_connections)
+            self._session = aiohttp.ClientSession(connector=connector, cookie_jar=cookie_jar, headers=headers)
+            self._semaphore = asyncio.Semaphore(self._max_connections)
+
+        return self._session
+
+    def _copy_cookies(self, cookie_jar):
+        cookies = {cookie.name: cookie.value for cookie in self._browser.session.cookies}
+        cookie_jar.update_cookies(cookies, response_url=URL(self._base_url))
+
+    async def _get(self, url, read=None):
+        # get the url, retrying failed requests. the content is returned, or 
+        # if read is passed the result of awaiting read(response, span)
+        # swap futurelearn for the base url
+        if url.startswith(FUTURELEARN_URL):
+            url = self._base_url + url[len(FUTURELEARN_URL):]
+
+        session = self._get_session()
+        attempt = 0
+        while True:
+            wait = self._retry_policy.get_bucket(url).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            try:
+                async with self._semaphore:
+                    with metrics.span("http", url) as span:
+                        async with session.get(url) as response:
+                            if response.status == 404:
+                                raise LinkNotFoundError()
+                            if response.status not in self._retry_policy.retry_statuses:
+                                if read is not None:
+                                    return await read(response, span)
+                                content = await response.read()
+                                span.bytes = len(content)
+                                return content
+                            status, retry_after = response.status, response.headers.get("Retry-After")
+                            error = "HTTP status {}".format(status)
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                status, retry_after, error = None, None, e
+
+            attempt += 1
+            delay = self._retry_policy.get_delay(attempt, url, status, retry_after)
+            print("error         - {} - retrying in {:.1f} secs".format(error, delay))
+            await asyncio.sleep(delay)
+
+    async def _download_to_file(self, url):
+        # stream the url to a temporary file, returning the file path and a hash of the content
+        path, content_hash = await self._get(url, read=self._read_to_file)
+        try:
+            await self._run(_check_dataset_file, path)
+        except NeedToLoginException:
+            os.remove(path)
+            raise
+        return path, content_hash
+
+    async def _read_to_file(self, response, span):
+        content_hash = hashlib.sha256()
+        file_descriptor, path = tempfile.mkstemp(suffix=".download", dir=self._cache_manager.cache_directory)
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    content_hash.update(chunk)
+                    file.write(chunk)
+                    span.bytes += len(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, content_hash.hexdigest()
+
+    async def _get_futurelearn_page(self, url):
+        async def get_page():
+            content = await self._get(url)
+
+            # does the form contain a link to sign in? if so..  They need to sign in
+            if (FUTURELEARN_URL + "/sign-in").encode("utf-8") in content:
+                raise NeedToLoginException("Failed to login to FutureLearn. Is your username and password correct?")
+
+            return content
+
+        try:
+            return await self._with_login(get_page)
+        except LinkNotFoundError as error:
+            print(error)
+            raise NeedToLoginException("A mechanicalsoup.LinkNotFoundError was raised for URL {}. Does this organisation/course/run exist?".format(url))
+
+    async def _with_login(self, func):
+        # await func(), if FutureLearn asks to sign in (e.g. the stored session has
+        # expired) login again, copy the new cookies to the aiohttp session and 
+        # await it once more. only browsers created by login can login again.
+        login_count = self._login_count
+        try:
+            return await func()
+        except NeedToLoginException:
+            if not hasattr(self._browser, "fl_credentials"):
+                raise
+
+            # if many coroutines need to login, only the first does
+            if self._login_lock is None:
+                self._login_lock = asyncio.Lock()
+            async with self._login_lock:
+                if self._login_count == login_count:
+                    await self._run(relogin, self._browser)
+                    self._copy_cookies(self._get_session().cookie_jar)
+                    self._login_count += 1
+
+            return await func()
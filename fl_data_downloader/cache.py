@@ -1,50 +1,1391 @@
 import pandas as pd
 import os
 import sqlite3
+import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from urllib.parse import quote, unquote
+
+from .instrumentation import metrics
+from .locks import FileLock, NullLock
+from .schemas import read_csv, to_csv, apply_schema
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".fl-data-dl-cache")
+
+# the maximum number of bytes of data frames kept in memory
+DEFAULT_MEMORY_CACHE_SIZE = 256 * 1024 * 1024
+
+# the compressions cache files can be written with and the extension added to compressed csv files
+COMPRESSIONS = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+# the ways entries are chosen to be removed when the cache is too big, least recently or least frequently used
+EVICTION_POLICIES = ["lru", "lfu"]
+
+# files being written which are older than this (in seconds) were left by a process which stopped
+STALE_WRITING_AGE = 24 * 60 * 60
+
+# how the cache files are laid out, "flat" files named using the key in the cache directory or
+# "partitioned" hive style directories e.g. organisation=raspberry-pi/dataset=enrolments/course=programming-101/run=1
+CACHE_LAYOUTS = ["flat", "partitioned"]
+
+# the columns stored in the names of partition directories rather than in the files
+PARTITION_COLUMNS = ["course", "run"]
+
+# the operators which can be used in filters, the same as pyarrow's
+FILTER_OPERATORS = ["==", "!=", "<", "<=", ">", ">=", "in", "not in"]
+
+# the number of rows read at a time when filtering a csv file
+FILTER_CHUNKSIZE = 100000
+
+# data which doesn't exist (e.g. a dataset which isn't available for a course run) isn't requested again for this time
+#  7 days
+DEFAULT_MISSING_TTL = 7 * 24 * 60 * 60
+
+# the sqlite database in the cache directory which indexes the cache entries
+INDEX_FILE_NAME = "index.db"
+
+# the directory in the cache directory which holds the lock files for each key
+LOCK_DIRECTORY = ".locks"
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    organisation TEXT NOT NULL,
+    course TEXT,
+    run INTEGER,
+    dataset TEXT NOT NULL,
+    path TEXT NOT NULL,
+    format TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    rows INTEGER,
+    bytes INTEGER,
+    content_hash TEXT,
+    url TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    accessed_at REAL,
+    hits INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_dataset ON entries (organisation, dataset, course, run);
+CREATE INDEX IF NOT EXISTS entries_course ON entries (organisation, course, run);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+CREATE TABLE IF NOT EXISTS segments (
+    key TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    format TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    rows INTEGER,
+    bytes INTEGER,
+    PRIMARY KEY (key, segment)
+);
+CREATE TABLE IF NOT EXISTS missing (
+    key TEXT PRIMARY KEY,
+    organisation TEXT NOT NULL,
+    course TEXT,
+    run INTEGER,
+    dataset TEXT NOT NULL,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS missing_course ON missing (organisation, course, run);
+"""
+
+ENTRY_COLUMNS = ["key", "organisation", "course", "run", "dataset", "path", "format", "fetched_at", "rows", "bytes", "content_hash", "url", "etag", "last_modified"]
+
+# columns added to the index since it was created, which are added to older indexes
+INDEX_UPGRADES = {
+    "etag": "TEXT",
+    "last_modified": "TEXT",
+    "accessed_at": "REAL",
+    "hits": "INTEGER",
+}
+
+class CsvFormat():
+    """
+    Stores cached data as CSV files, the original cache format. The files
+    can be compressed with gzip or zstd (requires `zstandard`).
+    """
+    name = "csv"
+
+    def __init__(self, compression=None):
+        _check_compression(compression)
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError("zstd compression of csv files requires zstandard. Install it using: pip install zstandard")
+
+        self.compression = compression
+        # uncompressed files have no extension, compressed files are read using their extension
+        self.extension = "" if compression is None else ".csv" + COMPRESSIONS[compression]
+
+    def write(self, data_frame, path):
+        to_csv(data_frame, path, compression=self.compression)
+
+    def read(self, path, columns=None, dataset=None, filters=None):
+        if not filters:
+            return read_csv(path, dataset, usecols=columns)
+
+        # the rows are filtered a chunk at a time, so the whole file is never in memory
+        dfs = [_filter_data_frame(df, filters) for df in read_csv(path, dataset, usecols=columns, chunksize=FILTER_CHUNKSIZE)]
+        if len(dfs) == 0:
+            return read_csv(path, dataset, usecols=columns, nrows=0)
+        return apply_schema(pd.concat(dfs, ignore_index=True), dataset)
+
+    def read_chunks(self, path, chunksize, columns=None, dataset=None):
+        return read_csv(path, dataset, usecols=columns, chunksize=chunksize)
+
+    def open_writer(self, path):
+        return _CsvChunkWriter(path, self.compression)
+
+class ParquetFormat():
+    """
+    Stores cached data as Parquet files, which keep the column types and are
+    much quicker to read than CSV. Requires `pyarrow`. The files are 
+    compressed with snappy, unless gzip or zstd is used.
+    """
+    name = "parquet"
+    extension = ".parquet"
+
+    def __init__(self, compression=None):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("The parquet cache format requires pyarrow. Install it using: pip install pyarrow")
+
+        _check_compression(compression)
+        self.compression = compression
+
+    def write(self, data_frame, path):
+        import pyarrow.parquet as pq
+        pq.write_table(_to_arrow_table(data_frame), path, compression=self.compression or "snappy")
+
+    def read(self, path, columns=None, dataset=None, filters=None):
+        # pyarrow skips the row groups which can't match the filters
+        return apply_schema(pd.read_parquet(path, columns=columns, filters=filters or None), dataset)
+
+    def read_chunks(self, path, chunksize, columns=None, dataset=None):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield apply_schema(batch.to_pandas(), dataset)
+
+    def open_writer(self, path):
+        return _ParquetChunkWriter(path, self.compression)
+
+CACHE_FORMATS = {
+    "csv": CsvFormat,
+    "parquet": ParquetFormat,
+}
+
+class _CsvChunkWriter():
+    def __init__(self, path, compression=None):
+        if compression == "gzip":
+            import gzip
+            self._file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        elif compression == "zstd":
+            import zstandard
+            self._file = zstandard.open(path, "wt", newline="", encoding="utf-8")
+        else:
+            self._file = open(path, "w", newline="", encoding="utf-8")
+        self._header = True
+
+    def write(self, data_frame):
+        to_csv(data_frame, self._file, header=self._header)
+        self._header = False
+
+    def close(self):
+        self._file.close()
+
+class _ParquetChunkWriter():
+    def __init__(self, path, compression=None):
+        self._path = path
+        self._compression = compression or "snappy"
+        self._writer = None
+
+    def write(self, data_frame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # the schema of the file is taken from the first chunk
+        if self._writer is None:
+            table = _to_arrow_table(data_frame)
+            self._writer = pq.ParquetWriter(self._path, table.schema, compression=self._compression)
+        else:
+            table = pa.Table.from_pandas(data_frame, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+class CacheWriter():
+    """
+    Writes a data frame to the cache a chunk at a time. The data is written
+    to a temporary file and only added to the cache when the writer is 
+    closed, if the writer is aborted nothing is added to the cache.
+
+    Created using `CacheManager.open_writer`.
+    """
+    def __init__(self, cache_manager, keys, url=None, content_hash=None, etag=None, last_modified=None):
+        self._cache_manager = cache_manager
+        self._keys = keys
+        self._values = dict(url=url, content_hash=content_hash, etag=etag, last_modified=last_modified)
+        self._rows = 0
+        self._open = cache_manager.use_cache
+
+        if self._open:
+            self._file_name = cache_manager._get_file_name(keys)
+            path = os.path.join(cache_manager.cache_directory, self._file_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._temp_path = _temp_path(path)
+            self._chunk_writer = cache_manager.format.open_writer(self._temp_path)
+
+    def write(self, data_frame):
+        if self._open:
+            with metrics.span("cache write", self._file_name) as span:
+                self._chunk_writer.write(_drop_partition_columns(data_frame, self._file_name))
+                span.rows = len(data_frame)
+            self._rows += len(data_frame)
+
+    def close(self):
+        """
+        Adds the data written to the cache.
+        """
+        if self._open:
+            self._open = False
+            path = os.path.join(self._cache_manager.cache_directory, self._file_name)
+            with metrics.span("cache write", self._file_name) as span:
+                self._chunk_writer.close()
+                os.replace(self._temp_path, path)
+                span.bytes = os.path.getsize(path)
+            self._cache_manager._add_entry(self._keys, self._file_name, self._rows, **self._values)
+
+    def abort(self):
+        """
+        Discards the data written, if the writer hasn't been closed.
+        """
+        if self._open:
+            self._open = False
+            self._chunk_writer.close()
+            self._cache_manager._remove_file(os.path.relpath(self._temp_path, self._cache_manager.cache_directory))
+
+class MemoryCache():
+    """
+    Keeps data frames read from the cache in memory, so reading them again
+    doesn't read and parse the files. When the data frames use more than
+    `max_bytes`, the least recently used are removed.
+
+    Data frames are stored with the version of the cache entry they were read
+    from and are only returned if the entry hasn't changed. A copy is returned
+    so changing it doesn't change the data in memory; with pandas
+    copy-on-write this doesn't copy the data.
+
+    :param integer max_bytes:
+        The maximum number of bytes of data frames to keep in memory.
+        Defaults to 256MB.
+    """
+    def __init__(self, max_bytes=DEFAULT_MEMORY_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Returns a copy of the data frame for a key, or `None` if it isn't in
+        memory or is a different version.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] != version:
+                self._misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self._hits += 1
+            return _copy_data_frame(item[1])
+
+    def put(self, key, version, data_frame):
+        """
+        Stores a copy of a data frame, removing the least recently used data
+        frames if there isn't enough space.
+        """
+        size = int(data_frame.memory_usage(index=True, deep=True).sum())
+        data_frame = _copy_data_frame(data_frame)
+        with self._lock:
+            self._discard(key)
+            # data frames bigger than the cache are never stored
+            if size > self.max_bytes:
+                return
+
+            self._items[key] = (version, data_frame, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                self._evictions += 1
+
+    def update_version(self, key, version, new_version):
+        """
+        Changes the version of a data frame, if it is `version`. Used when
+        the cache entry changes without its data changing.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == version:
+                self._items[key] = (new_version,) + item[1:]
+
+    def discard(self, key):
+        """
+        Removes the data frame for a key.
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """
+        Removes all the data frames.
+        """
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        """
+        Returns a dictionary of the number of `hits`, `misses` and 
+        `evictions`, the number of data frames in memory (`entries`), the 
+        number of `bytes` they use and `max_bytes`.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits, 
+                "misses": self._misses, 
+                "evictions": self._evictions, 
+                "entries": len(self._items), 
+                "bytes": self._bytes, 
+                "max_bytes": self.max_bytes}
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+# the memory cache shared by all cache managers in the process
+_shared_memory_cache = MemoryCache()
 
 class CacheManager():
-    def __init__(self, cache_directory, use_cache):
+    """
+    Stores data frames in files in the cache directory. Each entry is 
+    recorded in a sqlite index (`index.db`) with the organisation, course, 
+    run and dataset it is for, when it was fetched, its size and where it 
+    came from.
+
+    Entries are identified by keys, `organisation, [course, run,] dataset`.
+
+    Rows can be appended to an entry, they are stored in a separate segment 
+    file and combined with the entry when it is read.
+
+    Data frames which have been read or saved are kept in a
+    :class:`MemoryCache`, `memory_cache` is `True` to use the cache shared by
+    the process, a `MemoryCache` or `False` to not keep data in memory.
+
+    Files are compressed with `compression`, "gzip" or "zstd". If `max_size`
+    is set, when the files in the cache use more than `max_size` bytes, 
+    entries are removed until they don't, see `prune`.
+
+    Data which doesn't exist, e.g. a dataset which isn't available for a
+    course run, is recorded using `mark_missing` and `is_missing` returns
+    `True` for it until `missing_ttl` seconds have passed.
+
+    With `layout="partitioned"` the files are stored in hive style 
+    partition directories e.g. 
+    `organisation=raspberry-pi/dataset=enrolments/course=programming-101/run=1/data.parquet`,
+    so all the runs of a dataset can be read as one partitioned dataset by
+    pyarrow or DuckDB, see `get_partition_directory`. The course and run 
+    columns are stored in the directory names rather than the files. Files 
+    in the flat layout, including files cached before the index existed, are
+    moved into partition directories when the cache manager is created.
+
+    Files are written to a temporary file which is renamed when it is 
+    complete, so other processes using the cache never read a half written
+    file. `lock` returns a lock for a key, shared by all the threads and 
+    processes using the cache directory.
+    """
+    def __init__(self, cache_directory, use_cache, format="csv", memory_cache=True, compression=None, max_size=None, eviction="lru", missing_ttl=DEFAULT_MISSING_TTL, layout="flat"):
         self.use_cache = use_cache
         if self.use_cache:
             if cache_directory is None:
-                cache_directory = os.path.join(os.path.expanduser("~"), ".fl-data-dl-cache")
+                cache_directory = DEFAULT_CACHE_DIRECTORY
 
-            # create the directory if it doesn't exist
-            if not os.path.exists(cache_directory):
-                os.makedirs(cache_directory)
+            # create the directory and the directory for lock files if they don't exist
+            os.makedirs(os.path.join(cache_directory, LOCK_DIRECTORY), exist_ok=True)
 
             print("using cache   - {}".format(cache_directory))
 
         self.cache_directory = cache_directory
-        
-    def save_data(self, data_frame, *keys):
+        self.format = _get_format(format, compression)
+        self.max_size = max_size
+        self.eviction = _check_eviction(eviction)
+        self.missing_ttl = missing_ttl
+        self.layout = _check_layout(layout)
+
+        # the (organisation, course, run) of runs which are no longer active, their entries are removed first
+        self.inactive_runs = set()
+
+        if memory_cache is True:
+            memory_cache = _shared_memory_cache
+        self.memory_cache = memory_cache if memory_cache and self.use_cache else None
+
+        if self.use_cache:
+            self._index_path = os.path.join(cache_directory, INDEX_FILE_NAME)
+            conn = self._connect()
+            try:
+                conn.executescript(INDEX_SCHEMA)
+                _upgrade_index(conn)
+            finally:
+                conn.close()
+
+            if self.layout == "partitioned":
+                self._partition_entries()
+
+    def save_data(self, data_frame, *keys, url=None, content_hash=None, etag=None, last_modified=None):
+        if self.use_cache:
+            file_name = self._get_file_name(keys)
+            self._write_file(data_frame, file_name)
+            self._add_entry(keys, file_name, len(data_frame), url=url, content_hash=content_hash, etag=etag, last_modified=last_modified)
+            self._put_in_memory(self.get_entry(*keys), data_frame)
+
+    def lock(self, *keys):
+        """
+        Returns a :class:`FileLock` for the keys, used so only one thread or
+        process downloads the data for the keys at a time::
+
+            with cache_manager.lock("raspberry-pi", "programming-101", 1, "comments"):
+                # check the cache again, another process may have downloaded it
+                ...
+        """
+        if self.use_cache:
+            return FileLock(os.path.join(self.cache_directory, LOCK_DIRECTORY, self._create_key(keys) + ".lock"))
+        return NullLock()
+
+    def open_writer(self, *keys, url=None, content_hash=None, etag=None, last_modified=None):
+        """
+        Returns a `CacheWriter` which saves data to the cache a chunk at a time.
+        """
+        return CacheWriter(self, keys, url=url, content_hash=content_hash, etag=etag, last_modified=last_modified)
+
+    def get_data(self, *keys, expiry=None, columns=None, filters=None):
+        """
+        Returns the data in the cache for the keys, or `None` if it isn't in
+        the cache or has expired. 
+
+        If `columns` is given only those columns are read. `filters` is a 
+        list of `(column, operator, value)` tuples e.g. 
+        `[("week_number", "==", 1)]` using the operators in 
+        `FILTER_OPERATORS`, only the rows which match all of them are 
+        returned. The rows are filtered as the file is read.
+        """
+        if self.use_cache:
+            key = self._create_key(keys)
+            entry = self.get_entry(*keys)
+
+            if entry is not None:
+                if _is_fresh(entry, expiry):
+                    # the columns used by the filters are read too
+                    read_columns = _read_columns(columns, filters)
+
+                    data_frame = self._get_from_memory(entry, read_columns)
+                    if data_frame is not None:
+                        print("memory cache  - {}".format(key))
+                        metrics.count("memory cache hits")
+                        return _select_columns(_filter_data_frame(data_frame, filters), columns)
+
+                    print("reading cache - {}".format(key))
+                    with metrics.span("cache read", key) as span:
+                        try:
+                            data_frame = self._read_file(entry["path"], entry["format"], entry["dataset"], columns=read_columns, filters=filters)
+                            segments_df = self._read_segments(key, dataset=entry["dataset"], columns=read_columns, filters=filters)
+                        except FileNotFoundError:
+                            self._remove_deleted_entry(key)
+                            return None
+
+                        if segments_df is not None:
+                            data_frame = apply_schema(pd.concat([data_frame, segments_df], ignore_index=True), entry["dataset"])
+
+                        # the size of the files, only part of them is read if there are columns or filters
+                        span.bytes = entry["bytes"] or 0
+                        span.rows = len(data_frame)
+
+                    self._record_access(key)
+                    if columns is None and not filters:
+                        self._put_in_memory(entry, data_frame)
+                    return _select_columns(data_frame, columns)
+
+    def iter_data(self, *keys, expiry=None, chunksize=100000, columns=None):
+        """
+        Returns an iterator of data frames of at most `chunksize` rows, or 
+        `None` if the data isn't in the cache or has expired.
+        """
+        if self.use_cache:
+            entry = self.get_entry(*keys)
+            if entry is not None and _is_fresh(entry, expiry):
+                if not os.path.isfile(self._get_path(entry)):
+                    self._remove_deleted_entry(entry["key"])
+                    return None
+
+                print("reading cache - {}".format(entry["key"]))
+                self._record_access(entry["key"])
+                return metrics.iter_spans("cache read", self._iter_chunks(entry, chunksize, columns), entry["key"])
+
+    def is_fresh(self, *keys, expiry=None):
+        """
+        Returns `True` if there is data in the cache for the keys which 
+        hasn't expired.
+        """
+        if self.use_cache:
+            entry = self.get_entry(*keys)
+            return entry is not None and _is_fresh(entry, expiry)
+        return False
+
+    def has_data(self, *keys):
+        """
+        Returns `True` if there is data in the cache for the keys, even if it
+        has expired.
+        """
+        if self.use_cache:
+            entry = self.get_entry(*keys)
+            return entry is not None and os.path.isfile(self._get_path(entry))
+        return False
+
+    def append_data(self, data_frame, *keys, content_hash=None, etag=None, last_modified=None):
+        """
+        Appends rows to an entry in the cache, storing them in a new segment 
+        file. The entry is marked as fetched now.
+        """
+        if self.use_cache:
+            key = self._create_key(keys)
+            segment = self._query("SELECT COALESCE(MAX(segment), 0) + 1 FROM segments WHERE key = ?", (key,))[0][0]
+            file_name = self._get_file_name(keys, "_segment{}".format(segment))
+            segment_file_path = os.path.join(self.cache_directory, file_name)
+            self._write_file(data_frame, file_name)
+
+            fetched_at = time.time()
+            self._execute(
+                "INSERT INTO segments (key, segment, path, format, fetched_at, rows, bytes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, segment, file_name, self.format.name, fetched_at, len(data_frame), os.path.getsize(segment_file_path)))
+            self._execute(
+                "UPDATE entries SET fetched_at = ?, rows = rows + ?, content_hash = ?, etag = ?, last_modified = ? WHERE key = ?",
+                (fetched_at, len(data_frame), content_hash, etag, last_modified, key))
+
+            if self.memory_cache is not None:
+                self.memory_cache.discard((self.cache_directory, key))
+
+            print("appending     - {} ({} rows)".format(key, len(data_frame)))
+
+            if self.max_size is not None:
+                self._evict(self.max_size, self.eviction, self.inactive_runs, keep=key)
+
+    def get_appended_data(self, *keys, since=None, columns=None):
+        """
+        Returns the rows appended to an entry, optionally only those appended
+        after the `since` datetime. Returns `None` if no rows were appended.
+        """
+        if self.use_cache:
+            key = self._create_key(keys)
+            since = 0 if since is None else since.timestamp()
+            return self._read_segments(key, dataset=_split_keys(keys)[3], since=since, columns=columns)
+
+    def mark_missing(self, *keys):
+        """
+        Records that the data for the keys doesn't exist, e.g. the dataset
+        isn't available for the course run.
+        """
+        if self.use_cache:
+            organisation, course, run, dataset = _split_keys(keys)
+            self._execute(
+                "INSERT OR REPLACE INTO missing (key, organisation, course, run, dataset, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self._create_key(keys), organisation, course, run, dataset, time.time()))
+
+    def is_missing(self, *keys, ttl=None):
+        """
+        Returns `True` if the data for the keys was recorded as missing in
+        the last `ttl` seconds, which defaults to `missing_ttl`.
+        """
+        if self.use_cache:
+            ttl = self.missing_ttl if ttl is None else ttl
+            rows = self._query("SELECT checked_at FROM missing WHERE key = ?", (self._create_key(keys),))
+            return len(rows) > 0 and rows[0][0] > time.time() - ttl
+        return False
+
+    def get_availability(self, organisation=None, course=None, run=None, dataset=None):
+        """
+        Returns whether the data for each organisation, course, run and 
+        dataset is available, as a `pandas.DataFrame` with the columns 
+        organisation, course, run, dataset, available and checked_at. Data
+        which is in the cache is available, data which was recorded as 
+        missing isn't.
+        """
+        if self.use_cache:
+            where, params = _where(organisation=organisation, course=course, run=run, dataset=dataset)
+            rows = self._query(
+                "SELECT organisation, course, run, dataset, 1, fetched_at FROM entries{} UNION ALL "
+                "SELECT organisation, course, run, dataset, 0, checked_at FROM missing{} ORDER BY organisation, course, run, dataset".format(where, where), 
+                params + params)
+            df = pd.DataFrame(rows, columns=["organisation", "course", "run", "dataset", "available", "checked_at"])
+            df["available"] = df["available"].astype(bool)
+            df["checked_at"] = df["checked_at"].map(datetime.fromtimestamp)
+            return df
+
+    def get_partition_directory(self, organisation, dataset):
+        """
+        Returns the directory which contains the partitioned files for all 
+        the runs of a dataset when `layout="partitioned"` is used, which can
+        be read as one dataset e.g. using 
+        `pandas.read_parquet(directory, filters=[("course", "==", "programming-101")])`
+        or DuckDB's `read_parquet(directory + "/**/*.parquet", hive_partitioning = true)`.
+        """
+        return os.path.join(self.cache_directory, _partition_directory((organisation, dataset)))
+
+    def get_entry(self, *keys):
+        """
+        Returns the index entry for the keys as a dictionary, or `None` if
+        the data isn't in the cache.
+        """
         if self.use_cache:
             key = self._create_key(keys)
-            cache_file_path = os.path.join(self.cache_directory, key)
-            data_frame.to_csv(cache_file_path, index=False)
-            print("saving cache  - {}".format(key))
-            
-    def get_data(self, *keys, expiry=None):
+            rows = self._query("SELECT {} FROM entries WHERE key = ?".format(", ".join(ENTRY_COLUMNS)), (key,))
+            if len(rows) > 0:
+                return dict(zip(ENTRY_COLUMNS, rows[0]))
+
+            # a file cached before the index existed is added to it, files cached before "_" 
+            # was escaped are named using the unescaped ids
+            for name in dict.fromkeys([key, "_".join(map(str, keys))]):
+                file_name = name + self.format.extension
+                if os.path.isfile(os.path.join(self.cache_directory, file_name)):
+                    return self._index_file(keys, file_name, self.format.name)
+
+    def touch(self, *keys, etag=None, last_modified=None):
+        """
+        Marks an entry as fetched now, without changing its data. Used when 
+        the data is downloaded again but hasn't changed.
+        """
         if self.use_cache:
             key = self._create_key(keys)
-            cache_file_path = os.path.join(self.cache_directory, key)
-
-            use_cache = False
-            # does the file exist?
-            if os.path.isfile(cache_file_path):
-                # does the cache expire?
-                if expiry is not None:
-                    # is the cached file older than the expiry datetime?
-                    file_age = datetime.fromtimestamp(os.path.getmtime(cache_file_path))
-                    if expiry < file_age:
-                        use_cache = True
-                else:
-                    use_cache = True
-
-            if use_cache:
-                print("reading cache - {}".format(key))
-                return pd.read_csv(cache_file_path)
+            entry = self.get_entry(*keys)
+            fetched_at = time.time()
+            self._execute(
+                "UPDATE entries SET fetched_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE key = ?",
+                (fetched_at, etag, last_modified, key))
+
+            # the data in memory is still the latest
+            if self.memory_cache is not None and entry is not None:
+                version = _entry_version(entry)
+                self.memory_cache.update_version((self.cache_directory, key), version, version[:1] + (fetched_at,) + version[2:])
+
+    def list_entries(self, organisation=None, course=None, run=None, dataset=None):
+        """
+        Returns the entries in the cache as a `pandas.DataFrame`, optionally
+        filtered by organisation, course, run and dataset.
+        """
+        if self.use_cache:
+            where, params = _where(organisation=organisation, course=course, run=run, dataset=dataset)
+            rows = self._query("SELECT {} FROM entries{} ORDER BY key".format(", ".join(ENTRY_COLUMNS), where), params)
+            df = pd.DataFrame(rows, columns=ENTRY_COLUMNS)
+            df["fetched_at"] = df["fetched_at"].map(datetime.fromtimestamp)
+            return df
+
+    def invalidate(self, organisation=None, course=None, run=None, dataset=None):
+        """
+        Removes entries from the cache, filtered by organisation, course, run
+        and dataset. 
+
+        :return:
+            The number of entries removed.
+        """
+        if self.use_cache:
+            where, params = _where(organisation=organisation, course=course, run=run, dataset=dataset)
+            rows = self._query("SELECT key, path FROM entries{}".format(where), params)
+            for key, path in rows:
+                self._remove_entry(key, path)
+            # data recorded as missing is requested again
+            self._execute("DELETE FROM missing{}".format(where), params)
+            return len(rows)
+
+    def prune(self, max_size=None, policy=None, inactive_runs=None):
+        """
+        Removes files left by downloads which didn't finish and, if the files
+        in the cache use more than `max_size` bytes, removes entries until 
+        they don't.
+
+        Entries for runs which are no longer active are removed first, as 
+        they are never refreshed, then the entries which were least recently 
+        read ("lru") or least often read ("lfu").
+
+        :param integer max_size:
+            The maximum number of bytes, defaults to the `max_size` of the
+            cache manager. If `None` no entries are removed.
+
+        :param string policy:
+            "lru" or "lfu", defaults to the `eviction` of the cache manager.
+
+        :param set inactive_runs:
+            The (organisation, course, run) of runs which are no longer 
+            active, defaults to the `inactive_runs` of the cache manager.
+
+        :return:
+            A dictionary of the number of `entries` and `files` removed and
+            the number of `bytes` reclaimed.
+        """
+        if self.use_cache:
+            files, freed = self._remove_stale_files()
+            entries = 0
+            max_size = self.max_size if max_size is None else max_size
+            if max_size is not None:
+                policy = self.eviction if policy is None else _check_eviction(policy)
+                inactive_runs = self.inactive_runs if inactive_runs is None else inactive_runs
+                evicted, evicted_bytes = self._evict(max_size, policy, inactive_runs)
+                entries += evicted
+                freed += evicted_bytes
+
+            return {"entries": entries, "files": files, "bytes": freed}
+
+    def get_size(self):
+        """
+        Returns the number of bytes used by the files in the cache.
+        """
+        if self.use_cache:
+            return self._query("SELECT COALESCE((SELECT SUM(bytes) FROM entries), 0) + COALESCE((SELECT SUM(bytes) FROM segments), 0)")[0][0]
+        return 0
+
+    def get_stats(self):
+        """
+        Returns the number of entries, rows and bytes in the cache for each
+        organisation and dataset as a `pandas.DataFrame`.
+        """
+        if self.use_cache:
+            rows = self._query(
+                "SELECT entries.organisation, entries.dataset, COUNT(*), SUM(entries.rows), SUM(entries.bytes) + COALESCE(SUM(segments.bytes), 0) "
+                "FROM entries LEFT JOIN (SELECT key, SUM(bytes) AS bytes FROM segments GROUP BY key) AS segments ON entries.key = segments.key "
+                "GROUP BY entries.organisation, entries.dataset ORDER BY entries.organisation, entries.dataset")
+            return pd.DataFrame(rows, columns=["organisation", "dataset", "entries", "rows", "bytes"])
+
+    def migrate(self, from_format="csv"):
+        """
+        Converts all the files in the cache from one format to the format
+        used by this cache manager. The modified time of each file is kept so
+        the cache doesn't expire.
+
+        :param string from_format:
+            The format of the existing cache files, defaults to "csv".
+
+        :return:
+            The number of files converted.
+        """
+        from_format = _get_format(from_format)
+        if not self.use_cache or (from_format.name == self.format.name and from_format.extension == self.format.extension):
+            return 0
+
+        converted = 0
+        for file_name in self._list_files():
+            directory, base_name = os.path.split(file_name)
+            keys = None
+            if directory == "":
+                key = _strip_extension(base_name, from_format)
+                extension = self.format.extension
+                if key is not None and not self._is_indexed(file_name):
+                    # files cached before the index existed are added to it, named using the escaped key
+                    keys = _parse_file_keys(key)
+                    if keys is not None:
+                        key = self._create_key(keys)
+            else:
+                # files in partition directories always have an extension
+                key = _strip_extension(base_name, from_format, partitioned=True)
+                extension = self.format.extension or ".csv"
+            if key is None:
+                continue
+
+            from_path = os.path.join(self.cache_directory, file_name)
+            to_file_name = _join_path(directory, key + extension)
+            to_path = os.path.join(self.cache_directory, to_file_name)
+            if to_file_name == file_name:
+                continue
+
+            data_frame = from_format.read(from_path, dataset=self._get_dataset(file_name))
+            self._write_file(data_frame, to_file_name)
+
+            modified_time = os.path.getmtime(from_path)
+            os.utime(to_path, (modified_time, modified_time))
+            os.remove(from_path)
+
+            for table in ("entries", "segments"):
+                self._execute(
+                    "UPDATE {} SET path = ?, format = ?, bytes = ? WHERE path = ?".format(table), 
+                    (to_file_name, self.format.name, os.path.getsize(to_path), file_name))
+            if keys is not None:
+                self._index_file(keys, to_file_name, self.format.name)
+
+            print("migrated      - {}".format(file_name))
+            converted += 1
+
+        return converted
+
+    def _iter_chunks(self, entry, chunksize, columns):
+        for chunk in self._read_file_chunks(entry["path"], entry["format"], entry["dataset"], chunksize, columns):
+            yield chunk
+
+        rows = self._query("SELECT path, format FROM segments WHERE key = ? ORDER BY segment", (entry["key"],))
+        for path, format in rows:
+            for chunk in self._read_file_chunks(path, format, entry["dataset"], chunksize, columns):
+                yield chunk
+
+    def _read_file(self, file_name, format, dataset, columns=None, filters=None):
+        # read a cache file, adding back the columns stored in the names of its partition directories
+        partition = _partition_values(file_name)
+        path = os.path.join(self.cache_directory, file_name)
+        if len(partition) == 0:
+            return _get_format(format).read(path, columns=columns, dataset=dataset, filters=filters)
+
+        file_columns = None if columns is None else [column for column in columns if column not in partition]
+        file_filters = [filter for filter in filters or [] if filter[0] not in partition]
+        partition_filters = [filter for filter in filters or [] if filter[0] in partition]
+
+        data_frame = _get_format(format).read(path, columns=file_columns or None, dataset=dataset, filters=file_filters)
+        data_frame = _filter_data_frame(_add_partition_columns(data_frame, partition, dataset), partition_filters)
+        return _select_columns(data_frame, columns)
+
+    def _read_file_chunks(self, file_name, format, dataset, chunksize, columns=None):
+        partition = _partition_values(file_name)
+        file_columns = None if columns is None else [column for column in columns if column not in partition]
+        for chunk in _get_format(format).read_chunks(os.path.join(self.cache_directory, file_name), chunksize, columns=file_columns or None, dataset=dataset):
+            yield _select_columns(_add_partition_columns(chunk, partition, dataset), columns)
+
+    def _get_file_name(self, keys, suffix=""):
+        # the path of the cache file for the keys, relative to the cache directory
+        if self.layout == "partitioned":
+            return _join_path(_partition_directory(keys), "data" + suffix + (self.format.extension or ".csv"))
+        return self._create_key(keys) + suffix + self.format.extension
+
+    def _partition_entries(self):
+        # move the files in the flat layout into partition directories, so caches are migrated
+        # automatically. the files are converted to this cache manager's format
+        unindexed_files = self._find_unindexed_files()
+        if len(unindexed_files) == 0 and len(self._query("SELECT key FROM entries WHERE path NOT LIKE '%/%' LIMIT 1")) == 0:
+            return 0
+
+        partitioned = 0
+        with FileLock(os.path.join(self.cache_directory, LOCK_DIRECTORY, "layout.lock")):
+            # files cached before the index existed are added to it first
+            for file_name, keys, format in self._find_unindexed_files():
+                if len(self._query("SELECT key FROM entries WHERE key = ?", (self._create_key(keys),))) == 0:
+                    self._index_file(keys, file_name, format)
+
+            rows = self._query("SELECT organisation, course, run, dataset FROM entries WHERE path NOT LIKE '%/%'")
+            for organisation, course, run, dataset in rows:
+                keys = tuple(value for value in (organisation, course, run) if value is not None) + (dataset,)
+                with self.lock(*keys):
+                    if self._partition_entry(keys):
+                        partitioned += 1
+        return partitioned
+
+    def _partition_entry(self, keys):
+        entry = self.get_entry(*keys)
+        if entry is None or "/" in entry["path"]:
+            return False
+
+        print("partitioning  - {}".format(entry["key"]))
+        files = [(entry["path"], entry["format"], None)]
+        files += [(path, format, segment) for segment, path, format in self._query("SELECT segment, path, format FROM segments WHERE key = ? ORDER BY segment", (entry["key"],))]
+        for path, format, segment in files:
+            try:
+                data_frame = self._read_file(path, format, entry["dataset"])
+            except FileNotFoundError:
+                # the file has been deleted, remove the entry
+                self._remove_entry(entry["key"], entry["path"])
+                return False
+
+            if segment is None:
+                to_file_name = self._get_file_name(keys)
+                self._write_file(data_frame, to_file_name)
+                self._execute(
+                    "UPDATE entries SET path = ?, format = ?, bytes = ? WHERE key = ?", 
+                    (to_file_name, self.format.name, os.path.getsize(os.path.join(self.cache_directory, to_file_name)), entry["key"]))
+            else:
+                to_file_name = self._get_file_name(keys, "_segment{}".format(segment))
+                self._write_file(data_frame, to_file_name)
+                self._execute(
+                    "UPDATE segments SET path = ?, format = ?, bytes = ? WHERE key = ? AND segment = ?", 
+                    (to_file_name, self.format.name, os.path.getsize(os.path.join(self.cache_directory, to_file_name)), entry["key"], segment))
+            self._remove_file(path)
+
+        if self.memory_cache is not None:
+            self.memory_cache.discard((self.cache_directory, entry["key"]))
+        return True
+
+    def _index_file(self, keys, file_name, format):
+        # add a file cached before the index existed to it, using its modified time
+        path = os.path.join(self.cache_directory, file_name)
+        organisation, course, run, dataset = _split_keys(keys)
+        values = (self._create_key(keys), organisation, course, run, dataset, file_name, format, 
+            os.path.getmtime(path), None, os.path.getsize(path), None, None, None, None)
+        self._save_entry(values)
+        return dict(zip(ENTRY_COLUMNS, values))
+
+    def _find_unindexed_files(self):
+        # the (file name, keys, format) of the files in the flat layout which aren't in the index
+        files = []
+        for file_name in sorted(os.listdir(self.cache_directory)):
+            if not os.path.isfile(os.path.join(self.cache_directory, file_name)):
+                continue
+            name, format = _split_extension(file_name)
+            keys = None if name is None else _parse_file_keys(name)
+            if keys is not None and not self._is_indexed(file_name):
+                files.append((file_name, keys, format))
+        return files
+
+    def _is_indexed(self, file_name):
+        return len(self._query("SELECT path FROM entries WHERE path = ? UNION SELECT path FROM segments WHERE path = ?", (file_name, file_name))) > 0
+
+    def _list_files(self):
+        # the paths of all the files in the cache directory and partition directories, relative to the cache directory
+        file_names = []
+        for directory, directories, files in os.walk(self.cache_directory):
+            # lock files aren't cache files
+            directories[:] = sorted(name for name in directories if name != LOCK_DIRECTORY)
+            relative_directory = os.path.relpath(directory, self.cache_directory)
+            for name in sorted(files):
+                file_names.append(name if relative_directory == "." else _join_path(relative_directory.replace(os.sep, "/"), name))
+        return file_names
+
+    def _add_entry(self, keys, file_name, rows, url=None, content_hash=None, etag=None, last_modified=None):
+        key = self._create_key(keys)
+
+        # any appended segments are replaced by the new data
+        self._remove_segments(key)
+
+        # the old file is removed if the new one has a different name e.g. it is compressed
+        old_rows = self._query("SELECT path FROM entries WHERE key = ?", (key,))
+        if len(old_rows) > 0 and old_rows[0][0] != file_name:
+            self._remove_file(old_rows[0][0])
+
+        organisation, course, run, dataset = _split_keys(keys)
+        self._save_entry(
+            (key, organisation, course, run, dataset, file_name, self.format.name, time.time(), 
+            rows, os.path.getsize(os.path.join(self.cache_directory, file_name)), content_hash, url, etag, last_modified))
+        self._execute("DELETE FROM missing WHERE key = ?", (key,))
+
+        print("saving cache  - {}".format(key))
+
+        if self.max_size is not None:
+            self._evict(self.max_size, self.eviction, self.inactive_runs, keep=key)
+
+    def _write_file(self, data_frame, file_name):
+        # write to a temporary file which is renamed when it is complete
+        path = os.path.join(self.cache_directory, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = _temp_path(path)
+        with metrics.span("cache write", file_name) as span:
+            try:
+                self.format.write(_drop_partition_columns(data_frame, file_name), temp_path)
+                os.replace(temp_path, path)
+            except BaseException:
+                self._remove_file(os.path.relpath(temp_path, self.cache_directory))
+                raise
+            span.bytes = os.path.getsize(path)
+            span.rows = len(data_frame)
+
+    def _evict(self, max_size, policy, inactive_runs, keep=None):
+        # remove entries until the cache is no bigger than max_size, returning the number of entries and bytes removed
+        if self.get_size() <= max_size:
+            return 0, 0
+
+        rows = self._query(
+            "SELECT entries.key, entries.organisation, entries.course, entries.run, entries.path, "
+            "COALESCE(entries.bytes, 0) + COALESCE(segments.bytes, 0), COALESCE(entries.accessed_at, entries.fetched_at), COALESCE(entries.hits, 0) "
+            "FROM entries LEFT JOIN (SELECT key, SUM(bytes) AS bytes FROM segments GROUP BY key) AS segments ON entries.key = segments.key")
+
+        size = sum(row[5] for row in rows)
+
+        def order(row):
+            key, organisation, course, run, path, entry_bytes, accessed_at, hits = row
+            active = (organisation, course, run) not in inactive_runs
+            if policy == "lfu":
+                return (active, hits, accessed_at)
+            return (active, accessed_at)
+
+        removed = 0
+        removed_bytes = 0
+        for key, organisation, course, run, path, entry_bytes, accessed_at, hits in sorted(rows, key=order):
+            if size <= max_size:
+                break
+            # the entry which has just been saved is kept
+            if key == keep:
+                continue
+
+            print("evicting      - {}".format(key))
+            metrics.count("evictions")
+            self._remove_entry(key, path)
+            size -= entry_bytes
+            removed += 1
+            removed_bytes += entry_bytes
+
+        return removed, removed_bytes
+
+    def _remove_stale_files(self):
+        # remove the files left by writers which never finished, returning the number of files and bytes removed
+        removed = 0
+        removed_bytes = 0
+        for file_name in self._list_files():
+            path = os.path.join(self.cache_directory, file_name)
+            if file_name.endswith(".writing") and time.time() - os.path.getmtime(path) > STALE_WRITING_AGE:
+                print("removing      - {}".format(file_name))
+                removed_bytes += os.path.getsize(path)
+                self._remove_file(file_name)
+                removed += 1
+        return removed, removed_bytes
+
+    def _remove_deleted_entry(self, key):
+        # the file has been deleted, remove it from the index
+        self._remove_segments(key)
+        self._execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _remove_entry(self, key, path):
+        self._remove_segments(key)
+        self._remove_file(path)
+        self._execute("DELETE FROM entries WHERE key = ?", (key,))
+        if self.memory_cache is not None:
+            self.memory_cache.discard((self.cache_directory, key))
+
+    def _record_access(self, key):
+        self._execute("UPDATE entries SET accessed_at = ?, hits = COALESCE(hits, 0) + 1 WHERE key = ?", (time.time(), key))
+
+    def _get_from_memory(self, entry, columns):
+        if self.memory_cache is not None:
+            data_frame = self.memory_cache.get((self.cache_directory, entry["key"]), _entry_version(entry))
+            if data_frame is not None and columns is not None:
+                # only some of the columns were asked for
+                if not all(column in data_frame.columns for column in columns):
+                    return None
+                data_frame = data_frame[columns]
+            return data_frame
+
+    def _put_in_memory(self, entry, data_frame):
+        if self.memory_cache is not None and entry is not None:
+            self.memory_cache.put((self.cache_directory, entry["key"]), _entry_version(entry), data_frame)
+
+    def _read_segments(self, key, dataset=None, since=0, columns=None, filters=None):
+        rows = self._query("SELECT path, format FROM segments WHERE key = ? AND fetched_at > ? ORDER BY segment", (key, since))
+        if len(rows) > 0:
+            segment_dfs = [self._read_file(path, format, dataset, columns=columns, filters=filters) for path, format in rows]
+            return apply_schema(pd.concat(segment_dfs, ignore_index=True), dataset)
+
+    def _get_dataset(self, file_name):
+        # the dataset a cache file is for, using the index
+        rows = self._query(
+            "SELECT dataset FROM entries WHERE path = ? UNION SELECT entries.dataset FROM segments JOIN entries ON segments.key = entries.key WHERE segments.path = ?",
+            (file_name, file_name))
+        if len(rows) > 0:
+            return rows[0][0]
+
+    def _remove_segments(self, key):
+        rows = self._query("SELECT path FROM segments WHERE key = ?", (key,))
+        for (path,) in rows:
+            self._remove_file(path)
+        if len(rows) > 0:
+            self._execute("DELETE FROM segments WHERE key = ?", (key,))
+
+    def _remove_file(self, path):
+        try:
+            os.remove(os.path.join(self.cache_directory, path))
+        except FileNotFoundError:
+            pass
+
+        # remove the partition directories which are now empty
+        directory = os.path.dirname(path)
+        while directory != "":
+            try:
+                os.rmdir(os.path.join(self.cache_directory, directory))
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def _get_path(self, entry):
+        return os.path.join(self.cache_directory, entry["path"])
 
     def _create_key(self, ids):
-        return "_".join(map(str, ids))
+        # "_" and "%" are escaped in all but the last id (the dataset) so keys are never ambiguous,
+        # e.g. ("org", "my_course", 1, "comments") and ("org_my", "course", 1, "comments")
+        ids = list(map(str, ids))
+        ids[:-1] = [id.replace("%", "%25").replace("_", "%5F") for id in ids[:-1]]
+        return "_".join(ids)
+
+    def _save_entry(self, values):
+        # when an entry is replaced, when it was last read and how often are kept
+        self._execute(
+            "INSERT OR REPLACE INTO entries ({}, accessed_at, hits) VALUES ({}, (SELECT accessed_at FROM entries WHERE key = ?), (SELECT hits FROM entries WHERE key = ?))".format(
+                ", ".join(ENTRY_COLUMNS), ", ".join("?" * len(ENTRY_COLUMNS))),
+            tuple(values) + (values[0], values[0]))
+
+    def _connect(self):
+        return sqlite3.connect(self._index_path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def _query(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+def migrate_cache(cache_directory=None, format="parquet", from_format="csv", compression=None, layout="flat"):
+    """
+    Converts all the files in a cache directory to a different format.
+
+    :param string cache_directory:
+        The cache directory, if `None` (default) the directory ~/.fl-data-dl-cache
+
+    :param string format:
+        The format to convert to, defaults to "parquet".
+
+    :param string from_format:
+        The format of the existing cache files, defaults to "csv".
+
+    :param string compression:
+        The compression to use, "gzip" or "zstd". Defaults to `None`.
+
+    :param string layout:
+        The layout of the cache files, "flat" (default) or "partitioned". 
+        Files in the flat layout are moved into partition directories if 
+        "partitioned" is used.
+
+    :return:
+        The number of files converted.
+    """
+    return CacheManager(cache_directory, True, format=format, compression=compression, layout=layout).migrate(from_format)
+
+def _upgrade_index(conn):
+    # add any columns missing from an index created by an older version
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(entries)")]
+    with conn:
+        for column, column_type in INDEX_UPGRADES.items():
+            if column not in columns:
+                conn.execute("ALTER TABLE entries ADD COLUMN {} {}".format(column, column_type))
+
+def _is_fresh(entry, expiry):
+    # does the cache expire? is the entry older than the expiry datetime?
+    return expiry is None or expiry.timestamp() < entry["fetched_at"]
+
+def _temp_path(path):
+    # a temporary path to write a file to, which is different for each process and thread. it starts 
+    # with "." so it is ignored by pyarrow and DuckDB when reading partition directories
+    directory, file_name = os.path.split(path)
+    return os.path.join(directory, ".{}.{}-{}.writing".format(file_name, os.getpid(), threading.get_ident()))
+
+def _entry_version(entry):
+    # the data in memory is the same as the cache file if these haven't changed
+    return (entry["path"], entry["fetched_at"], entry["rows"], entry["bytes"])
+
+def _copy_data_frame(df):
+    # with copy-on-write a shallow copy is enough to stop the data being changed
+    return df.copy(deep=not _copy_on_write())
+
+def _copy_on_write():
+    # pandas 3 always uses copy-on-write, earlier versions can turn it on
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    try:
+        return pd.get_option("mode.copy_on_write") is True
+    except KeyError:
+        return False
+
+def _filter_data_frame(df, filters):
+    # the rows of a data frame which match all the (column, operator, value) filters
+    if not filters:
+        return df
+
+    mask = pd.Series(True, index=df.index)
+    for column, operator, value in filters:
+        series = df[column]
+        if operator == "==":
+            matches = series == value
+        elif operator == "!=":
+            matches = series != value
+        elif operator == "<":
+            matches = series < value
+        elif operator == "<=":
+            matches = series <= value
+        elif operator == ">":
+            matches = series > value
+        elif operator == ">=":
+            matches = series >= value
+        elif operator == "in":
+            matches = series.isin(value)
+        elif operator == "not in":
+            matches = ~series.isin(value)
+        else:
+            raise ValueError("[{}] is not a valid filter operator. The options are: {}".format(operator, ", ".join(FILTER_OPERATORS)))
+        # comparisons with missing values are false
+        mask &= matches.fillna(False).astype(bool)
+
+    return df[mask].reset_index(drop=True)
+
+def _read_columns(columns, filters):
+    # the columns to read to return the columns and apply the filters
+    if columns is None:
+        return None
+    columns = list(columns)
+    for column, operator, value in filters or []:
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+def _select_columns(df, columns):
+    if columns is None or list(df.columns) == list(columns):
+        return df
+    return df[list(columns)]
+
+def _partition_directory(keys):
+    # the hive style partition directory for the keys e.g. organisation=raspberry-pi/dataset=enrolments/course=programming-101/run=1
+    organisation, course, run, dataset = _split_keys(keys)
+    partitions = [("organisation", organisation), ("dataset", dataset), ("course", course), ("run", run)]
+    return "/".join("{}={}".format(name, quote(str(value), safe="")) for name, value in partitions if value is not None)
+
+def _partition_values(file_name):
+    # the values of the partition columns in the path of a cache file e.g. {"course": "programming-101", "run": 1}
+    values = {}
+    for directory in file_name.split("/")[:-1]:
+        name, _, value = directory.partition("=")
+        if name in PARTITION_COLUMNS:
+            values[name] = int(value) if name == "run" else unquote(value)
+    return values
+
+def _drop_partition_columns(data_frame, file_name):
+    # the columns in the partition directory names aren't stored in the file
+    columns = [column for column in _partition_values(file_name) if column in data_frame.columns]
+    if len(columns) == 0:
+        return data_frame
+    return data_frame.drop(columns=columns)
+
+def _add_partition_columns(data_frame, partition, dataset):
+    if len(partition) == 0:
+        return data_frame
+    for position, column in enumerate(PARTITION_COLUMNS):
+        if column in partition and column not in data_frame.columns:
+            data_frame.insert(position, column, partition[column])
+    return apply_schema(data_frame, dataset)
+
+def _join_path(directory, file_name):
+    # paths in the index always use "/"
+    if directory == "":
+        return file_name
+    return directory + "/" + file_name
+
+def _to_arrow_table(data_frame):
+    # categories are stored with 32 bit indices, so the files for different runs have the 
+    # same schema and can be read as one dataset
+    import pyarrow as pa
+    table = pa.Table.from_pandas(data_frame, preserve_index=False)
+    fields = [field.with_type(pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered)) if pa.types.is_dictionary(field.type) else field for field in table.schema]
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+def _parse_file_keys(name):
+    # the keys of a cache file's name without its extension e.g. raspberry-pi_programming-101_1_comments,
+    # None if it isn't the name of a cache file. the run is the last number and the dataset the rest 
+    # of the name after it, files cached before "_" was escaped are assumed to have an organisation 
+    # without "_" in it
+    if re.search(r"_segment\d+$", name) is not None:
+        return None
+
+    parts = [unquote(part) for part in name.split("_")]
+    runs = [index for index, part in enumerate(parts[:-1]) if index >= 2 and part.isdigit()]
+    if len(runs) > 0:
+        run = runs[-1]
+        return (parts[0], "_".join(parts[1:run]), int(parts[run]), "_".join(parts[run + 1:]))
+    if len(parts) >= 2:
+        return (parts[0], "_".join(parts[1:]))
+    return None
+
+def _split_keys(keys):
+    # keys are organisation, [course, run,] dataset
+    organisation = str(keys[0])
+    dataset = str(keys[-1])
+    course = str(keys[1]) if len(keys) > 2 else None
+    run = int(keys[2]) if len(keys) > 3 else None
+    return organisation, course, run, dataset
+
+def _where(**filters):
+    # create a sql where clause for the filters which are not None
+    clauses = []
+    params = []
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append("{} = ?".format(column))
+            params.append(value)
+    
+    if len(clauses) == 0:
+        return "", ()
+    return " WHERE " + " AND ".join(clauses), tuple(params)
+
+def _get_format(format, compression=None):
+    if format not in CACHE_FORMATS:
+        raise ValueError("Unknown cache format [{}]. The options are: {}".format(format, ", ".join(CACHE_FORMATS)))
+    return CACHE_FORMATS[format](compression)
+
+def _check_compression(compression):
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError("Unknown cache compression [{}]. The options are: {}".format(compression, ", ".join(COMPRESSIONS)))
+
+def _check_layout(layout):
+    if layout not in CACHE_LAYOUTS:
+        raise ValueError("Unknown cache layout [{}]. The options are: {}".format(layout, ", ".join(CACHE_LAYOUTS)))
+    return layout
+
+def _check_eviction(eviction):
+    if eviction not in EVICTION_POLICIES:
+        raise ValueError("Unknown cache eviction policy [{}]. The options are: {}".format(eviction, ", ".join(EVICTION_POLICIES)))
+    return eviction
+
+def _split_extension(file_name):
+    # the name without the extension and the format of a cache file in the flat layout, 
+    # (None, None) if it isn't a cache file e.g. the index or a temporary file
+    if file_name.startswith("."):
+        return None, None
+    if "." not in file_name:
+        return file_name, "csv"
+    for extension in [".csv" + extension for extension in COMPRESSIONS.values()] + [ParquetFormat.extension]:
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)], "csv" if extension.startswith(".csv") else "parquet"
+    return None, None
+
+def _strip_extension(file_name, format, partitioned=False):
+    # returns the key (or, for partitioned files, the name without the extension) for a 
+    # cache file in the given format or None if it isn't one
+    if file_name.startswith("."):
+        return None
+
+    if partitioned and format.extension == "":
+        # uncompressed csv files in partition directories have the extension .csv
+        return file_name[:-len(".csv")] if file_name.endswith(".csv") else None
+
+    if format.extension == "":
+        # files with no extension are csv files
+        if "." in file_name:
+            return None
+        return file_name
+
+    if file_name.endswith(format.extension):
+        return file_name[:-len(format.extension)]
@@ -0,0 +1,140 @@
+import socket
+import threading
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+# the maximum number of connections kept open to each host
+DEFAULT_POOL_SIZE = 10
+
+# the (connect, read) timeout in seconds for requests which don't set one
+DEFAULT_TIMEOUT = (10, 60)
+
+# the number of seconds a connection is idle before tcp keep-alive probes are sent
+KEEP_ALIVE_IDLE = 60
+
+# the adapter shared by all sessions in the process
+_config = {"pool_size": DEFAULT_POOL_SIZE, "timeout": DEFAULT_TIMEOUT, "keep_alive": True}
+_adapter = None
+_adapter_lock = threading.Lock()
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    A `requests` HTTP adapter which keeps a pool of connections open to each
+    host, sets a timeout on requests which don't have one and counts how many
+    requests reused an open connection.
+
+    :param integer pool_size:
+        The maximum number of connections kept open to each host.
+
+    :param tuple timeout:
+        The (connect, read) timeout in seconds.
+
+    :param boolean keep_alive:
+        Whether to enable tcp keep-alive on connections, so idle connections
+        aren't dropped by firewalls and proxies.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, keep_alive=True):
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._lock = threading.Lock()
+        # the stats of pools which have been closed
+        self._closed_requests = 0
+        self._closed_connections = 0
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.keep_alive:
+            pool_kwargs["socket_options"] = _keep_alive_socket_options()
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+        # keep the stats of pools when they are closed
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+        def dispose_pool(pool):
+            with self._lock:
+                self._closed_requests += pool.num_requests
+                self._closed_connections += pool.num_connections
+            if dispose is not None:
+                dispose(pool)
+        pools.dispose_func = dispose_pool
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+    def get_stats(self):
+        """
+        Returns a dictionary of the number of `requests` made, the number of
+        `connections` opened and the number of requests which `reused` an
+        open connection.
+        """
+        pools = self.poolmanager.pools
+        with self._lock:
+            requests = self._closed_requests
+            connections = self._closed_connections
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests += pool.num_requests
+                    connections += pool.num_connections
+
+        return {"requests": requests, "connections": connections, "reused": max(requests - connections, 0)}
+
+def configure_http(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, keep_alive=True):
+    """
+    Configures the connections used to download data. Sessions created by
+    `login` after this is called use the new settings.
+
+    :param integer pool_size:
+        The maximum number of connections kept open to FutureLearn, should be
+        at least the number of workers. Defaults to `10`.
+
+    :param tuple timeout:
+        The (connect, read) timeout in seconds, defaults to `(10, 60)`.
+
+    :param boolean keep_alive:
+        Whether to enable tcp keep-alive on connections. Defaults to `True`.
+    """
+    global _adapter
+    with _adapter_lock:
+        _config.update(pool_size=pool_size, timeout=timeout, keep_alive=keep_alive)
+        _adapter = None
+
+def get_adapter():
+    """
+    Returns the :class:`PooledHTTPAdapter` shared by all sessions.
+    """
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = PooledHTTPAdapter(**_config)
+        return _adapter
+
+def get_connection_stats():
+    """
+    Returns the number of requests made, connections opened and requests
+    which reused a connection by the shared adapter e.g.
+    `{"requests": 120, "connections": 4, "reused": 116}`
+    """
+    return get_adapter().get_stats()
+
+def mount_adapter(session):
+    """
+    Mounts the shared adapter on a `requests.Session` and asks for
+    compressed responses.
+    """
+    adapter = get_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+def _keep_alive_socket_options():
+    options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # the idle time can only be set on some platforms
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEP_ALIVE_IDLE))
+    return options
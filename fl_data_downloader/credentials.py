@@ -1,13 +1,28 @@
 import os
+import json
+import time
 import configparser
 import mechanicalsoup
 
 from getpass import getpass
+from requests.cookies import create_cookie
 
 from .exceptions import NeedToLoginException
+from .connections import mount_adapter
+from .instrumentation import metrics
 
 CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".fl-data-dl")
 
+# the logged in session cookies are stored so the next process doesn't need to login
+SESSION_PATH = CONFIG_PATH + "-session"
+
+# how long a stored session is used for, in seconds - 7 days
+SESSION_MAX_AGE = 7 * 24 * 60 * 60
+
+SIGN_IN_URL = "https://www.futurelearn.com/sign-in"
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 6.3; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2840.71 Safari/537.36'
+
 def get_credentials():
     # are there credentials in the config file?
     config = configparser.ConfigParser()
@@ -47,27 +62,122 @@ def store_credentials():
     with open(CONFIG_PATH, 'w') as configfile:
         config.write(configfile)
 
-def login(credentials=None):
+    # the stored session may be for a different user
+    clear_session()
+
+def clear_session():
+    """
+    Removes the stored login session, the next call to `login` will sign in
+    to FutureLearn.
+    """
+    if os.path.exists(SESSION_PATH):
+        os.remove(SESSION_PATH)
+
+def login(credentials=None, use_session=True):
     """
     Logs in to FutureLearn. 
     
     Returns a mechanicalsoup.StatefulBrowser which is required to get data.
+    The browser uses the connection pool shared by the process, see
+    `configure_http`.
+
+    The session cookies are stored in `~/.fl-data-dl-session` and reused by
+    the next call to `login`, even in another process, so FutureLearn is only
+    signed in to when the stored session has expired. If FutureLearn asks
+    to sign in again, `FutureLearnData` logs in again automatically.
 
     :param List credentials:
         Optional: A list of [user, password] to login.
+
+    :param boolean use_session:
+        Whether to use and store the session cookies. Defaults to `True`.
     
     :return:
         A browser object required by [get data] methods.
     """
-    if credentials is None:
+    b = mechanicalsoup.StatefulBrowser(soup_config={'features':'lxml'}, raise_on_404=True, user_agent=USER_AGENT,)
+    mount_adapter(b.session)
+    b.fl_credentials = credentials
+    b.fl_use_session = use_session
+
+    user = credentials[0] if credentials is not None else None
+    if use_session and _load_session(b, user):
+        print("using session - {}".format(SESSION_PATH))
+    else:
+        _sign_in(b)
+
+    return b
+
+def relogin(browser):
+    """
+    Signs in to FutureLearn again using a browser returned by `login`,
+    updating its session cookies.
+    """
+    print("logging in    - session expired")
+    browser.session.cookies.clear()
+    _sign_in(browser)
+
+def _sign_in(b):
+    if b.fl_credentials is None:
         user, pw = get_credentials()
     else:
-        user = credentials[0]
-        pw = credentials[1]
-    b = mechanicalsoup.StatefulBrowser(soup_config={'features':'lxml'}, raise_on_404=True, user_agent='Mozilla/5.0 (Windows NT 6.3; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2840.71 Safari/537.36',)
-    b.open("https://www.futurelearn.com/sign-in")
-    b.select_form('form[action="/sign-in"]')
-    b["email"] = user
-    b["password"] = pw
-    response = b.submit_selected()
-    return b
\ No newline at end of file
+        user = b.fl_credentials[0]
+        pw = b.fl_credentials[1]
+
+    with metrics.span("login", SIGN_IN_URL):
+        b.open(SIGN_IN_URL)
+        b.select_form('form[action="/sign-in"]')
+        b["email"] = user
+        b["password"] = pw
+        response = b.submit_selected()
+
+    if b.fl_use_session:
+        _save_session(b, user)
+
+    return response
+
+def _save_session(b, user):
+    cookies = [{
+        "name": cookie.name, 
+        "value": cookie.value, 
+        "domain": cookie.domain, 
+        "path": cookie.path, 
+        "expires": cookie.expires, 
+        "secure": cookie.secure
+        } for cookie in b.session.cookies]
+
+    session = {"user": user, "saved_at": time.time(), "cookies": cookies}
+
+    # the session gives access to the account, so only the user can read it
+    file_descriptor = os.open(SESSION_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, "w") as session_file:
+        json.dump(session, session_file)
+
+def _load_session(b, user=None):
+    # load the stored session cookies into the browser, returns False if 
+    # there isn't a valid session
+    try:
+        with open(SESSION_PATH) as session_file:
+            session = json.load(session_file)
+    except (OSError, ValueError):
+        return False
+
+    try:
+        if user is not None and session["user"] != user:
+            return False
+
+        now = time.time()
+        if now - session["saved_at"] > SESSION_MAX_AGE:
+            return False
+
+        cookies = [cookie for cookie in session["cookies"] if cookie["expires"] is None or cookie["expires"] > now]
+    except (KeyError, TypeError):
+        return False
+
+    if len(cookies) == 0:
+        return False
+
+    for cookie in cookies:
+        b.session.cookies.set_cookie(create_cookie(**cookie))
+
+    return True
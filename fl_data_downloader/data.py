@@ -1,28 +1,37 @@
 import csv
+import hashlib
 import os
-import re
+import pickle
+import tempfile
+import threading
 
 import pandas as pd
+import requests
 from mechanicalsoup import LinkNotFoundError
 
-from requests.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor
 
 from datetime import datetime, timedelta, date
-from io import StringIO
-from time import sleep
 
-from .credentials import login
+from .credentials import login, relogin
 from .exceptions import (
     NeedToLoginException, 
     DatasetNotKnownException, 
     DatasetNotFoundForCourse, 
-    CourseRunNotFound,
-    ConnectionErrorMaxRetriesExceeded
+    CourseRunNotFound
 )
-from .cache import CacheManager
-
-STATS_URL = "https://www.futurelearn.com/admin/courses/{course}/{run}/stats-dashboard/data/{dataset}"
-COUNTRIES_DEMOGRAPHICS_URL = "https://www.futurelearn.com/admin/courses/{course}/{run}/demographics/countries/{dataset}-dataset"
+from .cache import CacheManager, DEFAULT_MISSING_TTL, _filter_data_frame, _select_columns
+from .retry import RetryPolicy
+from .schemas import read_csv, to_csv, apply_schema
+from .parsers import parse_runs_page, parse_steps_page
+from .query import DatasetQuery
+from .instrumentation import metrics
+
+FUTURELEARN_URL = "https://www.futurelearn.com"
+STATS_URL = FUTURELEARN_URL + "/admin/courses/{course}/{run}/stats-dashboard/data/{dataset}"
+COUNTRIES_DEMOGRAPHICS_URL = FUTURELEARN_URL + "/admin/courses/{course}/{run}/demographics/countries/{dataset}-dataset"
+RUNS_URL = FUTURELEARN_URL + "/admin/organisations/{organisation}/runs"
+STEPS_URL = FUTURELEARN_URL + "/admin/courses/{course}/{run}/overview#step-types"
 
 DATASET_URLS = {
     "archetype_survey_responses": STATS_URL,
@@ -45,6 +54,16 @@ DATASET_URLS = {
 
 AVAILABLE_DATASETS = DATASET_URLS.keys()
 
+# datasets which mostly grow while a run is active and the columns which identify each row,
+# when `incremental` is used only new rows are added to the cache, if rows already in the
+# cache have changed (e.g. a learner has unenrolled) the cached data is replaced
+INCREMENTAL_DATASETS = {
+    "comments": ["id"],
+    "enrolments": ["learner_id"],
+    "question_response": ["learner_id", "quiz_question", "submitted_at"],
+    "step_activity": ["learner_id", "step"],
+}
+
 # a course run is inactive after this time from the start date 
 # datasets are no longer downloaded if in cache for inactive courses
 #  12 weeks
@@ -56,8 +75,15 @@ CACHE_EXPIRY_TIME = 12 * 60 *60
 # debug - make cache expire after 1 second
 # CACHE_EXPIRY_TIME = 1
 
-# the time to wait after a ConnectionError before retrying
-RETRY_TIME = 30
+# the size of the blocks datasets are downloaded in
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# the default number of rows returned by each iteration of iter_dataset
+DEFAULT_CHUNKSIZE = 100000
+
+# prefetch also refreshes datasets which will expire within this time
+#  1 hour
+DEFAULT_PREFETCH_AHEAD = 60 * 60
 
 class FutureLearnData:
     """
@@ -109,24 +135,93 @@ class FutureLearnData:
 
     :param integer max_retries:
         The maximum number of times to try and download a dataset 
+
+    :param RetryPolicy retry_policy:
+        Decides when failed requests are retried and limits the rate of 
+        requests, see :class:`RetryPolicy`. If `None` (default) failed 
+        requests are tried `max_retries` times with exponential backoff.
+
+    :param string cache_format:
+        The format cache files are stored in, "csv" (default) or "parquet".
+        The parquet format keeps column types and is quicker to read but
+        requires `pyarrow`.
+
+    :param integer max_workers:
+        The number of course runs to download at the same time when getting
+        a dataset for a course or courses. Defaults to `1`, which downloads
+        each run one after the other.
+
+    :param boolean incremental:
+        If `True`, when the comments, enrolments, question_response and 
+        step_activity datasets are refreshed only the new rows are added to 
+        the cache, see `get_dataset_delta`. If rows already in the cache have 
+        changed the cached dataset is replaced. Defaults to `False`.
+
+    :param memory_cache:
+        Datasets read from the cache are kept in memory, so getting them 
+        again is quick. `True` (default) uses a 256MB memory cache shared by 
+        all `FutureLearnData` objects, a :class:`MemoryCache` uses that cache
+        and `False` doesn't keep datasets in memory.
+
+    :param string cache_compression:
+        The compression used for cache files, "gzip" or "zstd". If `None`
+        (default) csv files aren't compressed and parquet files use snappy.
+
+    :param integer max_cache_size:
+        The maximum number of bytes used by the cache files. When the cache
+        is bigger, entries for runs which are no longer active are removed
+        first, then the least recently or least often read entries. If 
+        `None` (default) the cache isn't limited.
+
+    :param string cache_eviction:
+        How entries are chosen to be removed when the cache is bigger than
+        `max_cache_size`, "lru" (least recently used, default) or "lfu"
+        (least frequently used).
+
+    :param integer missing_ttl:
+        When a dataset isn't available for a run, it is recorded in the cache
+        and isn't requested again for this number of seconds. Defaults to 7
+        days.
+
+    :param string cache_layout:
+        How the cache files are stored, "flat" (default) files in the cache 
+        directory or "partitioned" hive style directories e.g. 
+        `organisation=raspberry-pi/dataset=enrolments/course=programming-101/run=1`,
+        which can be read as one dataset by pyarrow or DuckDB. An existing
+        flat cache is moved into partition directories.
     """
-    def __init__(self, organisation, browser=None, use_cache=True, cache_directory=None, max_retries=3):
+    def __init__(self, organisation, browser=None, use_cache=True, cache_directory=None, max_retries=3, max_workers=1, cache_format="csv", incremental=False, retry_policy=None, memory_cache=True, 
+        cache_compression=None, max_cache_size=None, cache_eviction="lru", missing_ttl=DEFAULT_MISSING_TTL, cache_layout="flat"):
         
         self._organisation = organisation
-        self._cache_manager = CacheManager(cache_directory, use_cache)
+        self._cache_manager = CacheManager(cache_directory, use_cache, format=cache_format, memory_cache=memory_cache, 
+            compression=cache_compression, max_size=max_cache_size, eviction=cache_eviction, missing_ttl=missing_ttl, layout=cache_layout)
         self._cache_directory = cache_directory
         self._use_cache = use_cache
         self._max_retries = max_retries
+        self._retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_retries=max_retries)
+        self._max_workers = max_workers
+        self._incremental = incremental
 
         if browser is None:
             browser = login()
         self._browser = browser
 
+        # the browser is only used by the thread which created this object,
+        # worker threads each get their own session
+        self._thread = threading.current_thread()
+        self._local = threading.local()
+
+        # the number of times FutureLearn has been logged into again
+        self._login_count = 0
+        self._login_lock = threading.Lock()
+
         # a property which will hold all the runs for the organisation
         self._runs = None
 
-        # the number of failed requests in a row
-        self._failed_requests = 0
+        # the runs indexed by (course, run) and the runs of each course, built when the runs are loaded
+        self._run_index = None
+        self._course_runs = None
 
     def get_dataset(self, course, run, dataset):
         """
@@ -147,41 +242,83 @@ class FutureLearnData:
 
         expiry = self._calc_cache_expiry(dataset, self.get_run_active_status(course, run))
         
-        df = self._cache_manager.get_data(self._organisation, course, run, dataset, expiry=expiry)
-        if df is None:
+        def download():
+            return self._load_dataset(self._download_dataset(course, run, dataset), course, run, dataset)
 
-            # get the campaign data file
-            url = DATASET_URLS[dataset].format(course=course, run=run, dataset=dataset)
-            downloaded = False
-            while not downloaded:
-                print("downloading   - {}_{}_{}_{}".format(self._organisation, course, run, dataset))
-                try:
-                    data = self._browser.open(url)
-                    self._failed_requests = 0
-                    downloaded = True
-                except ConnectionError as e:
-                    self._failed_requests += 1
-                    if self._failed_requests < self._max_retries:
-                        print("error - ConnectionError occurred - {}. Retrying in {} secs.".format(e, RETRY_TIME))
-                        sleep(RETRY_TIME)
-                    else:
-                        raise ConnectionErrorMaxRetriesExceeded("ConnectionError occurred. Max number of retries exceeded.")
-
-            data = data.content.decode("utf-8").strip()
-
-            # has a html page been returned? if so, you need to login
-            if data[0].find("<!DOCTYPE html>") > -1:
-                raise NeedToLoginException()
-            
-            df = pd.read_csv(StringIO(data))
-
-            # add the course and run columns
-            df.insert(0, "course", course)
-            df.insert(1, "run", run)
-
-            self._cache_manager.save_data(df, self._organisation, course, run, dataset)
+        return self._get_or_download((self._organisation, course, run, dataset), expiry, download)
+
+    def iter_dataset(self, course, run, dataset, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Gets a FutureLearn dataset for a specific run of a course a chunk of 
+        rows at a time, so the whole dataset is never held in memory. 
         
-        return df
+        The dataset is downloaded to a temporary file and each chunk is 
+        written to the cache as it is read.
+
+        :param string course:
+            The online course e.g. "programming-101"
+
+        :param integer run:
+            The number of the specific course run 
+
+        :param string dataset:
+            The name of the dataset e.g. "enrolments"
+
+        :param integer chunksize:
+            The maximum number of rows in each chunk, defaults to 100000.
+        
+        :return:
+            An iterator of `pandas.DataFrame`.
+        """
+        keys = (self._organisation, course, run, dataset)
+        expiry = self._calc_cache_expiry(dataset, self.get_run_active_status(course, run))
+
+        chunks = self._cache_manager.iter_data(*keys, expiry=expiry, chunksize=chunksize)
+        if chunks is None:
+            if self._incremental and dataset in INCREMENTAL_DATASETS:
+                # incremental datasets are compared with the whole cached dataset
+                df = self.get_dataset(course, run, dataset)
+                chunks = (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
+            else:
+                chunks = self._iter_download_once(keys, expiry, chunksize)
+
+        for chunk in chunks:
+            yield chunk
+
+    def get_dataset_delta(self, course, run, dataset, since=None):
+        """
+        Gets the rows which have been added to a dataset by incremental 
+        refreshes (see the `incremental` parameter), refreshing the dataset 
+        first if its cache has expired.
+
+        :param string course:
+            The online course e.g. "programming-101"
+
+        :param integer run:
+            The number of the specific course run 
+
+        :param string dataset:
+            The name of the dataset, one of "comments", "enrolments", 
+            "question_response" or "step_activity"
+
+        :param datetime since:
+            Only return rows added after this time. If `None` (default) all
+            the rows added since the dataset was last downloaded in full are
+            returned.
+
+        :return:
+            The new rows in a `pandas.DataFrame`.
+        """
+        if dataset not in INCREMENTAL_DATASETS:
+            raise DatasetNotKnownException("[{}] is not an incremental dataset. The options are: {}".format(dataset, ", ".join(INCREMENTAL_DATASETS)))
+
+        df = self.get_dataset(course, run, dataset)
+
+        delta_df = self._cache_manager.get_appended_data(self._organisation, course, run, dataset, since=since)
+        if delta_df is None:
+            delta_df = df.iloc[0:0]
+
+        return delta_df
 
     def get_dataset_for_course(self, course, dataset):
         """
@@ -197,27 +334,16 @@ class FutureLearnData:
             The dataset in a `pandas.DataFrame`.
         """
 
-        runs_df = self.runs
-        runs = runs_df[runs_df["course"] == course]["run"].sort_values().to_list()
+        runs = self._get_course_runs(course)
 
-        df = None
-        dataset_found = False
-        for run in runs:
-            try:
-                if not dataset_found:
-                    df = self.get_dataset(course, run, dataset)
-                    dataset_found = True
-                else:
-                    df = df.append(self.get_dataset(course, run, dataset), ignore_index=True)
-
-            except LinkNotFoundError:
-                pass
+        dfs = self._get_dataset_for_runs([(course, run) for run in runs], dataset)
+        dfs = [df for df in dfs if df is not None]
 
         # if no datasets were found for any course run raise an error
-        if not dataset_found:
+        if len(dfs) == 0:
             raise DatasetNotFoundForCourse
 
-        return df
+        return _concat(dfs, dataset)
 
     def get_dataset_for_courses(self, courses, dataset):
         """
@@ -232,21 +358,50 @@ class FutureLearnData:
         :return:
             The dataset in a `pandas.DataFrame`.
         """
-        first_course = True
-        dataset_df = None
-        
+        # get the runs for all the courses so they can be downloaded together
+        course_runs = []
         for course in courses:
-            try:
-                dataset_for_course_df = self.get_dataset_for_course(course, dataset)
-                if first_course:
-                    dataset_df = dataset_for_course_df
-                    first_course = False
-                else:
-                    dataset_df = dataset_df.append(dataset_for_course_df, ignore_index=True)
-            except DatasetNotFoundForCourse:
-                    print("dataset [{}] was not found for course [{}].".format(dataset, course))
-            
-        return dataset_df
+            course_runs += [(course, run) for run in self._get_course_runs(course)]
+
+        dfs = self._get_dataset_for_runs(course_runs, dataset)
+
+        dataset_dfs = []
+        for course in courses:
+            course_dfs = [df for (run_course, run), df in zip(course_runs, dfs) if run_course == course and df is not None]
+            if len(course_dfs) > 0:
+                dataset_dfs += course_dfs
+            else:
+                print("dataset [{}] was not found for course [{}].".format(dataset, course))
+
+        if len(dataset_dfs) == 0:
+            return None
+
+        return _concat(dataset_dfs, dataset)
+
+    def query(self, dataset):
+        """
+        Returns a lazy query of a dataset for all the runs of the 
+        organisation's courses, which can be narrowed to some courses, runs,
+        columns and rows using `where`. Only the runs needed are read or 
+        downloaded and the columns and rows are filtered as they are read, 
+        so much less memory is used than getting all the runs and filtering 
+        them afterwards, see :class:`DatasetQuery`.
+
+        Example, the step activity for week 1 of a course::
+
+            fl = FutureLearnData("raspberry-pi")
+            df = fl.query("step_activity").where(course="programming-101", week_number=1).to_data_frame()
+
+        :param string dataset:
+            The name of the dataset e.g. "step_activity"
+
+        :return:
+            A :class:`DatasetQuery`.
+        """
+        if dataset not in AVAILABLE_DATASETS:
+            raise DatasetNotKnownException("[{}] is not a valid dataset".format(dataset))
+
+        return DatasetQuery(self, dataset)
 
     def get_courses(self):
         """
@@ -260,16 +415,17 @@ class FutureLearnData:
             The course data in a `pandas.DataFrame`.            
         """
         expiry = self._calc_cache_expiry("courses", True)
-        df = self._cache_manager.get_data(self._organisation, "courses", expiry=expiry)
-        if df is None:
+
+        def download():
             print("downloading   - {}_courses".format(self._organisation))
 
             # pull the unique runs and descriptions from the course runs
             df = self.runs[["course", "full_name"]].drop_duplicates()
             df.reset_index(drop=True, inplace=True)
             self._cache_manager.save_data(df, self._organisation, "courses")
+            return df
 
-        return df
+        return self._get_or_download((self._organisation, "courses"), expiry, download)
 
     def get_runs(self):
         """
@@ -279,41 +435,27 @@ class FutureLearnData:
             + course - the short "name" for the course e.g. "programming-101"
             + full_name - the full name of the course
             + run - the run number
-            + start_date - the date the run started
+            + start_date - the date the run started, as a datetime
             + status - the current status of the run
         
         :return:
             The run data in a `pandas.DataFrame`.
         """
         expiry = self._calc_cache_expiry("runs", True)
-        df = self._cache_manager.get_data(self._organisation, "runs", expiry=expiry)
-        if df is None:
+
+        def download():
             print("downloading   - {}_runs".format(self._organisation))
 
-            url = "https://www.futurelearn.com/admin/organisations/{}/runs".format(self._organisation)
+            url = RUNS_URL.format(organisation=self._organisation)
             response = self._get_futurelearn_page(url)
-            form = self._browser.select_form('form[class="m-table-filter__checkboxes"]')
 
-            course_runs = []
-            
-            # find the courses
-            courses = re.findall(b"course-meta__title(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)\n(.+?)data-order(.+?)\n(.+?)\n",response.content)
+            df = _parse_page(parse_runs_page, url, response.content)
 
-            for each in courses:
-                url_name = re.search(b'/courses/(.+?)/',each[0]).group(0).decode("utf-8")[:-1][9:]
-                full_name = re.search(b'">(.+?)</a>',each[0]).group(0).decode("utf-8")[:-4][2:]
-                run = int(re.search(b'/courses/(.+?)/(.+?)">',each[0]).group(0).decode("utf-8")[:-2].split("/")[-1])
-                # start_date = datetime.strptime(re.search(b"'(.+?)'",each[8]).group(0)[1:][:-1].decode("utf-8"),'%Y-%m-%d').date()
-                start_date = re.search(b"'(.+?)'",each[8]).group(0)[1:][:-1].decode("utf-8")
-                status = re.search(b'flag--(.+?)>(.+?)<',each[5]).group(0)[:-1].decode("utf-8").split(">")[1]
+            self._cache_manager.save_data(df, self._organisation, "runs", 
+                url=url, content_hash=hashlib.sha256(response.content).hexdigest())
+            return df
 
-                course_runs.append([url_name, full_name, run, start_date, status])
-
-            df = pd.DataFrame(course_runs, columns=["course", "full_name", "run", "start_date", "status"])
-
-            self._cache_manager.save_data(df, self._organisation, "runs")
-
-        return df
+        return self._get_or_download((self._organisation, "runs"), expiry, download)
 
     def get_steps_for_run(self, course, run):
         """
@@ -338,50 +480,20 @@ class FutureLearnData:
             The step data in a `pandas.DataFrame`.
         """
         expiry = self._calc_cache_expiry("steps-for-run", self.get_run_active_status(course, run))
-        df = self._cache_manager.get_data(self._organisation, course, run, "steps-for-run", expiry=expiry)
-        
-        if df is None:
+
+        def download():
             print("downloading   - {}_{}_{}_steps-for-run".format(self._organisation, course, run))
 
-            url = "https://www.futurelearn.com/admin/courses/{}/{}/overview#step-types".format(course, run)
+            url = STEPS_URL.format(course=course, run=run)
             response = self._get_futurelearn_page(url)
-            raw_page = response.content
-            search_keys = {
-                "video-articles":b'video-articles/(.+?)VI',
-                "discussions":b'discussions/(.+?)DI',
-                    "articles":b'/articles/(.+?)AR',
-                "quizzes":b'quizzes/(.+?)QU',
-                "exercises":b'exercises/(.+?)EX',
-                "assignments":b'assignments/(.+?)AS',
-                "assignment_reviews":b'assignment_reviews/(.+?)RV',
-                "assignment_reflections":b'assignment_reflections/(.+?)RE',
-                "poll_articles":b'poll-articles/(.+?)PL',
-                "audio_articles":b'audio-articles/(.+?)AU',
-                }
-
-            run_steps = []
-            # print(raw_page)
-            for key in search_keys:
-
-                raw_steps = re.findall(search_keys[key],raw_page)               
-                # print(key, len(raw_steps))
-
-                for raw_step in raw_steps:
-                    step_info = re.findall("(\d+)",raw_step.decode('utf-8'))
-                    # print(step_info)
-                    admin_url = "https://www.futurelearn.com/admin/{}/{}".format(key,step_info[0])
-
-                    step_id = step_info[1] + "." + step_info[2].zfill(2)
-                    week = step_info[1]
-                    step = step_info[2]
-                    step_type = key[:-1]
-                    run_steps.append([course, run, step_id, week, step, admin_url, step_type])
-
-            df = pd.DataFrame(run_steps, columns=["course", "run", "step_id", "week", "step", "admin_url", "step_type"])
-
-            self._cache_manager.save_data(df, self._organisation, course, run, "steps-for-run")
 
-        return df
+            df = _parse_page(parse_steps_page, url, response.content, course, run)
+
+            self._cache_manager.save_data(df, self._organisation, course, run, "steps-for-run", 
+                url=url, content_hash=hashlib.sha256(response.content).hexdigest())
+            return df
+
+        return self._get_or_download((self._organisation, course, run, "steps-for-run"), expiry, download)
 
     def get_steps_for_courses(self, courses=None):
         """
@@ -403,30 +515,88 @@ class FutureLearnData:
             The step data in a `pandas.DataFrame`.
 
         .. note::
-            If `courses` is `None` (default), all courses for the organisation are returned
+            If `courses` is `None` (default), all courses for the organisation are returned.
+            The runs are downloaded `max_workers` at a time.
 
         """
-        # get all the runs 
-        runs_df = self.get_runs()
-        steps_df = None
-
         # get the courses from the runs 
         if courses is None:
-            courses = runs_df["course"].unique()
+            courses = self.runs["course"].unique()
 
-        first_run = True
+        course_runs = []
         for course in courses:
+            course_runs += [(course, run) for run in self._get_course_runs(course)]
 
-            runs = runs_df[runs_df["course"] == course]["run"].to_list()
-
-            for run in runs:
-                if first_run:
-                    steps_df = self.get_steps_for_run(course, run)
-                    first_run = False
-                else:
-                    steps_df = steps_df.append(self.get_steps_for_run(course, run), ignore_index=True)
+        # collect the steps for each run and combine them once at the end
+        steps_dfs = self._map(lambda course_run: self.get_steps_for_run(*course_run), course_runs)
         
-        return steps_df
+        if len(steps_dfs) == 0:
+            return None
+
+        return _concat(steps_dfs, "steps-for-run")
+
+    def prefetch(self, courses=None, datasets=None, ahead=DEFAULT_PREFETCH_AHEAD, background=False):
+        """
+        Refreshes the datasets in the cache which have expired or will 
+        expire soon, so they can be read from the cache when they are needed.
+        Can be run on a schedule before the data is used e.g. using 
+        `fl-data-dl warm`.
+
+        The datasets are refreshed in order - active runs first, then 
+        enrolments (which are always refreshed), then the datasets for 
+        inactive runs which aren't in the cache. `max_workers` datasets are
+        downloaded at the same time.
+
+        Example, refresh the enrolments and comments for all courses in a 
+        background thread::
+
+            fl = FutureLearnData("raspberry-pi", max_workers=4)
+            future = fl.prefetch(datasets=["enrolments", "comments"], background=True)
+            print(future.result())
+
+        :param List courses:
+            A list of course names e.g. `["programming-101", "embedded-systems"]`.
+            If `None` (default) the datasets for all courses are refreshed.
+
+        :param List datasets:
+            The list of dataset names e.g. ["enrolments", "step_activity"]. 
+            If `None` (default) all datasets are refreshed.
+
+        :param integer ahead:
+            Datasets which will expire within this number of seconds are
+            also refreshed. Defaults to 1 hour.
+
+        :param boolean background:
+            If `True` the datasets are refreshed in a background thread and a
+            `concurrent.futures.Future` is returned. Defaults to `False`.
+
+        :return:
+            The datasets which needed refreshing as a `pandas.DataFrame` with
+            the columns course, run, dataset, active and result, which is
+            "refreshed", "not modified", "not found" or "fresh" (refreshed by
+            another thread or process).
+        """
+        if background:
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(self.prefetch, courses, datasets, ahead)
+            executor.shutdown(wait=False)
+            return future
+
+        if datasets is None:
+            datasets = AVAILABLE_DATASETS
+
+        for dataset in datasets:
+            if dataset not in AVAILABLE_DATASETS:
+                raise DatasetNotKnownException("[{}] is not a valid dataset".format(dataset))
+
+        tasks = self._get_prefetch_tasks(courses, datasets, ahead) if self._use_cache else []
+        print("prefetching   - {} datasets".format(len(tasks)))
+
+        results = self._map(lambda task: self._refresh_dataset(*task), tasks)
+
+        return pd.DataFrame(
+            [(course, run, dataset, active, result) for (course, run, dataset, active, refresh_before), result in zip(tasks, results)], 
+            columns=["course", "run", "dataset", "active", "result"])
 
     @property
     def runs(self):
@@ -436,9 +606,54 @@ class FutureLearnData:
         """
         # get the runs if it hasn't been already
         if self._runs is None:
-            self._runs = self.get_runs()
+            runs_df = self.get_runs()
+            self._run_index, self._course_runs = _index_runs(runs_df)
+            self._cache_manager.inactive_runs = self._cache_manager.inactive_runs | _inactive_runs(self._organisation, self._run_index)
+            self._runs = runs_df
         return self._runs
 
+    def get_dataset_availability(self, courses=None):
+        """
+        Returns which datasets are available for each run, for the runs and
+        datasets which have been requested. Datasets which aren't available
+        for a run are recorded when they are requested and aren't requested 
+        again until `missing_ttl` has passed.
+
+        Returns the data as a `pandas.DataFrame`:
+            + course - the short "name" for the course e.g. "programming-101"
+            + run - the run number
+            + dataset - the name of the dataset
+            + available - `True` if the dataset is available
+            + checked_at - when the dataset was last requested
+
+        :param List courses:
+            A list of course names e.g. `["programming-101", "embedded-systems"]`.
+            If `None` (default) all courses are returned.
+
+        :return:
+            The availability in a `pandas.DataFrame`.
+        """
+        df = self._cache_manager.get_availability(organisation=self._organisation)
+        if df is None:
+            return None
+
+        df = df[df["course"].notna()]
+        if courses is not None:
+            df = df[df["course"].isin(courses)]
+        df = df.drop(columns="organisation").reset_index(drop=True)
+        df["run"] = df["run"].astype(int)
+        return df
+
+    def get_cache_stats(self):
+        """
+        Returns the number of `hits`, `misses` and `evictions` of the memory
+        cache, the number of datasets in memory (`entries`) and the number 
+        of `bytes` they use, see :meth:`MemoryCache.get_stats`. `None` is
+        returned if datasets aren't kept in memory.
+        """
+        if self._cache_manager.memory_cache is not None:
+            return self._cache_manager.memory_cache.get_stats()
+
     def get_run_active_status(self, course, run):
         """
         Returns whether a run is still "active" and therefore data is still 
@@ -453,44 +668,408 @@ class FutureLearnData:
         :return:
             True is the course is "active", False if "inactive".
         """
-        # get the course run
-        run_df = self.runs[(self.runs["course"] == course) & (self.runs["run"] == run)]
+        start_date, status, active_until = self._get_run(course, run)
+        return datetime.now() < active_until
+
+    def get_runs_active_status(self, dataset=None):
+        """
+        Returns whether every run is "active", see `get_run_active_status`. 
+        The status of all the runs is calculated at once, which is much 
+        quicker than calling `get_run_active_status` for each run.
+
+        Returns the runs as a `pandas.DataFrame` with the columns:
+            + course - the short "name" for the course e.g. "programming-101"
+            + run - the run number
+            + start_date - the date the run started
+            + active - `True` if the run is "active"
+            + cache_expiry - if `dataset` is given, the time before which the 
+              dataset in the cache is downloaded again, `NaT` if it never is
 
-        if run_df.empty:
+        :param string dataset:
+            The name of a dataset e.g. "enrolments", to calculate the cache
+            expiry for. Defaults to `None`.
+
+        :return:
+            The runs in a `pandas.DataFrame`.
+        """
+        runs_df = self.runs[["course", "run", "start_date"]].copy()
+        runs_df["active"] = _are_runs_active(runs_df["start_date"])
+        if dataset is not None:
+            runs_df["cache_expiry"] = _calc_cache_expiries(dataset, runs_df["active"])
+        return runs_df
+
+    def _get_run(self, course, run):
+        # the (start date, status, active until) of a run, loading the runs builds the index
+        if self._run_index is None:
+            self.runs
+        try:
+            return self._run_index[(course, int(run))]
+        except (KeyError, ValueError, TypeError):
             raise CourseRunNotFound("The course run does not exist. {}.{}".format(course, run))
+
+    def _get_course_runs(self, course):
+        # the run numbers of a course, in order
+        if self._course_runs is None:
+            self.runs
+        return self._course_runs.get(course, [])
+
+    def _get_prefetch_tasks(self, courses, datasets, ahead):
+        # the (course, run, dataset, active, refresh_before) of the datasets which need refreshing in 
+        # priority order, refresh_before is the time the dataset must have been fetched since
+        status_df = self.get_runs_active_status()
+        if courses is not None:
+            status_df = status_df[status_df["course"].isin(courses)]
+
+        entries_df = self._cache_manager.list_entries(organisation=self._organisation)
+        entries_df = entries_df[entries_df["course"].notna()]
+        # the times are naive local times, converted to epoch seconds using python datetimes
+        # as pandas treats naive times as UTC
+        fetched = {(course, int(run), dataset): fetched_at.to_pydatetime().timestamp() for course, run, dataset, fetched_at in zip(
+            entries_df["course"], entries_df["run"], entries_df["dataset"], entries_df["fetched_at"])}
+
+        # datasets recorded as missing aren't downloaded again until missing_ttl has passed
+        availability_df = self._cache_manager.get_availability(organisation=self._organisation)
+        checked_since = datetime.now() - timedelta(seconds=self._cache_manager.missing_ttl)
+        missing = {(course, int(run), dataset) for course, run, dataset, available, checked_at in zip(
+            availability_df["course"], availability_df["run"], availability_df["dataset"], 
+            availability_df["available"], availability_df["checked_at"]) 
+            if not available and pd.notna(course) and checked_at > checked_since}
+
+        tasks = []
+        for dataset in datasets:
+            expiries = _calc_cache_expiries(dataset, status_df["active"])
+            for course, run, active, expiry in zip(status_df["course"], status_df["run"], status_df["active"], expiries):
+                if (course, int(run), dataset) in missing:
+                    continue
+                fetched_at = fetched.get((course, int(run), dataset))
+                if pd.isna(expiry):
+                    # the dataset never expires, it is only downloaded if it isn't in the cache
+                    if fetched_at is not None:
+                        continue
+                    refresh_before = 0
+                else:
+                    refresh_before = (expiry.to_pydatetime() + timedelta(seconds=ahead)).timestamp()
+                    if fetched_at is not None and fetched_at >= refresh_before:
+                        continue
+                
+                tasks.append((fetched_at, (course, int(run), dataset, bool(active), refresh_before)))
+
+        # active runs, then enrolments, then the datasets fetched longest ago
+        tasks.sort(key=lambda task: (not task[1][3], task[1][2] != "enrolments", task[0] or 0))
+        return [task for fetched_at, task in tasks]
+
+    def _refresh_dataset(self, course, run, dataset, active, refresh_before):
+        # download a dataset to the cache unless it has been fetched since refresh_before
+        keys = (self._organisation, course, run, dataset)
+        with self._cache_manager.lock(*keys):
+            entry = self._cache_manager.get_entry(*keys)
+            if entry is not None and entry["fetched_at"] >= refresh_before:
+                return "fresh"
+
+            try:
+                download = self._download_dataset(course, run, dataset)
+            except LinkNotFoundError:
+                return "not found"
+
+            if download is None:
+                return "not modified"
+            self._load_dataset(download, course, run, dataset)
+            return "refreshed"
+
+    def _get_dataset_source(self, course, run, dataset):
+        # where the data for a run's dataset will come from - "cache", "download" or "not available"
+        keys = (self._organisation, course, run, dataset)
+        if self._cache_manager.is_missing(*keys):
+            return "not available"
+
+        expiry = self._calc_cache_expiry(dataset, self.get_run_active_status(course, run))
+        if self._cache_manager.is_fresh(*keys, expiry=expiry):
+            return "cache"
+        return "download"
+
+    def _query_dataset(self, course, run, dataset, columns, filters):
+        # get the columns and rows of a run's dataset which match the filters, None if the run has 
+        # no dataset. the rows are filtered as the cache file is read or, if the dataset needs 
+        # downloading, a chunk at a time as it is read
+        keys = (self._organisation, course, run, dataset)
+        expiry = self._calc_cache_expiry(dataset, self.get_run_active_status(course, run))
+
+        df = self._cache_manager.get_data(*keys, expiry=expiry, columns=columns, filters=filters)
+        if df is not None:
+            return df
+
+        try:
+            dfs = [_select_columns(_filter_data_frame(chunk, filters), columns) for chunk in self.iter_dataset(course, run, dataset)]
+        except LinkNotFoundError:
+            return None
+
+        if len(dfs) == 0:
+            return None
+        return _concat(dfs, dataset)
+
+    def _get_or_download(self, keys, expiry, download):
+        # get data from the cache or, if it isn't there, call download to get it. only one thread 
+        # or process downloads the data for the keys at a time, the others wait for it to finish
+        # and read the data it saved to the cache
+        df = self._cache_manager.get_data(*keys, expiry=expiry)
+        if df is None:
+            with self._cache_manager.lock(*keys):
+                df = self._cache_manager.get_data(*keys, expiry=expiry)
+                if df is None:
+                    df = download()
+        return df
+
+    def _iter_download_once(self, keys, expiry, chunksize):
+        # download a dataset a chunk at a time holding the lock for its keys (see _get_or_download).
+        # the chunks are parsed once, written to the cache and spooled to a temporary file which 
+        # they are returned from after the lock is released, so other threads and processes 
+        # aren't blocked while they are used
+        if not self._cache_manager.use_cache:
+            # nothing is shared, use the chunks as they are downloaded
+            return self._iter_download(self._download_dataset(*keys[1:]), keys, chunksize)
+
+        # if the cache file is removed before it is read (e.g. by another process) the 
+        # dataset is downloaded once more
+        for attempt in range(2):
+            with self._cache_manager.lock(*keys):
+                if attempt > 0 or not self._cache_manager.is_fresh(*keys, expiry=expiry):
+                    download = self._download_dataset(*keys[1:])
+                    if download is not None:
+                        spool_path = _spool_chunks(self._iter_download(download, keys, chunksize))
+                        return _iter_spooled_chunks(spool_path)
+
+            chunks = self._cache_manager.iter_data(*keys, chunksize=chunksize)
+            if chunks is not None:
+                return chunks
+
+        raise FileNotFoundError("The cache file for {} was removed while it was being read.".format("_".join(str(key) for key in keys)))
+
+    def _append_new_rows(self, df, url, course, run, dataset, validators):
+        # add the rows which aren't already in the cache
+        cached_df = self._cache_manager.get_data(self._organisation, course, run, dataset)
+        new_df = _new_rows(cached_df, df, INCREMENTAL_DATASETS[dataset])
+
+        if new_df is None:
+            # the rows couldn't be compared or cached rows have changed, replace the cached data
+            self._cache_manager.save_data(df, self._organisation, course, run, dataset, url=url, **validators)
+            return df
         
-        # calculate the date the run expires
-        start_date = run_df.iloc[0]["start_date"]
-        start_date = datetime.strptime(start_date, "%Y-%m-%d")
-        expired_date = start_date + timedelta(seconds=COURSE_RUN_INACTIVE_AFTER)
+        if len(new_df) == 0:
+            self._cache_manager.touch(self._organisation, course, run, dataset, etag=validators["etag"], last_modified=validators["last_modified"])
+            return cached_df
+
+        self._cache_manager.append_data(new_df, self._organisation, course, run, dataset, **validators)
+        return apply_schema(pd.concat([cached_df, new_df], ignore_index=True), dataset)
+
+    def _load_dataset(self, download, course, run, dataset):
+        # read a dataset downloaded by _download_dataset and add it to the cache
+        if download is None:
+            # the data hasn't changed, use the cache
+            return self._cache_manager.get_data(self._organisation, course, run, dataset)
+
+        url, path, validators, entry = download
+        try:
+            with metrics.span("parse", url) as span:
+                df = _read_dataset_file(path, course, run, dataset)
+                span.rows = len(df)
+        finally:
+            os.remove(path)
+
+        if self._incremental and entry is not None and dataset in INCREMENTAL_DATASETS:
+            df = self._append_new_rows(df, url, course, run, dataset, validators)
+        else:
+            self._cache_manager.save_data(df, self._organisation, course, run, dataset, url=url, **validators)
+
+        return df
+
+    def _download_dataset(self, course, run, dataset):
+        # downloads a dataset to a temporary file, returning the url, the file path, the 
+        # validators to store in the cache and the cache entry. None is returned if the 
+        # data hasn't changed since it was cached
+        url = DATASET_URLS[dataset].format(course=course, run=run, dataset=dataset)
+        keys = (self._organisation, course, run, dataset)
+
+        # don't request datasets which weren't available when they were last requested
+        if self._cache_manager.is_missing(*keys):
+            print("not available - {}_{}_{}_{}".format(self._organisation, course, run, dataset))
+            metrics.count("not available")
+            raise LinkNotFoundError()
+
+        print("downloading   - {}_{}_{}_{}".format(self._organisation, course, run, dataset))
+
+        # if the data is in the cache but has expired, only download it again if it has changed
+        entry = self._cache_manager.get_entry(*keys)
+        try:
+            response, path, content_hash = self._with_login(lambda: self._download_to_file(url, headers=_conditional_headers(entry)))
+        except LinkNotFoundError:
+            self._cache_manager.mark_missing(*keys)
+            raise
+
+        if entry is not None and (response.status_code == 304 or content_hash == entry["content_hash"]):
+            if self._cache_manager.has_data(*keys):
+                print("not modified  - {}_{}_{}_{}".format(self._organisation, course, run, dataset))
+                metrics.count("not modified")
+                if path is not None:
+                    os.remove(path)
+                self._cache_manager.touch(*keys, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+                return None
+
+        if response.status_code == 304:
+            # the cached data couldn't be used, download it all again
+            response, path, content_hash = self._download_to_file(url)
+
+        validators = dict(content_hash=content_hash, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+        return url, path, validators, entry
+
+    def _iter_download(self, download, keys, chunksize):
+        # read a downloaded dataset in chunks, writing each one to the cache
+        url, path, validators, entry = download
+        writer = self._cache_manager.open_writer(*keys, url=url, **validators)
+        try:
+            for chunk in metrics.iter_spans("parse", _iter_dataset_file(path, keys[1], keys[2], keys[3], chunksize), url):
+                writer.write(chunk)
+                yield chunk
+            writer.close()
+        finally:
+            writer.abort()
+            os.remove(path)
+
+    def _download_to_file(self, url, headers=None):
+        # stream the url to a temporary file, returning the response, the file path and a hash of the content
+        # the file path and hash are None if the response is 304 not modified
+        def download():
+            with metrics.span("http", url) as span:
+                response = self._open(url, headers=headers, stream=True)
+                if response.status_code == 304:
+                    response.close()
+                    return response, None, None
+                
+                content_hash = hashlib.sha256()
+                file_descriptor, path = tempfile.mkstemp(suffix=".download", dir=self._cache_manager.cache_directory)
+                try:
+                    with os.fdopen(file_descriptor, "wb") as file:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            content_hash.update(chunk)
+                            file.write(chunk)
+                            span.bytes += len(chunk)
+                except:
+                    os.remove(path)
+                    raise
+                finally:
+                    response.close()
+
+            try:
+                _check_dataset_file(path)
+            except NeedToLoginException:
+                os.remove(path)
+                raise
+
+            return response, path, content_hash.hexdigest()
+
+        return self._retry_policy.call(download, url)
+
+    def _get_dataset_for_runs(self, course_runs, dataset):
+        # gets the dataset for a list of (course, run) pairs, returning a list
+        # of data frames in the same order, None if the run has no dataset
+        def get_dataset_for_run(course_run):
+            try:
+                return self.get_dataset(course_run[0], course_run[1], dataset)
+            except LinkNotFoundError:
+                return None
+
+        return self._map(get_dataset_for_run, course_runs)
+
+    def _map(self, func, items):
+        # call func for each item, using a pool of threads if there is more than 1 worker
+        # the results are always returned in the same order as the items
+        if self._max_workers > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                return list(executor.map(func, items))
+        else:
+            return list(map(func, items))
+
+    def _get_session(self):
+        # each worker thread has its own session which shares the cookie jar, 
+        # headers and connection adapters of the logged in browser
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.cookies = self._browser.session.cookies
+            session.headers.update(self._browser.session.headers)
+            for prefix, adapter in self._browser.session.adapters.items():
+                session.mount(prefix, adapter)
+            self._local.session = session
+        return session
+
+    def _open(self, url, headers=None, stream=False):
+        # the session is used directly rather than the browser, which parses every
+        # page with BeautifulSoup (slow for large pages) and reads the whole response
+        if threading.current_thread() is self._thread:
+            session = self._browser.session
+        else:
+            session = self._get_session()
         
-        return datetime.now() < expired_date
+        response = session.get(url, headers=headers, stream=stream)
+        if self._browser.raise_on_404 and response.status_code == 404:
+            response.close()
+            raise LinkNotFoundError()
+        return self._check_response(response)
+
+    def _check_response(self, response):
+        # raise an error for responses which should be retried
+        try:
+            self._retry_policy.check_response(response)
+        except Exception:
+            response.close()
+            raise
+        return response
 
     def _get_futurelearn_page(self, url):
+        def open_page():
+            with metrics.span("http", url) as span:
+                response = self._open(url)
+                span.bytes = len(response.content)
+            return response
+
+        def get_page():
+            response = self._retry_policy.call(open_page, url)
+
+            # does the form contain a link to sign in? if so..  They need to sign in
+            if FUTURELEARN_URL + "/sign-in" in response.text:
+                raise NeedToLoginException("Failed to login to FutureLearn. Is your username and password correct?")
+
+            return response
+
         # open the url
         try:
-            response = self._browser.open(url)
+            return self._with_login(get_page)
         except LinkNotFoundError as error:
             print(error)
             raise NeedToLoginException("A mechanicalsoup.LinkNotFoundError was raised for URL {}. Does this organisation/course/run exist?".format(url))
 
-        # does the form contain a link to sign in? if so..  They need to sign in
-        if "https://www.futurelearn.com/sign-in" in response.text:
-            raise NeedToLoginException("Failed to login to FutureLearn. Is your username and password correct?")
-        
-        return response
+    def _with_login(self, func):
+        # call func, if FutureLearn asks to sign in (e.g. the stored session has
+        # expired) login again and call it once more. only browsers created by 
+        # login can login again.
+        login_count = self._login_count
+        try:
+            return func()
+        except NeedToLoginException:
+            if not hasattr(self._browser, "fl_credentials"):
+                raise
 
-    def _calc_cache_expiry(self, dataset, active):
-        # the cache expiry is in 12 hours before now (i.e. any cache older than 12 hours will be refreshed)
-        # unless the run is no longer active and its not the enrolments data (which is always refreshed)
-        if (dataset != "enrolments" and not active):
-            expiry = None
-        else:
-            expiry = datetime.now() - timedelta(seconds=CACHE_EXPIRY_TIME)
+            # if many threads need to login, only the first does
+            with self._login_lock:
+                if self._login_count == login_count:
+                    relogin(self._browser)
+                    self._login_count += 1
+
+            return func()
 
-        return expiry
+    def _calc_cache_expiry(self, dataset, active):
+        return _calc_cache_expiry(dataset, active)
 
-def download_data(organisation, courses, datasets=None, directory=".", use_cache=True):
+def download_data(organisation, courses, datasets=None, directory=".", use_cache=True, max_workers=1, cache_format="csv", cache_compression=None, max_cache_size=None, cache_layout="flat", metrics_path=None):
     """
     Downloads dataset data for all runs of a course and saves to a CSV file(s).
 
@@ -501,11 +1080,34 @@ def download_data(organisation, courses, datasets=None, directory=".", use_cache
 
     :param string datasets :
         The list of dataset names of the dataset e.g. ["enrolments", "step_activity"]. If `None` (the default) all datasets will be downloaded.
+
+    :param integer max_workers:
+        The number of course runs to download at the same time. Defaults to `1`.
+
+    :param string cache_format:
+        The format cache files are stored in, "csv" (default) or "parquet".
+
+    :param string cache_compression:
+        The compression used for cache files, "gzip" or "zstd". Defaults to `None`.
+
+    :param integer max_cache_size:
+        The maximum number of bytes used by the cache files. Defaults to `None`.
+
+    :param string cache_layout:
+        How the cache files are stored, "flat" (default) or "partitioned".
+
+    :param string metrics_path:
+        The path of a JSON file to write the time taken by each stage of the
+        download to, see :class:`Metrics`. Defaults to `None`.
     
     :return:
         Returns a list of file paths containing the downloaded data.
     """
-    fl = FutureLearnData(organisation, use_cache=use_cache, max_retries=1)
+    # only the work done by this download is reported
+    since = metrics.snapshot()
+
+    fl = FutureLearnData(organisation, use_cache=use_cache, max_retries=1, max_workers=max_workers, cache_format=cache_format, 
+        cache_compression=cache_compression, max_cache_size=max_cache_size, cache_layout=cache_layout)
     
     files = []
 
@@ -530,7 +1132,9 @@ def download_data(organisation, courses, datasets=None, directory=".", use_cache
                
                 try:
                     dataset_df = fl.get_dataset_for_course(course, dataset)
-                    dataset_df.to_csv(file_path, mode="a", header=first_course, index=False)
+                    with metrics.span("write", file_path) as span:
+                        to_csv(dataset_df, file_path, mode="a", header=first_course)
+                        span.rows = len(dataset_df)
                     files.append(file_path)
 
                     first_course = False
@@ -540,4 +1144,182 @@ def download_data(organisation, courses, datasets=None, directory=".", use_cache
         else:
             raise DatasetNotKnownException()
 
+    metrics.log_summary(since)
+    if metrics_path is not None:
+        metrics.export_json(metrics_path, since)
+
     return files
+
+
+def _active_until(start_dates):
+    # a run is active until COURSE_RUN_INACTIVE_AFTER after its start date
+    return pd.to_datetime(start_dates) + pd.Timedelta(seconds=COURSE_RUN_INACTIVE_AFTER)
+
+def _are_runs_active(start_dates):
+    return _active_until(start_dates) > datetime.now()
+
+def _index_runs(runs_df):
+    # index the runs by (course, run) and the runs of each course, so they can be 
+    # looked up without searching the data frame
+    active_until = _active_until(runs_df["start_date"]).to_list()
+    run_index = {}
+    course_runs = {}
+    for course, run, start_date, status, until in zip(
+            runs_df["course"].to_list(), runs_df["run"].to_list(), runs_df["start_date"].to_list(), runs_df["status"].to_list(), active_until):
+        run_index[(course, int(run))] = (start_date, status, until)
+        course_runs.setdefault(course, []).append(int(run))
+
+    for runs in course_runs.values():
+        runs.sort()
+
+    return run_index, course_runs
+
+def _inactive_runs(organisation, run_index):
+    # the (organisation, course, run) of the runs in a run index which are no longer active
+    now = datetime.now()
+    return {(organisation, course, run) for (course, run), (start_date, status, active_until) in run_index.items() if not now < active_until}
+
+def _calc_cache_expiries(dataset, active):
+    # _calc_cache_expiry for a series of run active statuses
+    expiry = pd.Timestamp(datetime.now() - timedelta(seconds=CACHE_EXPIRY_TIME))
+    if dataset == "enrolments":
+        return pd.Series(expiry, index=active.index)
+    return pd.Series(expiry, index=active.index).where(active.astype(bool))
+
+def _calc_cache_expiry(dataset, active):
+    # the cache expiry is in 12 hours before now (i.e. any cache older than 12 hours will be refreshed)
+    # unless the run is no longer active and its not the enrolments data (which is always refreshed)
+    if (dataset != "enrolments" and not active):
+        expiry = None
+    else:
+        expiry = datetime.now() - timedelta(seconds=CACHE_EXPIRY_TIME)
+
+    return expiry
+
+def _conditional_headers(entry):
+    # create the headers to only download the data if it has changed since it was cached
+    headers = {}
+    if entry is not None:
+        if entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"] is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def _new_rows(cached_df, df, key_columns):
+    # returns the rows in df which aren't in cached_df, or None if they can't be compared or
+    # rows in cached_df have changed or been removed, so only appending new rows would be wrong
+    if cached_df is None or list(cached_df.columns) != list(df.columns) or not set(key_columns).issubset(df.columns):
+        return None
+
+    # compare whole rows using a hash of their values, which treats missing values as equal
+    cached_hashes = pd.util.hash_pandas_object(cached_df, index=False)
+    is_unchanged = pd.util.hash_pandas_object(df, index=False).isin(cached_hashes).to_numpy()
+    if is_unchanged.sum() != len(cached_df):
+        return None
+
+    new_df = df[~is_unchanged]
+    cached_keys = pd.MultiIndex.from_frame(cached_df[key_columns])
+    if pd.MultiIndex.from_frame(new_df[key_columns]).isin(cached_keys).any():
+        # a row in the cache has new values
+        return None
+
+    return new_df
+
+def _parse_page(parse, url, *args):
+    # parse a downloaded page into a data frame, timing it as the parse stage
+    with metrics.span("parse", url) as span:
+        df = parse(*args)
+        span.rows = len(df)
+    return df
+
+def _concat(dfs, dataset):
+    # combine the data frames of a dataset's runs
+    with metrics.span("concat", dataset) as span:
+        df = apply_schema(pd.concat(dfs, ignore_index=True), dataset)
+        span.rows = len(df)
+    return df
+
+def _read_dataset_file(path, course, run, dataset):
+    _check_dataset_file(path)
+    
+    df = read_csv(path, dataset)
+
+    return _add_course_run(df, course, run, dataset)
+
+def _spool_chunks(chunks):
+    # write data frames to a temporary file, returning its path
+    file_descriptor, path = tempfile.mkstemp(suffix=".spool")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            for chunk in chunks:
+                pickle.dump(chunk, file, protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def _iter_spooled_chunks(path):
+    # read the data frames written by _spool_chunks, removing the file when they have been read
+    try:
+        with open(path, "rb") as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+    finally:
+        os.remove(path)
+
+def _iter_dataset_file(path, course, run, dataset, chunksize):
+    _check_dataset_file(path)
+
+    for df in read_csv(path, dataset, chunksize=chunksize):
+        yield _add_course_run(df, course, run, dataset)
+
+def _add_course_run(df, course, run, dataset):
+    # add the course and run columns
+    df.insert(0, "course", course)
+    df.insert(1, "run", run)
+
+    return apply_schema(df, dataset)
+
+def _check_dataset_file(path):
+    # has a html page been returned? if so, you need to login
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        if _is_html(file.read(1024)):
+            raise NeedToLoginException()
+
+def _is_html(data):
+    data = data.lstrip().lower()
+    return data.startswith("<!doctype html") or data.startswith("<html")
+
+def prune_cache(cache_directory=None, max_size=None, policy="lru"):
+    """
+    Removes entries from a cache directory until its files use no more than
+    `max_size` bytes, see :meth:`CacheManager.prune`. Runs which are no 
+    longer active are found using the runs of each organisation in the cache.
+
+    :param string cache_directory:
+        The cache directory, if `None` (default) the directory ~/.fl-data-dl-cache
+
+    :param integer max_size:
+        The maximum number of bytes. If `None` (default) only files left by
+        downloads which didn't finish are removed.
+
+    :param string policy:
+        "lru" (least recently used, default) or "lfu" (least frequently used).
+
+    :return:
+        A dictionary of the number of `entries` and `files` removed and the 
+        number of `bytes` reclaimed.
+    """
+    cache_manager = CacheManager(cache_directory, True, memory_cache=False)
+
+    inactive_runs = set()
+    for organisation in cache_manager.list_entries(dataset="runs")["organisation"]:
+        runs_df = cache_manager.get_data(organisation, "runs")
+        if runs_df is not None:
+            inactive_runs |= _inactive_runs(organisation, _index_runs(runs_df)[0])
+
+    return cache_manager.prune(max_size=max_size, policy=policy, inactive_runs=inactive_runs)
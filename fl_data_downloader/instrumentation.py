@@ -0,0 +1,278 @@
+import json
+import logging
+import threading
+
+import pandas as pd
+
+from contextlib import contextmanager
+from time import perf_counter, time
+
+# spans are logged at debug level and summaries at info level
+logger = logging.getLogger("fl_data_downloader")
+
+# the stages timed when downloading and caching data
+STAGES = ["login", "http", "parse", "cache read", "cache write", "concat", "write"]
+
+class Span():
+    """
+    The timing of one stage of work, e.g. downloading a dataset, passed to
+    the hooks added using :meth:`Metrics.add_hook`.
+
+    :param string stage:
+        The name of the stage e.g. "http" or "cache read".
+
+    :param string key:
+        What the work was for e.g. a url or cache key.
+    """
+    def __init__(self, stage, key=None):
+        self.stage = stage
+        self.key = key
+        # the number of bytes and rows processed, set by the code being timed
+        self.bytes = 0
+        self.rows = 0
+        self.started_at = time()
+        self.duration = None
+        self.error = None
+
+    def to_dict(self):
+        """
+        Returns the span as a dictionary which can be written as JSON.
+        """
+        return {
+            "stage": self.stage,
+            "key": self.key,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "bytes": self.bytes,
+            "rows": self.rows,
+            "error": None if self.error is None else repr(self.error),
+        }
+
+class Metrics():
+    """
+    Records how long each stage of downloading and caching data takes and
+    how many bytes and rows it processes, as well as counters e.g. the
+    number of requests retried.
+
+    The stages are "login", "http", "parse", "cache read", "cache write",
+    "concat" and "write". Each span is logged to the
+    "fl_data_downloader" logger at debug level and passed to any hooks.
+
+    The metrics for the process are in `fl_data_downloader.metrics`::
+
+        from fl_data_downloader import FutureLearnData, metrics
+
+        fl = FutureLearnData("raspberry-pi")
+        fl.get_dataset_for_course("programming-101", "enrolments")
+
+        print(metrics.get_summary())
+        metrics.export_json("metrics.json")
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # stage -> [count, seconds, bytes, rows, errors]
+        self._stages = {}
+        self._counters = {}
+        self._hooks = []
+
+    @contextmanager
+    def span(self, stage, key=None):
+        """
+        Times the code in a `with` block as a stage. The :class:`Span`
+        returned can be used to record the bytes and rows processed::
+
+            with metrics.span("parse", key) as span:
+                df = pd.read_csv(path)
+                span.rows = len(df)
+        """
+        span = Span(stage, key)
+        start = perf_counter()
+        try:
+            yield span
+        except BaseException as error:
+            span.error = error
+            raise
+        finally:
+            span.duration = perf_counter() - start
+            self._record(span)
+
+    def iter_spans(self, stage, iterator, key=None):
+        """
+        Times getting each item from an iterator of data frames as a stage,
+        recording the rows in each.
+        """
+        iterator = iter(iterator)
+        while True:
+            span = Span(stage, key)
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except BaseException as error:
+                span.error = error
+                span.duration = perf_counter() - start
+                self._record(span)
+                raise
+
+            span.duration = perf_counter() - start
+            span.rows = len(item)
+            self._record(span)
+            yield item
+
+    def count(self, name, value=1):
+        """
+        Adds `value` to a counter e.g. "retries".
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_hook(self, hook):
+        """
+        Adds a function which is called with each :class:`Span` when it
+        ends, e.g. to send the timings to a monitoring system.
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """
+        Removes a function added using `add_hook`.
+        """
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def snapshot(self):
+        """
+        Returns a copy of the metrics, which can be passed to `get_summary`
+        and `get_counters` to only include the work done since.
+        """
+        with self._lock:
+            return {"stages": {stage: list(values) for stage, values in self._stages.items()}, "counters": dict(self._counters)}
+
+    def get_summary(self, since=None):
+        """
+        Returns the number of spans, seconds, bytes, rows and errors of each
+        stage and the throughput in MB and rows a second (`None` for stages
+        which don't process bytes or rows), as a `pandas.DataFrame`.
+
+        :param dict since:
+            A snapshot returned by `snapshot`, only the work done since is
+            included. If `None` (default) all the work is included.
+        """
+        stages = self._get_stages(since)
+        rows = []
+        for stage in sorted(stages, key=_stage_order):
+            count, seconds, byte_count, row_count, errors = stages[stage]
+            rows.append((stage, count, seconds, byte_count, row_count, errors,
+                byte_count / 1024 / 1024 / seconds if seconds > 0 and byte_count > 0 else None,
+                row_count / seconds if seconds > 0 and row_count > 0 else None))
+        return pd.DataFrame(rows, columns=["stage", "count", "seconds", "bytes", "rows", "errors", "mb_per_second", "rows_per_second"])
+
+    def get_counters(self, since=None):
+        """
+        Returns the counters as a dictionary e.g. `{"retries": 2}`.
+
+        :param dict since:
+            A snapshot returned by `snapshot`, only the counts since are
+            included. If `None` (default) all the counts are included.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+        if since is not None:
+            counters = {name: value - since["counters"].get(name, 0) for name, value in counters.items()}
+        return {name: value for name, value in counters.items() if value != 0}
+
+    def to_dict(self, since=None):
+        """
+        Returns the summary and counters as a dictionary which can be written
+        as JSON.
+        """
+        summary_df = self.get_summary(since)
+        return {
+            "exported_at": time(),
+            "stages": [{column: _to_json_value(value) for column, value in row.items()} for row in summary_df.to_dict("records")],
+            "counters": self.get_counters(since),
+        }
+
+    def export_json(self, path, since=None):
+        """
+        Writes the summary and counters to a JSON file, e.g. for a
+        monitoring system to collect.
+
+        :param string path:
+            The path of the file to write.
+
+        :param dict since:
+            A snapshot returned by `snapshot`, only the work done since is
+            included. If `None` (default) all the work is included.
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_dict(since), file, indent=2)
+
+    def log_summary(self, since=None):
+        """
+        Prints the summary and logs it to the "fl_data_downloader" logger at
+        info level.
+        """
+        summary_df = self.get_summary(since)
+        lines = ["{:<12} {:>6} {:>9} {:>10} {:>10} {:>8} {:>6}".format("stage", "count", "secs", "MB", "rows", "MB/s", "errors")]
+        for stage, count, seconds, byte_count, rows, mb_per_second, errors in zip(summary_df["stage"], summary_df["count"], summary_df["seconds"],
+            summary_df["bytes"], summary_df["rows"], summary_df["mb_per_second"], summary_df["errors"]):
+            lines.append("{:<12} {:>6} {:>9.2f} {:>10.2f} {:>10} {:>8} {:>6}".format(
+                stage, count, seconds, byte_count / 1024 / 1024, rows, "" if pd.isna(mb_per_second) else "{:.2f}".format(mb_per_second), errors))
+        for name, value in sorted(self.get_counters(since).items()):
+            lines.append("{:<12} {:>6}".format(name, value))
+
+        print("\n".join(lines))
+        logger.info("summary\n%s", "\n".join(lines))
+
+    def reset(self):
+        """
+        Removes all the recorded metrics, hooks are kept.
+        """
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+
+    def _get_stages(self, since):
+        with self._lock:
+            stages = {stage: list(values) for stage, values in self._stages.items()}
+        if since is not None:
+            for stage, values in since["stages"].items():
+                if stage in stages:
+                    stages[stage] = [value - since_value for value, since_value in zip(stages[stage], values)]
+        return {stage: values for stage, values in stages.items() if values[0] > 0}
+
+    def _record(self, span):
+        with self._lock:
+            values = self._stages.setdefault(span.stage, [0, 0.0, 0, 0, 0])
+            values[0] += 1
+            values[1] += span.duration
+            values[2] += span.bytes
+            values[3] += span.rows
+            values[4] += 0 if span.error is None else 1
+            hooks = list(self._hooks)
+
+        logger.debug("%s - %s %.3fs %d bytes %d rows", span.stage, span.key, span.duration, span.bytes, span.rows)
+
+        for hook in hooks:
+            try:
+                hook(span)
+            except Exception:
+                # a broken hook shouldn't stop data being downloaded
+                logger.exception("metrics hook %r failed", hook)
+
+def _stage_order(stage):
+    return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+def _to_json_value(value):
+    # numpy numbers and NaN can't be written as JSON
+    if pd.isna(value):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+# the metrics for the process
+metrics = Metrics()
@@ -0,0 +1,105 @@
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# the thread locks for each lock file, so threads in a process wait for each other before locking the file
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+class FileLock():
+    """
+    A lock shared by the threads and processes using a lock file, so only
+    one of them can do something (e.g. download a dataset) at a time. The
+    file is locked using `fcntl.flock` or, on Windows, `msvcrt.locking`, so
+    the lock is released if a process stops while holding it.
+
+    Can be used as a context manager::
+
+        with FileLock("/tmp/download.lock"):
+            ...
+
+    :param string path:
+        The path of the lock file, it is created if it doesn't exist.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+        with _thread_locks_lock:
+            if path not in _thread_locks:
+                _thread_locks[path] = threading.Lock()
+            self._thread_lock = _thread_locks[path]
+
+    def acquire(self):
+        """
+        Waits until the lock is free and takes it.
+        """
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, "a+b")
+            _lock_file(self._file)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        """
+        Releases the lock, it can be released by a different thread to the
+        one which took it.
+        """
+        try:
+            _unlock_file(self._file)
+            self._file.close()
+        finally:
+            self._file = None
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class NullLock():
+    """
+    A lock which does nothing, used when there is no cache to share.
+    """
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+def _lock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    else:
+        # LK_LOCK tries for 10 seconds before raising an error, keep trying until the lock is free
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+
+def _unlock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,129 @@
+import html
+import re
+
+import numpy as np
+import pandas as pd
+
+from .schemas import DATE_FORMAT
+
+# matches a run on the organisation's admin runs page, which is laid out as
+#   <a class="course-meta__title" href="/admin/courses/[course]/[run]">[full name]</a>
+#   4 lines
+#   <span class="flag flag--[status]">[status]</span>
+#   1 line
+#   <td data-order='[start date]'>
+RUN_PATTERN = re.compile(
+    r"course-meta__title[^\n]*?/courses/([^/\n]+)/(\d+)\">([^\n]*?)</a>[^\n]*\n"
+    r"(?:[^\n]*\n){4}"
+    r"[^\n]*?flag--[^>\n]*>([^<\n]*)<[^\n]*\n"
+    r"[^\n]*\n"
+    r"[^\n]*?data-order=['\"]([^'\"\n]*)['\"]")
+
+RUNS_COLUMNS = ["course", "full_name", "run", "start_date", "status"]
+
+# the types of step on a run's overview page, the text in the step's admin
+# url and the code shown after the step number e.g. 
+#   <a href="/admin/video-articles/2841923">1.2</a> ... VI
+STEP_TYPES = [
+    ("video-articles", "video-articles", "VI"),
+    ("discussions", "discussions", "DI"),
+    ("articles", "articles", "AR"),
+    ("quizzes", "quizzes", "QU"),
+    ("exercises", "exercises", "EX"),
+    ("assignments", "assignments", "AS"),
+    ("assignment_reviews", "assignment_reviews", "RV"),
+    ("assignment_reflections", "assignment_reflections", "RE"),
+    ("poll_articles", "poll-articles", "PL"),
+    ("audio_articles", "audio-articles", "AU"),
+]
+
+# matches any type of step in a single pass, capturing the url text, the step's
+# admin id, the week and the step number. the code must be on the same line.
+STEP_PATTERN = re.compile(
+    "/(" + "|".join(re.escape(url) + r"(?=/[^\n]*?" + code + ")" for key, url, code in STEP_TYPES) + ")"
+    r"/(\d+)[^\d\n]+(\d+)[^\d\n]+(\d+)")
+
+STEP_KEYS = {url: key for key, url, code in STEP_TYPES}
+
+STEPS_COLUMNS = ["course", "run", "step_id", "week", "step", "admin_url", "step_type"]
+
+def parse_runs_page(content):
+    """
+    Parses the organisation's admin runs page, returning a `pandas.DataFrame`
+    with the course, full_name, run, start_date and status of each run.
+
+    :param bytes content:
+        The html of the page.
+    """
+    matches = RUN_PATTERN.findall(content.decode("utf-8", errors="replace"))
+
+    # build the columns with the types in the schema, converting the whole
+    # data frame afterwards costs more than parsing a page of 100 runs
+    if len(matches) > 0:
+        courses, runs, full_names, statuses, start_dates = zip(*matches)
+    else:
+        courses, runs, full_names, statuses, start_dates = (), (), (), (), ()
+
+    df = pd.DataFrame({
+        "course": _to_categorical(courses),
+        "full_name": pd.array([html.unescape(full_name) for full_name in full_names], dtype="string"),
+        "run": np.array(runs, dtype="int32"),
+        "start_date": _to_dates(start_dates),
+        "status": _to_categorical(statuses),
+        }, columns=RUNS_COLUMNS)
+
+    return df
+
+def _to_categorical(values):
+    # the same as pandas.Categorical(values), which is slow enough to be most
+    # of the time taken to parse a typical page
+    categories = sorted(set(values))
+    codes = {category: code for code, category in enumerate(categories)}
+    return pd.Categorical.from_codes([codes[value] for value in values], dtype=pd.CategoricalDtype(categories))
+
+def _to_dates(dates):
+    # numpy parses iso dates much quicker than pandas, which is only used if
+    # a date isn't in the expected format
+    try:
+        return np.array(dates, dtype="datetime64[us]")
+    except ValueError:
+        return pd.to_datetime(pd.Series(dates, dtype=object), format=DATE_FORMAT, errors="coerce")
+
+def parse_steps_page(content, course, run):
+    """
+    Parses a run's admin overview page, returning a `pandas.DataFrame` with
+    the step_id, week, step, admin_url and step_type of each step.
+
+    :param bytes content:
+        The html of the page.
+
+    :param string course:
+        The online course e.g. "programming-101"
+
+    :param integer run:
+        The number of the course run
+    """
+    matches = STEP_PATTERN.findall(content.decode("utf-8", errors="replace"))
+
+    # build the columns rather than rows, which is much quicker for pandas
+    if len(matches) > 0:
+        urls, admin_ids, weeks, steps = zip(*matches)
+    else:
+        urls, admin_ids, weeks, steps = (), (), (), ()
+    keys = [STEP_KEYS[url] for url in urls]
+    weeks = np.array(weeks, dtype="int32")
+    steps = np.array(steps, dtype="int32")
+
+    # the columns are created with the types in the schema, as converting the
+    # data frame afterwards costs more than parsing a typical page
+    df = pd.DataFrame({
+        "course": _to_categorical([course] * len(keys)),
+        "run": np.full(len(keys), run, dtype="int32"),
+        "step_id": pd.array(["{}.{:02d}".format(week, step) for week, step in zip(weeks.tolist(), steps.tolist())], dtype="string"),
+        "week": pd.array(weeks, dtype="Int32"),
+        "step": pd.array(steps, dtype="Int32"),
+        "admin_url": pd.array(["https://www.futurelearn.com/admin/{}/{}".format(key, admin_id) for key, admin_id in zip(keys, admin_ids)], dtype="string"),
+        "step_type": _to_categorical([key[:-1] for key in keys]),
+        }, columns=STEPS_COLUMNS)
+
+    return df
@@ -0,0 +1,241 @@
+import os
+import threading
+
+from queue import Queue
+from mechanicalsoup import LinkNotFoundError
+
+from .data import FutureLearnData, AVAILABLE_DATASETS
+from .exceptions import DatasetNotKnownException
+from .instrumentation import metrics
+from .sinks import CsvSink
+
+# put on a queue to tell the stage reading from it there is no more work
+_DONE = object()
+
+def download_all(organisation, courses=None, datasets=None, sink=None, download_workers=4, parse_workers=2, queue_size=16, use_cache=True, cache_directory=None, cache_format="csv", browser=None, 
+    cache_compression=None, max_cache_size=None, cache_layout="flat", metrics_path=None):
+    """
+    Downloads datasets for all runs of many courses, writing them to a sink.
+
+    The work is split into 3 stages which run at the same time, connected by
+    queues - downloading, parsing the downloaded data (and saving it to the
+    cache) and writing it to the sink - so waiting for the network, parsing
+    CSV and writing the data overlap.
+
+    Example, download all the datasets for all the courses of an organisation
+    to CSV files in the "data" directory::
+
+        from fl_data_downloader import download_all, CsvSink
+
+        download_all("raspberry-pi", sink=CsvSink("data"))
+
+    :param string organisation:
+        The organisation to download data for e.g. "raspberry-pi"
+
+    :param List courses:
+        A list of course names e.g. `["programming-101", "embedded-systems"]`.
+        If `None` (default) all the organisation's courses are downloaded.
+
+    :param List datasets:
+        The list of dataset names e.g. ["enrolments", "step_activity"]. If
+        `None` (default) all datasets are downloaded.
+
+    :param sink:
+        An object with `write(dataset, data_frame)` and `close()` methods
+        which the data for each run is written to. Defaults to a `CsvSink`
+        writing to the current directory.
+
+    :param integer download_workers:
+        The number of runs downloaded at the same time, defaults to `4`.
+
+    :param integer parse_workers:
+        The number of downloaded runs parsed at the same time, defaults to `2`.
+
+    :param integer queue_size:
+        The maximum number of runs waiting between each stage, defaults to `16`.
+
+    :param boolean use_cache:
+        Whether to use the cache. Defaults to `True`.
+
+    :param string cache_directory:
+        The directory to use for storing cache files. If `None` (default)
+        the directory ~/.fl-data-dl-cache
+
+    :param string cache_format:
+        The format cache files are stored in, "csv" (default) or "parquet".
+
+    :param Browser browser:
+        A browser object returned by the `fl_data_downloader.login` function.
+        If `None` (default) the login function will be called.
+
+    :param string cache_compression:
+        The compression used for cache files, "gzip" or "zstd". Defaults to `None`.
+
+    :param integer max_cache_size:
+        The maximum number of bytes used by the cache files. Defaults to `None`.
+
+    :param string cache_layout:
+        How the cache files are stored, "flat" (default) or "partitioned".
+
+    :param string metrics_path:
+        The path of a JSON file to write the time taken by each stage of the
+        download to, see :class:`Metrics`. Defaults to `None`.
+
+    :return:
+        The sink.
+    """
+    if datasets is None:
+        datasets = AVAILABLE_DATASETS
+
+    for dataset in datasets:
+        if dataset not in AVAILABLE_DATASETS:
+            raise DatasetNotKnownException("[{}] is not a valid dataset".format(dataset))
+
+    if sink is None:
+        sink = CsvSink()
+
+    # only the work done by this download is reported
+    since = metrics.snapshot()
+
+    fl = FutureLearnData(organisation, browser=browser, use_cache=use_cache, cache_directory=cache_directory, cache_format=cache_format, 
+        cache_compression=cache_compression, max_cache_size=max_cache_size, cache_layout=cache_layout)
+
+    # load the runs before the workers start
+    runs_df = fl.runs
+    if courses is None:
+        courses = runs_df["course"].drop_duplicates().sort_values().to_list()
+
+    def tasks():
+        for dataset in datasets:
+            for course in courses:
+                for run in fl._get_course_runs(course):
+                    yield course, run, dataset
+
+    def download(task):
+        course, run, dataset = task
+        expiry = fl._calc_cache_expiry(dataset, fl.get_run_active_status(course, run))
+        if fl._cache_manager.is_fresh(organisation, course, run, dataset, expiry=expiry):
+            return task, None, None
+
+        # the lock is held until the data is saved to the cache by the parse stage, so
+        # other processes using the cache wait for it rather than downloading it too
+        lock = fl._cache_manager.lock(organisation, course, run, dataset)
+        lock.acquire()
+        try:
+            if fl._cache_manager.is_fresh(organisation, course, run, dataset, expiry=expiry):
+                lock.release()
+                return task, None, None
+            return task, fl._download_dataset(course, run, dataset), lock
+        except LinkNotFoundError:
+            # the dataset doesn't exist for this run
+            lock.release()
+            return None
+        except BaseException:
+            lock.release()
+            raise
+
+    def parse(item):
+        (course, run, dataset), download, lock = item
+        try:
+            df = fl._load_dataset(download, course, run, dataset)
+        finally:
+            if lock is not None:
+                lock.release()
+        if df is not None:
+            return dataset, df
+
+    def discard(item):
+        # remove the downloaded file and release the lock of an item which won't be parsed
+        (course, run, dataset), download, lock = item
+        try:
+            if download is not None and download[1] is not None and os.path.exists(download[1]):
+                os.remove(download[1])
+        finally:
+            if lock is not None:
+                lock.release()
+
+    errors = []
+    download_queue = Queue(maxsize=queue_size)
+    parse_queue = Queue(maxsize=queue_size)
+    write_queue = Queue(maxsize=queue_size)
+
+    producer = threading.Thread(target=_produce, args=(tasks(), download_queue, errors), daemon=True)
+    producer.start()
+
+    threads = [producer]
+    threads += _start_stage(download, download_queue, parse_queue, download_workers, errors)
+    threads += _start_stage(parse, parse_queue, write_queue, parse_workers, errors, discard=discard)
+
+    # the sink is written to by this thread
+    while True:
+        item = write_queue.get()
+        if item is _DONE:
+            break
+        if len(errors) == 0:
+            try:
+                with metrics.span("write", item[0]) as span:
+                    sink.write(*item)
+                    span.rows = len(item[1])
+            except Exception as error:
+                errors.append(error)
+
+    for thread in threads:
+        thread.join()
+
+    sink.close()
+
+    metrics.log_summary(since)
+    if metrics_path is not None:
+        metrics.export_json(metrics_path, since)
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    return sink
+
+def _produce(tasks, out_queue, errors):
+    for task in tasks:
+        if len(errors) > 0:
+            break
+        out_queue.put(task)
+    out_queue.put(_DONE)
+
+def _start_stage(func, in_queue, out_queue, workers, errors, discard=None):
+    # start the worker threads for a stage, which call func with each item from
+    # the in_queue and put the result on the out_queue. when all the workers
+    # have finished, _DONE is put on the out_queue. discard is called with the
+    # items which aren't processed after an error.
+    def work():
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                # put it back for the other workers
+                in_queue.put(_DONE)
+                return
+
+            # after an error, keep emptying the queue so the other stages don't block
+            if len(errors) > 0:
+                if discard is not None:
+                    discard(item)
+                continue
+
+            try:
+                result = func(item)
+                if result is not None:
+                    out_queue.put(result)
+            except Exception as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    def finish():
+        for thread in threads:
+            thread.join()
+        out_queue.put(_DONE)
+
+    finisher = threading.Thread(target=finish, daemon=True)
+    finisher.start()
+
+    return threads + [finisher]
@@ -0,0 +1,203 @@
+import pandas as pd
+
+from .schemas import apply_schema, get_schema, DATETIME
+from .instrumentation import metrics
+
+class Between():
+    """
+    Filters a column to the values from `start` up to, but not including,
+    `end`, see :func:`between`.
+    """
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "between({!r}, {!r})".format(self.start, self.end)
+
+def between(start=None, end=None):
+    """
+    Returns a filter for :meth:`DatasetQuery.where` which matches the values
+    from `start` up to, but not including, `end` e.g. the step activity for
+    the first week of January::
+
+        fl.query("step_activity").where(first_visited_at=between(datetime(2020, 1, 6), datetime(2020, 1, 13)))
+
+    :param start:
+        The lowest value, `None` for no lower limit.
+
+    :param end:
+        The value the values must be less than, `None` for no upper limit.
+    """
+    return Between(start, end)
+
+class DatasetQuery():
+    """
+    A lazy query of a dataset for the runs of an organisation's courses,
+    returned by :meth:`FutureLearnData.query`.
+
+    Nothing is read or downloaded until `to_data_frame` or
+    `iter_data_frames` is called. Then only the runs which match the query
+    are read, and the columns and rows are filtered as each run's cache
+    file is read (or as it is downloaded), so the memory used depends on the
+    size of the result rather than the size of the dataset.
+
+    Example, the step activity in week 1 of runs 3 and 4 of 2 courses::
+
+        fl = FutureLearnData("raspberry-pi")
+        query = fl.query("step_activity").where(
+            course=["programming-101", "programming-102"],
+            run=[3, 4],
+            columns=["course", "run", "learner_id", "step", "last_completed_at"],
+            week_number=1)
+        df = query.to_data_frame()
+
+    :param FutureLearnData fl:
+        The `FutureLearnData` object used to read and download the data.
+
+    :param string dataset:
+        The name of the dataset e.g. "step_activity"
+    """
+    def __init__(self, fl, dataset, courses=None, runs=None, columns=None, filters=()):
+        self._fl = fl
+        self.dataset = dataset
+        self.courses = courses
+        self.runs = runs
+        self.columns = columns
+        self.filters = tuple(filters)
+
+    def where(self, course=None, run=None, columns=None, **filters):
+        """
+        Returns a new query narrowed to some runs, columns or rows. Calling
+        `where` on the query returned narrows it further.
+
+        Any other keyword arguments filter the rows using the value of a
+        column:
+            + a value - the rows where the column is the value e.g. `week_number=1`
+            + a list, tuple or set - the rows where the column is one of the
+              values e.g. `step=["1.1", "1.2"]`
+            + `between(start, end)` - the rows where the column is from
+              `start` up to, but not including, `end`
+
+        Datetimes without a timezone are treated as UTC.
+
+        :param course:
+            A course name or list of course names e.g. `"programming-101"`.
+
+        :param run:
+            A run number or list of run numbers.
+
+        :param List columns:
+            The columns to return e.g. `["learner_id", "step"]`.
+
+        :return:
+            A :class:`DatasetQuery`.
+        """
+        courses = self.courses
+        if course is not None:
+            courses = _intersect(courses, _to_list(course))
+
+        runs = self.runs
+        if run is not None:
+            runs = _intersect(runs, [int(run) for run in _to_list(run)])
+
+        if columns is not None:
+            columns = list(columns)
+        else:
+            columns = self.columns
+
+        return DatasetQuery(self._fl, self.dataset, courses=courses, runs=runs, columns=columns,
+            filters=self.filters + tuple(_to_filters(filters, self.dataset)))
+
+    def get_runs(self):
+        """
+        Returns the `(course, run)` of the runs the query reads, in order.
+        """
+        courses = self.courses
+        if courses is None:
+            courses = list(dict.fromkeys(self._fl.runs["course"]))
+
+        course_runs = []
+        for course in courses:
+            course_runs += [(course, run) for run in self._fl._get_course_runs(course) if self.runs is None or run in self.runs]
+        return course_runs
+
+    def plan(self):
+        """
+        Returns how the data for each run will be got, without reading or
+        downloading it, as a `pandas.DataFrame` with the columns course,
+        run and source, which is "cache", "download" or "not available"
+        (the dataset wasn't found for the run when it was last requested).
+        """
+        return pd.DataFrame(
+            [(course, run, self._fl._get_dataset_source(course, run, self.dataset)) for course, run in self.get_runs()],
+            columns=["course", "run", "source"])
+
+    def iter_data_frames(self):
+        """
+        Returns an iterator of the data for each run as a `pandas.DataFrame`,
+        only one run's data is held in memory at a time. Runs which don't
+        have the dataset are skipped.
+        """
+        for course, run in self.get_runs():
+            df = self._read_run((course, run))
+            if df is not None:
+                yield df
+
+    def to_data_frame(self):
+        """
+        Returns the data for all the runs as a `pandas.DataFrame`, or `None`
+        if no run has the dataset. `max_workers` runs are read or downloaded
+        at the same time.
+        """
+        dfs = [df for df in self._fl._map(self._read_run, self.get_runs()) if df is not None]
+        if len(dfs) == 0:
+            return None
+
+        with metrics.span("concat", self.dataset) as span:
+            df = apply_schema(pd.concat(dfs, ignore_index=True), self.dataset)
+            span.rows = len(df)
+        return df
+
+    def _read_run(self, course_run):
+        return self._fl._query_dataset(course_run[0], course_run[1], self.dataset, self.columns, list(self.filters))
+
+    def __repr__(self):
+        return "DatasetQuery({!r}, courses={!r}, runs={!r}, columns={!r}, filters={!r})".format(
+            self.dataset, self.courses, self.runs, self.columns, list(self.filters))
+
+def _to_list(value):
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+def _intersect(values, new_values):
+    # the values in both lists, in the order of the first, if there is no first list the new values
+    if values is None:
+        return new_values
+    return [value for value in values if value in new_values]
+
+def _to_filters(filters, dataset):
+    # convert the keyword filters of where to (column, operator, value) tuples
+    schema = get_schema(dataset)
+    converted = []
+    for column, value in filters.items():
+        convert = _to_utc if schema.get(column) == DATETIME else lambda value: value
+        if isinstance(value, Between):
+            if value.start is not None:
+                converted.append((column, ">=", convert(value.start)))
+            if value.end is not None:
+                converted.append((column, "<", convert(value.end)))
+        elif isinstance(value, (list, tuple, set)):
+            converted.append((column, "in", [convert(item) for item in value]))
+        else:
+            converted.append((column, "==", convert(value)))
+
+    return converted
+
+def _to_utc(value):
+    # datetime columns are read as UTC, so the values they are compared with must be too
+    value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.tz_localize("UTC")
+    return value.tz_convert("UTC").to_pydatetime()
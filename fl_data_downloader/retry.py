@@ -0,0 +1,214 @@
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from requests.exceptions import ConnectionError, ChunkedEncodingError, Timeout, HTTPError
+
+from .exceptions import ConnectionErrorMaxRetriesExceeded
+from .instrumentation import metrics
+
+# the response status codes which are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket():
+    """
+    Limits the rate of requests. Each request takes a token from the bucket,
+    which is refilled at `rate` tokens a second up to `capacity` tokens, so
+    short bursts of requests are allowed.
+
+    :param float rate:
+        The number of requests a second, `None` for no limit.
+
+    :param integer capacity:
+        The maximum number of requests which can be made at once.
+    """
+    def __init__(self, rate=None, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token from the bucket, returning the number of seconds to
+        wait before making the request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, 0)
+
+            if self.rate is not None:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # the tokens can go negative, the requests queue up behind each other
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+
+            return wait
+
+    def acquire(self):
+        """
+        Takes a token from the bucket, waiting until it is available.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stops any tokens being taken for a number of seconds, used when the
+        server asks for requests to slow down.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+class RetryPolicy():
+    """
+    Decides when failed requests are retried and limits the rate requests
+    are made to each host.
+
+    Requests which fail with a connection error, a timeout or a 429 / 5xx
+    status are retried after an exponentially increasing delay, with random
+    jitter so workers don't retry at the same time. If the server sends a
+    `Retry-After` header, it is waited for and, for a 429 status, all requests
+    to the host are paused.
+
+    Example, retry up to 5 times and make no more than 2 requests a second::
+
+        from fl_data_downloader import FutureLearnData, RetryPolicy
+
+        fl = FutureLearnData("raspberry-pi", retry_policy=RetryPolicy(max_retries=5, rate=2))
+
+    :param integer max_retries:
+        The maximum number of times to try a request. Defaults to `3`.
+
+    :param float backoff:
+        The number of seconds to wait before the first retry, doubled for
+        each retry after. Defaults to `1`.
+
+    :param float max_backoff:
+        The maximum number of seconds to wait between retries. Defaults to `60`.
+
+    :param boolean jitter:
+        Whether to randomise the delay between retries. Defaults to `True`.
+
+    :param float rate:
+        The maximum number of requests a second to each host. If `None`
+        (default) the rate isn't limited.
+
+    :param integer burst:
+        The number of requests which can be made at once when limiting the
+        rate. Defaults to `1`.
+
+    :param tuple retry_statuses:
+        The response status codes which are retried.
+    """
+    def __init__(self, max_retries=3, backoff=1, max_backoff=60, jitter=True, rate=None, burst=1, retry_statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst
+        self.retry_statuses = retry_statuses
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def call(self, func, url):
+        """
+        Calls `func` to make a request to `url`, retrying if it fails. `func`
+        should raise a `requests.HTTPError` for a response with a status
+        which should be retried.
+        """
+        attempt = 0
+        while True:
+            self.get_bucket(url).acquire()
+            try:
+                return func()
+            except (ConnectionError, ChunkedEncodingError, Timeout, HTTPError) as error:
+                status, retry_after = None, None
+                if isinstance(error, HTTPError):
+                    if error.response is None or error.response.status_code not in self.retry_statuses:
+                        raise
+                    status = error.response.status_code
+                    retry_after = error.response.headers.get("Retry-After")
+
+                attempt += 1
+                delay = self.get_delay(attempt, url, status, retry_after)
+                print("error         - {} - retrying in {:.1f} secs".format(error, delay))
+                time.sleep(delay)
+
+    def get_delay(self, attempt, url, status=None, retry_after=None):
+        """
+        Returns the number of seconds to wait before retrying a request which
+        has failed `attempt` times. A `ConnectionErrorMaxRetriesExceeded` 
+        exception is raised if it shouldn't be retried.
+
+        :param integer attempt:
+            The number of times the request has failed.
+
+        :param string url:
+            The url of the request.
+
+        :param integer status:
+            The status of the response, `None` if there was a connection error.
+
+        :param string retry_after:
+            The value of the response's `Retry-After` header.
+        """
+        if attempt >= self.max_retries:
+            if status is None:
+                raise ConnectionErrorMaxRetriesExceeded("ConnectionError occurred. Max number of retries exceeded.")
+            raise ConnectionErrorMaxRetriesExceeded("HTTP status {} returned. Max number of retries exceeded.".format(status))
+
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = random.uniform(delay / 2, delay)
+
+        retry_after = _parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            if status == 429:
+                # slow down all the requests to the host
+                self.get_bucket(url).pause(delay)
+
+        metrics.count("retries")
+        return delay
+
+    def get_bucket(self, url):
+        """
+        Returns the :class:`TokenBucket` which limits the requests to the
+        host of a url.
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def check_response(self, response):
+        """
+        Raises a `requests.HTTPError` if the response has a status which
+        should be retried.
+        """
+        if response.status_code in self.retry_statuses:
+            raise HTTPError("{} {}".format(response.status_code, response.reason), response=response)
+
+def _parse_retry_after(value):
+    # Retry-After is either a number of seconds or a date
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,291 @@
+import pandas as pd
+
+# the type used for columns which contain dates and times
+DATETIME = "datetime"
+
+# the type used for columns which contain dates without a time
+DATE = "date"
+
+# the format FutureLearn uses for dates and times e.g. "2020-01-06 10:03:14 UTC"
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+# the format FutureLearn uses for dates e.g. "2020-01-06"
+DATE_FORMAT = "%Y-%m-%d"
+
+# the columns added to every dataset
+COMMON_SCHEMA = {
+    "course": "category",
+    "run": "int32",
+}
+
+# the types of the columns in each dataset, columns which are not listed are
+# inferred by pandas. ids are strings and low cardinality columns categories.
+DATASET_SCHEMAS = {
+    "archetype_survey_responses": {
+        "id": "Int64",
+        "learner_id": "string",
+        "responded_at": DATETIME,
+        "archetype": "category",
+    },
+    "campaigns": {},
+    "comments": {
+        "id": "Int64",
+        "author_id": "string",
+        "parent_id": "Int64",
+        "step": "string",
+        "week_number": "Int32",
+        "step_number": "Int32",
+        "text": "string",
+        "timestamp": DATETIME,
+        "moderated": DATETIME,
+        "likes": "Int32",
+    },
+    "countries": {},
+    "country-subdivisions": {},
+    "enrolments": {
+        "learner_id": "string",
+        "enrolled_at": DATETIME,
+        "unenrolled_at": DATETIME,
+        "role": "category",
+        "fully_participated_at": DATETIME,
+        "purchased_statement_at": DATETIME,
+        "gender": "category",
+        "country": "category",
+        "age_range": "category",
+        "highest_education_level": "category",
+        "employment_status": "category",
+        "employment_area": "category",
+        "detected_country": "category",
+    },
+    "leaving_survey_responses": {
+        "id": "Int64",
+        "learner_id": "string",
+        "left_at": DATETIME,
+        "leaving_reason": "category",
+        "last_completed_step_at": DATETIME,
+        "last_completed_step": "string",
+        "last_completed_week_number": "Int32",
+        "last_completed_step_number": "Int32",
+    },
+    "peer_review_assignments": {
+        "id": "Int64",
+        "step": "string",
+        "week_number": "Int32",
+        "step_number": "Int32",
+        "author_id": "string",
+        "text": "string",
+        "first_viewed_at": DATETIME,
+        "submitted_at": DATETIME,
+        "moderated": DATETIME,
+        "review_count": "Int32",
+    },
+    "peer_review_reviews": {
+        "id": "Int64",
+        "step": "string",
+        "week_number": "Int32",
+        "step_number": "Int32",
+        "reviewer_id": "string",
+        "assignment_id": "Int64",
+        "guideline_one_feedback": "string",
+        "guideline_two_feedback": "string",
+        "guideline_three_feedback": "string",
+        "created_at": DATETIME,
+    },
+    "post_course_survey_data": {},
+    "post_course_survey_free_text": {},
+    "question_response": {
+        "learner_id": "string",
+        "quiz_question": "string",
+        "question_type": "category",
+        "week_number": "Int32",
+        "step_number": "Int32",
+        "question_number": "Int32",
+        "response": "string",
+        "cloze_response": "string",
+        "submitted_at": DATETIME,
+    },
+    "step_activity": {
+        "learner_id": "string",
+        "step": "string",
+        "week_number": "Int32",
+        "step_number": "Int32",
+        "first_visited_at": DATETIME,
+        "last_completed_at": DATETIME,
+    },
+    "team_members": {
+        "id": "string",
+        "first_name": "string",
+        "last_name": "string",
+        "team_role": "category",
+        "user_role": "category",
+    },
+    "video_stats": {
+        "step_position": "string",
+        "title": "string",
+    },
+    "weekly_sentiment_survey_responses": {
+        "id": "Int64",
+        "responded_at": DATETIME,
+        "week_number": "Int32",
+        "experience_rating": "Int32",
+        "reason": "string",
+    },
+    "runs": {
+        "full_name": "string",
+        "start_date": DATE,
+        "status": "category",
+    },
+    "steps-for-run": {
+        "step_id": "string",
+        "week": "Int32",
+        "step": "Int32",
+        "admin_url": "string",
+        "step_type": "category",
+    },
+}
+
+# the columns which identify a row in each dataset within a run, datasets which
+# are not listed have no natural key
+PRIMARY_KEYS = {
+    "archetype_survey_responses": ["id"],
+    "comments": ["id"],
+    "enrolments": ["learner_id"],
+    "leaving_survey_responses": ["id"],
+    "peer_review_assignments": ["id"],
+    "peer_review_reviews": ["id"],
+    "question_response": ["learner_id", "quiz_question", "submitted_at"],
+    "step_activity": ["learner_id", "step"],
+    "team_members": ["id"],
+    "weekly_sentiment_survey_responses": ["id"],
+    "steps-for-run": ["step_id"],
+}
+
+def get_schema(dataset):
+    """
+    Returns the column types for a dataset as a dictionary of column names
+    to types. Columns which contain dates and times have the type "datetime"
+    and columns which contain dates the type "date".
+
+    :param string dataset:
+        The name of the dataset e.g. "enrolments"
+    """
+    schema = dict(COMMON_SCHEMA)
+    schema.update(DATASET_SCHEMAS.get(dataset, {}))
+    return schema
+
+def read_csv(path, dataset, **kwargs):
+    """
+    Reads a dataset csv file using the column types for the dataset. Any
+    keyword arguments are passed to `pandas.read_csv`.
+
+    If `chunksize` is passed, an iterator of data frames is returned.
+    """
+    dtypes = {column: column_type for column, column_type in get_schema(dataset).items() if column_type not in (DATETIME, DATE)}
+
+    if "chunksize" in kwargs:
+        return _read_csv_chunks(path, dataset, dtypes, **kwargs)
+
+    position = _tell(path)
+    try:
+        df = pd.read_csv(path, dtype=dtypes, **kwargs)
+    except (ValueError, TypeError):
+        # the data doesn't match the schema, let pandas infer the types
+        _seek(path, position)
+        df = pd.read_csv(path, **kwargs)
+
+    return apply_schema(df, dataset)
+
+def to_csv(df, path, **kwargs):
+    """
+    Writes a dataset to a csv file with the dates and times in the format
+    FutureLearn uses e.g. "2020-01-06 10:03:14 UTC", so the file matches
+    the downloaded data. Any keyword arguments are passed to 
+    `pandas.DataFrame.to_csv`.
+    """
+    columns = {column: _format_datetime(df[column]) for column in df.columns if isinstance(df[column].dtype, pd.DatetimeTZDtype)}
+    if len(columns) > 0:
+        df = df.assign(**columns)
+    df.to_csv(path, index=False, **kwargs)
+
+def apply_schema(df, dataset):
+    """
+    Converts the columns of a data frame to the types for the dataset.
+    Columns which can't be converted are left unchanged.
+    """
+    for column, column_type in get_schema(dataset).items():
+        if column not in df.columns:
+            continue
+
+        if column_type == DATETIME:
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = _to_datetime(df[column])
+
+        elif column_type == DATE:
+            if not pd.api.types.is_datetime64_any_dtype(df[column]):
+                df[column] = _to_date(df[column])
+
+        elif str(df[column].dtype) != column_type:
+            try:
+                df[column] = df[column].astype(column_type)
+            except (ValueError, TypeError):
+                pass
+
+    return df
+
+def _read_csv_chunks(path, dataset, dtypes, **kwargs):
+    position = _tell(path)
+    rows = 0
+    try:
+        with pd.read_csv(path, dtype=dtypes, **kwargs) as reader:
+            for df in reader:
+                df = apply_schema(df, dataset)
+                rows += len(df)
+                yield df
+    except (ValueError, TypeError):
+        # the data doesn't match the schema, read it again letting pandas infer the types
+        # and skip the rows which have already been returned
+        _seek(path, position)
+        with pd.read_csv(path, **kwargs) as reader:
+            for df in reader:
+                if rows >= len(df):
+                    rows -= len(df)
+                    continue
+                df = apply_schema(df.iloc[rows:], dataset)
+                rows = 0
+                yield df
+
+def _tell(path):
+    # the position of a file object, so it can be read again, None for a path
+    if hasattr(path, "seek") and path.seekable():
+        return path.tell()
+
+def _seek(path, position):
+    if position is not None:
+        path.seek(position)
+
+def _to_datetime(series):
+    try:
+        return pd.to_datetime(series, format=DATETIME_FORMAT, utc=True)
+    except (ValueError, TypeError):
+        pass
+
+    # the dates aren't in the FutureLearn format (e.g. they have been cached) so let pandas work it out
+    try:
+        return pd.to_datetime(series, utc=True)
+    except (ValueError, TypeError):
+        return series
+
+def _format_datetime(series):
+    # the times are converted to UTC so the "UTC" time zone name is written
+    return series.dt.tz_convert("UTC").dt.strftime(DATETIME_FORMAT)
+
+def _to_date(series):
+    try:
+        return pd.to_datetime(series, format=DATE_FORMAT)
+    except (ValueError, TypeError):
+        pass
+
+    try:
+        return pd.to_datetime(series)
+    except (ValueError, TypeError):
+        return series
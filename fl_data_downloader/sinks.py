@@ -0,0 +1,293 @@
+import hashlib
+import os
+import sqlite3
+
+import pandas as pd
+from datetime import datetime
+
+from .schemas import PRIMARY_KEYS, to_csv
+
+# the columns which are indexed in database tables, as they are often used to filter data
+INDEX_COLUMNS = ["learner_id", "step", "author_id"]
+
+# the table which records the runs which have been written to a database
+LOADED_RUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loaded_runs (
+    dataset TEXT NOT NULL,
+    course TEXT NOT NULL,
+    run INTEGER NOT NULL,
+    content_hash TEXT,
+    rows INTEGER,
+    loaded_at TEXT,
+    PRIMARY KEY (dataset, course, run)
+)
+"""
+
+class CsvSink():
+    """
+    Writes the data for each dataset to a CSV file, named
+    `[yyyy-mm-dd-hh-mm-ss]_[dataset].csv`, in a directory.
+
+    Used with :func:`download_all`::
+
+        from fl_data_downloader import download_all, CsvSink
+
+        sink = download_all("raspberry-pi", sink=CsvSink("data"))
+        print(sink.files)
+
+    :param string directory:
+        The directory to write the files to, defaults to the current directory.
+    """
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.files = {}
+        self._timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+
+    def write(self, dataset, data_frame):
+        """
+        Appends a data frame to the file for the dataset.
+        """
+        if dataset not in self.files:
+            file_path = os.path.join(self.directory, "{}_{}.csv".format(self._timestamp, dataset))
+            print("Filename: {}".format(file_path))
+
+            # delete any old files - belt and braces!
+            if os.path.exists(file_path):
+                print("- deleting old dataset")
+                os.remove(file_path)
+
+            self.files[dataset] = file_path
+            header = True
+        else:
+            header = False
+
+        to_csv(data_frame, self.files[dataset], mode="a", header=header)
+
+    def close(self):
+        pass
+
+class _DatabaseSink():
+    # writes datasets to tables in a database, sub classes set the column TYPES
+    # and implement _connect, _get_columns, _get_primary_key and _insert
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = self._connect(path)
+        self._tables = {}
+        self._execute(LOADED_RUNS_SCHEMA)
+
+    def write(self, dataset, data_frame):
+        """
+        Writes a data frame to the table for the dataset, replacing the rows
+        for each course run in the data frame. Runs whose data hasn't changed
+        since they were last written are skipped.
+
+        The data is written in a single transaction.
+        """
+        if data_frame.empty:
+            return
+
+        if "course" not in data_frame.columns or "run" not in data_frame.columns:
+            raise ValueError("The data for [{}] must have course and run columns".format(dataset))
+
+        self._execute("BEGIN TRANSACTION")
+        try:
+            self._create_table(dataset, data_frame)
+            for (course, run), run_df in data_frame.groupby(["course", "run"], observed=True, sort=False):
+                self._write_run(dataset, str(course), int(run), run_df)
+            self._execute("COMMIT")
+        except Exception:
+            self._execute("ROLLBACK")
+            # any tables created or changed have been rolled back
+            self._tables = {}
+            raise
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self._conn.close()
+
+    def _write_run(self, dataset, course, run, df):
+        content_hash = _hash_data_frame(df)
+        loaded = self._execute(
+            "SELECT content_hash FROM loaded_runs WHERE dataset = ? AND course = ? AND run = ?", 
+            (dataset, course, run)).fetchone()
+
+        if loaded is not None and loaded[0] == content_hash:
+            print("unchanged     - {}_{}_{}".format(course, run, dataset))
+            return
+
+        # rows with the same key would replace each other, or fail to be inserted if the key is missing
+        keys, columns = self._tables[dataset]
+        if len(keys) > 0 and _has_duplicate_keys(df, keys):
+            raise ValueError("The data for [{}_{}_{}] has duplicate or missing values in its key columns ({}), which the table's primary key doesn't allow".format(
+                course, run, dataset, ", ".join(keys)))
+
+        print("writing       - {}_{}_{}".format(course, run, dataset))
+        table = _quote(dataset)
+        self._execute("DELETE FROM {} WHERE course = ? AND run = ?".format(table), (course, run))
+        self._insert("INSERT", table, df)
+
+        self._execute("DELETE FROM loaded_runs WHERE dataset = ? AND course = ? AND run = ?", (dataset, course, run))
+        self._execute("INSERT INTO loaded_runs VALUES (?, ?, ?, ?, ?, ?)",
+            (dataset, course, run, content_hash, len(df), datetime.now().isoformat()))
+
+    def _create_table(self, dataset, df):
+        # create the table for a dataset or add any new columns to it
+        table = _quote(dataset)
+
+        if dataset not in self._tables:
+            columns = self._get_columns(dataset)
+            if columns is None:
+                keys = ["course", "run"] + PRIMARY_KEYS.get(dataset, [])
+                if not all(key in df.columns for key in keys):
+                    keys = ["course", "run"]
+                elif _has_duplicate_keys(df, keys):
+                    print("no key        - {} has duplicate or missing values in its key columns, the table is created without a primary key".format(dataset))
+                    keys = ["course", "run"]
+                has_key = len(keys) > 2
+
+                definitions = ["{} {}".format(_quote(column), self._get_type(df[column])) for column in df.columns]
+                if has_key:
+                    definitions.append("PRIMARY KEY ({})".format(", ".join(_quote(key) for key in keys)))
+                self._execute("CREATE TABLE {} ({})".format(table, ", ".join(definitions)))
+
+                # the primary key indexes course and run if the dataset has one
+                indexes = [[column] for column in INDEX_COLUMNS if column in df.columns]
+                if not has_key:
+                    indexes.insert(0, ["course", "run"])
+
+                for index in indexes:
+                    self._execute("CREATE INDEX {} ON {} ({})".format(
+                        _quote("{}_{}".format(dataset, "_".join(index))), table, ", ".join(_quote(column) for column in index)))
+
+                columns = list(df.columns)
+            else:
+                keys = self._get_primary_key(dataset)
+                has_key = len(keys) > 0
+
+            self._tables[dataset] = (keys if has_key else [], set(columns))
+
+        keys, columns = self._tables[dataset]
+        for column in df.columns:
+            if column not in columns:
+                self._execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, _quote(column), self._get_type(df[column])))
+                columns.add(column)
+
+    def _get_type(self, series):
+        if pd.api.types.is_bool_dtype(series):
+            return self.TYPES["bool"]
+        elif pd.api.types.is_integer_dtype(series):
+            return self.TYPES["int"]
+        elif pd.api.types.is_float_dtype(series):
+            return self.TYPES["float"]
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            return self.TYPES["datetime"]
+        else:
+            return self.TYPES["text"]
+
+    def _execute(self, sql, parameters=()):
+        return self._conn.execute(sql, parameters)
+
+class SqliteSink(_DatabaseSink):
+    """
+    Writes the data for each dataset to a table in a SQLite database.
+
+    Each table is created with column types from the data, a primary key of
+    course, run and the columns which identify a row in the dataset (e.g.
+    `learner_id` for enrolments) and indexes on `learner_id` and `step`.
+    Writing a course run replaces its rows, so the database can be refreshed
+    without duplicating data, and runs which haven't changed are skipped.
+
+    If the data a table is created from has rows with the same key or
+    missing key values, the table is created without a primary key. Writing
+    such a run to a table with a primary key raises a `ValueError`, rather
+    than rows being lost::
+
+        from fl_data_downloader import download_all, SqliteSink
+
+        download_all("raspberry-pi", sink=SqliteSink("all_courses.db"))
+
+    :param string path:
+        The path of the database file, it is created if it doesn't exist.
+    """
+    TYPES = {"bool": "INTEGER", "int": "INTEGER", "float": "REAL", "datetime": "TEXT", "text": "TEXT"}
+
+    def _connect(self, path):
+        # transactions are started and committed by the sink
+        return sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+
+    def _get_columns(self, dataset):
+        columns = [row[1] for row in self._execute("PRAGMA table_info({})".format(_quote(dataset)))]
+        return columns if len(columns) > 0 else None
+
+    def _get_primary_key(self, dataset):
+        # the 6th column of table_info is the position of the column in the primary key, 0 if it isn't in it
+        columns = [(row[5], row[1]) for row in self._execute("PRAGMA table_info({})".format(_quote(dataset))) if row[5] > 0]
+        return [column for position, column in sorted(columns)]
+
+    def _insert(self, verb, table, df):
+        sql = "{} INTO {} ({}) VALUES ({})".format(
+            verb, table, ", ".join(_quote(column) for column in df.columns), ", ".join("?" * len(df.columns)))
+        self._conn.executemany(sql, _iter_rows(df))
+
+class DuckDBSink(_DatabaseSink):
+    """
+    Writes the data for each dataset to a table in a `DuckDB <https://duckdb.org>`_
+    database, see :class:`SqliteSink`. Data frames are loaded directly by 
+    DuckDB rather than row by row, which is much quicker for large datasets.
+
+    Requires `duckdb` (``pip install duckdb``).
+
+    :param string path:
+        The path of the database file, it is created if it doesn't exist.
+    """
+    TYPES = {"bool": "BOOLEAN", "int": "BIGINT", "float": "DOUBLE", "datetime": "TIMESTAMPTZ", "text": "VARCHAR"}
+
+    def _connect(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("DuckDBSink requires duckdb. Install it using: pip install duckdb")
+        return duckdb.connect(path)
+
+    def _get_columns(self, dataset):
+        columns = [row[0] for row in self._execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = ? ORDER BY ordinal_position", 
+            (dataset,)).fetchall()]
+        return columns if len(columns) > 0 else None
+
+    def _get_primary_key(self, dataset):
+        rows = self._execute(
+            "SELECT constraint_column_names FROM duckdb_constraints() WHERE table_name = ? AND constraint_type = 'PRIMARY KEY'", 
+            (dataset,)).fetchall()
+        return list(rows[0][0]) if len(rows) > 0 else []
+
+    def _insert(self, verb, table, df):
+        columns = ", ".join(_quote(column) for column in df.columns)
+        self._conn.register("sink_data", df)
+        try:
+            self._execute("{} INTO {} ({}) SELECT {} FROM sink_data".format(verb, table, columns, columns))
+        finally:
+            self._conn.unregister("sink_data")
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+def _hash_data_frame(df):
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()
+
+def _has_duplicate_keys(df, keys):
+    # are any of the key columns missing or do any rows have the same key
+    return bool(df[keys].isna().any(axis=None)) or bool(df.duplicated(keys).any())
+
+def _iter_rows(df):
+    # convert the values to types sqlite understands, missing values become NULL
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%d %H:%M:%S")
+    df = df.astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
@@ -17,6 +17,11 @@ __desc__ = 'A utility for downloading data set files for all runs of courses on
 __author_email__ = 'martin.ohanlon@raspberrypi.org'
 __url__ = 'https://github.com/raspberrypilearning/fl-data-downloader'
 __requires__ = ["MechanicalSoup", "pandas"]
+__extra_requires__ = {
+    "async": ["aiohttp"],
+    "duckdb": ["duckdb"],
+    "zstd": ["zstandard"],
+}
 __keywords__ = [
     "FutureLearn",
     "MOOC",
@@ -62,6 +67,7 @@ if __name__ == '__main__':
         keywords=__keywords__,
         packages = [__package__],
         install_requires = __requires__,
+        extras_require = __extra_requires__,
         entry_points={
             'console_scripts': [
             'fl-data-dl = fl_data_downloader:fl_data_dl'